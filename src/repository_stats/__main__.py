@@ -1,19 +1,59 @@
 import argparse
+import logging
 import os
+import sys
+import threading
+import time
+from functools import partial
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import List, Optional, Tuple
 
-from github import Github
+from attr import asdict
+from github import Github, GithubException
+from github.Repository import Repository
 
+from repository_stats.batch import (
+    Summarize, build_branch_trees, merged_pull_request_numbers, read_repository_names, summarize_repositories,
+    write_branch_trees, write_ndjson
+)
 from repository_stats.repository_summary import summarize_repository
 from repository_stats.branch_tree import BranchTree
+from repository_stats.commit_store import CommitStore
+from repository_stats.fake_github import FixtureRecorder
+from repository_stats.graphql_summary import summarize_repository_graphql
+from repository_stats.http_cache import DEFAULT_MAX_BYTES, HttpCache
+from repository_stats.live_summary import (
+    DEFAULT_RECONCILE_INTERVAL, LiveSummaryStore, LiveSummaryUpdater, read_events, serve_webhooks
+)
 from repository_stats.logging_setup import setup_logging
+from repository_stats.metrics import MetricsMiddleware, serve_metrics, step, write_metrics
+from repository_stats.profiling import (
+    DEFAULT_SAMPLING_INTERVAL, PROFILE_MODES, profile_stage, start_profiling, stop_profiling
+)
+from repository_stats.pull_request_store import PullRequestStore
+from repository_stats.rate_limit import RateLimitScheduler
+from repository_stats.service import DEFAULT_FIELD_TTLS, RepositoryService, serve
+from repository_stats.tracing import TracingMiddleware, export_trace, span, start_tracing, stop_tracing, write_trace
+from repository_stats.transport import Middleware, install_middlewares
 
 
+_LOGGER = logging.getLogger(__name__)
 _FEATURE_BRANCH = os.getenv('FEATURE_BRANCH')
 _PR_NUMBER = os.getenv('PR_NUMBER')
 _REPOSITORY_NAME = os.getenv('REPOSITORY_NAME')
+_WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
 _BRANCH_DOT_GRAPH = f'branch_{_FEATURE_BRANCH}_graph.dot'
 _LOGGING_FILE = Path(__file__).parent.parent.parent / 'logging.yaml'
+_PER_PAGE = 100
+_CONCURRENCY = 4
+_REQUESTS_PER_SECOND = 10.0
+_BATCH_WORKERS = 4
+_RECONCILE_CHECK_INTERVAL = 60.0
+_SUMMARY_BACKENDS = {
+    'rest': summarize_repository,
+    'graphql': summarize_repository_graphql,
+}
 
 
 def _parse_arguments() -> argparse.Namespace:
@@ -21,13 +61,246 @@ def _parse_arguments() -> argparse.Namespace:
     parser.add_argument('--github-token', type=str, required=True)
     parser.add_argument('--debug-mode', action='store_true')
     parser.add_argument('--log-to-file', action='store_true')
-    return parser.parse_args()
+    parser.add_argument('--async-logging', action='store_true', help='Handle the log records on a background thread.')
+    parser.add_argument('--log-max-bytes', type=int, default=0, help='Rotate the log file from this size in bytes.')
+    parser.add_argument('--log-backup-count', type=int, default=3, help='Number of rotated log files to keep.')
+    parser.add_argument('--backend', choices=_SUMMARY_BACKENDS, default='rest')
+    parser.add_argument('--concurrency', type=int, default=_CONCURRENCY, help='Maximal concurrent fetches.')
+    parser.add_argument(
+        '--requests-per-second', type=float, default=_REQUESTS_PER_SECOND, help='Maximal sustained GitHub request rate.'
+    )
+    parser.add_argument('--repositories', nargs='+', default=[], help='Summarize these repositories as NDJSON.')
+    parser.add_argument('--repositories-file', type=Path, default=None, help='File of repositories to summarize.')
+    parser.add_argument('--batch-workers', type=int, default=_BATCH_WORKERS, help='Repositories summarized at once.')
+    parser.add_argument('--pr-numbers', type=int, nargs='+', default=[], help='Build the trees of these PRs.')
+    parser.add_argument('--merged-since', type=_utc_datetime, default=None, help='Build the trees of PRs merged since.')
+    parser.add_argument('--merged-until', type=_utc_datetime, default=None, help='Upper bound of --merged-since.')
+    parser.add_argument('--output-dir', type=Path, default=Path('.'), help='Output directory of the PRs trees.')
+    parser.add_argument('--local-mirror', type=Path, default=None)
+    parser.add_argument('--commit-store', type=Path, default=None, help='Path of the permanent commit store.')
+    parser.add_argument(
+        '--pull-request-store', type=Path, default=None, help='Path of the incrementally synchronized PRs store.'
+    )
+    parser.add_argument('--http-cache', type=Path, default=None, help='Directory of the persistent HTTP cache.')
+    parser.add_argument('--http-cache-size', type=int, default=DEFAULT_MAX_BYTES, help='HTTP cache size in bytes.')
+    parser.add_argument('--record-fixtures', type=Path, default=None, help='Record the responses for the benchmarks.')
+    parser.add_argument('--metrics-file', type=Path, default=None, help='Write Prometheus metrics to this file.')
+    parser.add_argument('--metrics-port', type=int, default=None, help='Serve Prometheus metrics on this local port.')
+    parser.add_argument('--trace', type=Path, default=None, help='Write an OTLP-JSON trace of the run to this file.')
+    parser.add_argument('--trace-endpoint', type=str, default=None, help='Export the trace to this OTLP/HTTP URL.')
+    parser.add_argument('--profile', choices=PROFILE_MODES, default=None, help='Profile the run stages.')
+    parser.add_argument('--profile-dir', type=Path, default=Path('profiles'), help='Output directory of the profiles.')
+    parser.add_argument(
+        '--profile-interval', type=float, default=DEFAULT_SAMPLING_INTERVAL, help='Stacks sampling interval in seconds.'
+    )
+    parser.add_argument('--serve', type=int, default=None, metavar='PORT', help='Serve the HTTP/JSON API on this port.')
+    parser.add_argument('--serve-host', type=str, default='127.0.0.1', help='Address of the HTTP/JSON API.')
+    parser.add_argument(
+        '--summary-ttl', type=_field_ttl, action='append', default=[], metavar='FIELD=SECONDS',
+        help=f'TTL of a cached summary field, one of {", ".join(DEFAULT_FIELD_TTLS)}.'
+    )
+    parser.add_argument(
+        '--summary-max-stale', type=_field_ttl, action='append', default=[], metavar='FIELD=SECONDS',
+        help='How long a summary field is served stale after its TTL, while it is refreshed in the background.'
+    )
+    parser.add_argument('--branch-tree-ttl', type=float, default=None, help='TTL of the cached branch trees.')
+    parser.add_argument('--live-store', type=Path, default=None, help='Path of the live summaries store.')
+    parser.add_argument('--live-events', type=Path, nargs='+', default=[], help='Apply these recorded events files.')
+    parser.add_argument('--webhook-port', type=int, default=None, help='Receive the webhooks on this local port.')
+    parser.add_argument('--record-events', type=Path, default=None, help='Append the received webhooks to this file.')
+    parser.add_argument(
+        '--poll-events', type=float, default=None, metavar='SECONDS', help='Poll the events feed every SECONDS.'
+    )
+    parser.add_argument(
+        '--reconcile-interval', type=float, default=DEFAULT_RECONCILE_INTERVAL,
+        help='Interval in seconds between the full rescans of the live summaries.'
+    )
+    args = parser.parse_args()
+    # the feed events and the webhook deliveries of the same changes have different ids, both would be applied
+    if args.poll_events is not None and args.webhook_port is not None:
+        parser.error('--poll-events and --webhook-port receive the same events, pass only one of them.')
+    return args
+
+
+def _transport_middlewares(args: argparse.Namespace) -> List[Middleware]:
+    middlewares = []
+    if args.trace is not None or args.trace_endpoint is not None:
+        middlewares.append(TracingMiddleware())
+    if args.record_fixtures is not None:
+        middlewares.append(FixtureRecorder(args.record_fixtures))
+    if args.http_cache is not None:
+        middlewares.append(HttpCache(args.http_cache, max_bytes=args.http_cache_size))
+    middlewares.append(RateLimitScheduler(rate=args.requests_per_second, max_concurrency=2 * args.concurrency))
+    if args.metrics_file is not None or args.metrics_port is not None or args.serve is not None:
+        middlewares.append(MetricsMiddleware())
+    return middlewares
+
+
+def _field_ttl(value: str) -> Tuple[str, float]:
+    name, _, seconds = value.partition('=')
+    if name not in DEFAULT_FIELD_TTLS:
+        raise argparse.ArgumentTypeError(f'Unknown summary field {name}.')
+    return name, float(seconds)
+
+
+def _pull_request_store(args: argparse.Namespace) -> Optional[PullRequestStore]:
+    return None if args.pull_request_store is None else PullRequestStore(args.pull_request_store)
+
+
+def _summary_backend(args: argparse.Namespace) -> Summarize:
+    return partial(_SUMMARY_BACKENDS[args.backend], pull_request_store=_pull_request_store(args))
+
+
+def _utc_datetime(value: str) -> datetime:
+    date = datetime.fromisoformat(value)
+    return date if date.tzinfo is not None else date.replace(tzinfo=timezone.utc)
+
+
+def _pr_numbers(repo: Repository, args: argparse.Namespace) -> List[int]:
+    if args.merged_since is None:
+        return args.pr_numbers
+    merged_until = args.merged_until or datetime.now(timezone.utc)
+    return args.pr_numbers + merged_pull_request_numbers(repo, repo.default_branch, args.merged_since, merged_until)
+
+
+def _repository_names(args: argparse.Namespace) -> List[str]:
+    if args.repositories_file is None:
+        return args.repositories
+    return args.repositories + read_repository_names(args.repositories_file)
+
+
+def _main(args: argparse.Namespace) -> None:
+    if args.metrics_port is not None:
+        serve_metrics(args.metrics_port)
+    if args.trace is not None or args.trace_endpoint is not None:
+        start_tracing()
+    if args.profile is not None:
+        start_profiling(args.profile, args.profile_dir, args.profile_interval)
+    try:
+        with span('repository_stats'):
+            _run(args)
+    finally:
+        stop_profiling()
+        if args.metrics_file is not None:
+            write_metrics(args.metrics_file)
+        _export_trace(args)
+
+
+def _export_trace(args: argparse.Namespace) -> None:
+    tracer = stop_tracing()
+    if tracer is None:
+        return
+    if args.trace is not None:
+        write_trace(tracer, args.trace)
+    if args.trace_endpoint is not None:
+        export_trace(tracer, args.trace_endpoint)
+
+
+def _run(args: argparse.Namespace) -> None:
+    with span('setup_logging'):
+        setup_logging(
+            _LOGGING_FILE, debug_mode=args.debug_mode, log_to_file=args.log_to_file, queued=args.async_logging,
+            max_bytes=args.log_max_bytes, backup_count=args.log_backup_count
+        )
+    install_middlewares(*_transport_middlewares(args))
+    # the rate limit scheduler replaces the PyGithub rate limit retries and fixed delays, including the 1s delay
+    # between writes that PyGithub also applies to the GraphQL queries
+    github = Github(
+        args.github_token, per_page=_PER_PAGE, retry=None, seconds_between_requests=None, seconds_between_writes=None
+    )
+    if args.serve is not None:
+        _serve(github, args)
+        return
+    if args.live_store is not None:
+        _live(github, args)
+        return
+    if args.repositories or args.repositories_file is not None:
+        records = summarize_repositories(
+            github, _repository_names(args), args.batch_workers, args.concurrency, _summary_backend(args)
+        )
+        with profile_stage('summary'):
+            write_ndjson(records, sys.stdout)
+        return
+    with profile_stage('summary'):
+        with step('get_repo'):
+            repo = github.get_repo(_REPOSITORY_NAME)
+        print(_summary_backend(args)(repo, concurrency=args.concurrency))
+    store = None if args.commit_store is None else CommitStore(args.commit_store)
+    if args.pr_numbers or args.merged_since is not None:
+        with profile_stage('branch_tree'):
+            branch_trees = build_branch_trees(repo, _pr_numbers(repo, args), args.concurrency, store)
+        with profile_stage('graph_write'):
+            write_branch_trees(branch_trees, args.output_dir)
+        return
+    with profile_stage('branch_tree'):
+        if args.local_mirror is None:
+            branch_tree = BranchTree.from_github_branch(repo, _FEATURE_BRANCH, int(_PR_NUMBER), store)
+        else:
+            branch_tree = BranchTree.from_local_mirror(
+                repo, _FEATURE_BRANCH, int(_PR_NUMBER), args.local_mirror, args.github_token
+            )
+    with profile_stage('graph_write'):
+        branch_tree.write_graph(Path(_BRANCH_DOT_GRAPH))
+
+
+def _serve(github: Github, args: argparse.Namespace) -> None:
+    service = RepositoryService(
+        github,
+        concurrency=args.concurrency,
+        field_ttls=dict(args.summary_ttl),
+        field_max_stale=dict(args.summary_max_stale),
+        branch_tree_ttl=args.branch_tree_ttl,
+        store=None if args.commit_store is None else CommitStore(args.commit_store),
+        pull_request_store=_pull_request_store(args),
+    )
+    server = serve(service, args.serve, args.serve_host)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+def _live(github: Github, args: argparse.Namespace) -> None:
+    updater = LiveSummaryUpdater(
+        github,
+        LiveSummaryStore(args.live_store),
+        concurrency=args.concurrency,
+        reconcile_interval=args.reconcile_interval,
+        summarize=_summary_backend(args),
+    )
+    names = _repository_names(args) or [_REPOSITORY_NAME]
+    for name in names:
+        updater.reconcile_if_due(name)
+    for path in args.live_events:
+        updater.ingest(read_events(path))
+    if args.webhook_port is None and args.poll_events is None:
+        write_ndjson(({'repository': name, **asdict(updater.summary(name))} for name in names), sys.stdout)
+        return
+    server = None
+    if args.webhook_port is not None:
+        server = serve_webhooks(updater, args.webhook_port, args.serve_host, _WEBHOOK_SECRET, args.record_events)
+        threading.Thread(target=server.serve_forever, name='webhooks', daemon=True).start()
+    try:
+        while True:
+            for name in names:
+                try:
+                    if args.poll_events is None:
+                        updater.reconcile_if_due(name)
+                    else:
+                        updater.poll(name)
+                except GithubException:
+                    _LOGGER.exception('Unable to update the live summary of %s.', name)
+            time.sleep(args.poll_events or _RECONCILE_CHECK_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
 
 
 if __name__ == '__main__':
-    args = _parse_arguments()
-    setup_logging(_LOGGING_FILE, debug_mode=args.debug_mode, log_to_file=args.log_to_file)
-    repo = Github(args.github_token).get_repo(_REPOSITORY_NAME)
-    print(summarize_repository(repo))
-    branch_tree = BranchTree.from_github_branch(repo, _FEATURE_BRANCH, int(_PR_NUMBER))
-    branch_tree.write_graph(Path(_BRANCH_DOT_GRAPH))
+    _main(_parse_arguments())
@@ -0,0 +1,215 @@
+import json
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from attr import asdict
+from github import Github, GithubException
+from github.PullRequest import PullRequest
+from github.Repository import Repository
+
+from repository_stats.branch_tree import BranchTree
+from repository_stats.commit_store import CommitStore
+from repository_stats.commit_utils import (
+    CommitGraph, CommitRecord, compare, get_in_between_commits, get_merge_commit, get_merged_pull_request,
+    get_pull_request_commits
+)
+from repository_stats.context_utils import map_in_context, submit_in_context
+from repository_stats.metrics import step
+from repository_stats.repository_summary import RepositorySummary, summarize_repository
+
+
+_LOGGER = logging.getLogger(__name__)
+Summarize = Callable[..., RepositorySummary]
+_MAX_MAIN_BRANCH_COMMITS = 50_000
+
+
+def read_repository_names(names_file: Path) -> List[str]:
+    """ Reads repository full names from a file, one per line. Empty lines and `#` comments are ignored.
+
+    :param Path names_file: The file of repository names.
+    :returns: The repositories full names.
+    :rtype: List[str]
+    """
+    lines = (line.split('#', 1)[0].strip() for line in names_file.read_text().splitlines())
+    return [line for line in lines if line]
+
+
+def summarize_repositories(
+    github: Github,
+    repository_names: Iterable[str],
+    workers: int = 4,
+    concurrency: int = 1,
+    summarize: Summarize = summarize_repository,
+) -> Iterator[dict]:
+    """ Summarizes many repositories on a bounded pool of workers, sharing the GitHub client.
+
+    All the repositories share the client HTTP session and the installed transport middlewares (e.g. the rate limit
+    scheduler). Yields a record per repository as soon as it completed, in completion order: the repository summary
+    fields, or an `error` if the repository could not be summarized.
+
+    :param Github github: The GitHub client.
+    :param Iterable[str] repository_names: The repositories full names.
+    :param int workers: The maximal number of repositories summarized concurrently.
+    :param int concurrency: The maximal number of concurrent fetches of each repository summary.
+    :param Summarize summarize: The summary backend.
+    :returns: An iterator of summary records.
+    :rtype: Iterator[dict]
+    """
+    def summarize_one(name: str) -> RepositorySummary:
+        return summarize(github.get_repo(name), concurrency=concurrency)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as executor:
+        futures = {submit_in_context(executor, summarize_one, name): name for name in repository_names}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                yield {'repository': name, **asdict(future.result())}
+            except Exception as e:
+                _LOGGER.exception('Unable to summarize repository %s.', name)
+                yield {'repository': name, 'error': str(e)}
+
+
+def write_ndjson(records: Iterable[dict], output: TextIO) -> None:
+    """ Writes records as newline delimited JSON, flushing every record.
+
+    :param Iterable[dict] records: The records to write.
+    :param TextIO output: The output stream.
+    """
+    for record in records:
+        output.write(json.dumps(record) + '\n')
+        output.flush()
+
+
+@step('merged_pull_request_numbers')
+def merged_pull_request_numbers(
+    repo: Repository, base_branch: str, merged_since: datetime, merged_until: datetime
+) -> List[int]:
+    """ Returns the numbers of the pull requests merged into a branch within a time window.
+
+    The closed pull requests are listed by most recently updated, until they were last updated before the window
+    (a pull request is always updated when it is merged).
+
+    :param Repository repo: The repository object.
+    :param str base_branch: The branch the pull requests were merged into.
+    :param datetime merged_since: The start of the merge time window.
+    :param datetime merged_until: The end of the merge time window.
+    :returns: The merged pull requests numbers.
+    :rtype: List[int]
+    """
+    numbers = []
+    for pull_request in repo.get_pulls(state='closed', base=base_branch, sort='updated', direction='desc'):
+        if pull_request.updated_at < merged_since:
+            break
+        if pull_request.merged_at is not None and merged_since <= pull_request.merged_at <= merged_until:
+            numbers.append(pull_request.number)
+    _LOGGER.info(
+        '%d pull requests were merged into %s in [%s, %s].', len(numbers), base_branch, merged_since, merged_until
+    )
+    return numbers
+
+
+def build_branch_trees(
+    repo: Repository,
+    pr_numbers: Iterable[int],
+    workers: int = 4,
+    store: Optional[CommitStore] = None,
+    max_main_branch_commits: int = _MAX_MAIN_BRANCH_COMMITS,
+) -> Dict[int, BranchTree]:
+    """ Builds the `BranchTree` of many merged pull requests concurrently.
+
+    The pull requests, their diverge commits and their feature branch commits are fetched by a pool of `workers`.
+    The main branch history spanning all the pull requests of the same base branch is listed once, and the main branch
+    commits of every pull request are resolved from it locally, instead of a compare per pull request. Pull requests
+    outside of the listed span, or whose base branch history could not be listed, fall back to the compare API.
+
+    :param Repository repo: The repository object.
+    :param Iterable[int] pr_numbers: The merged pull requests numbers.
+    :param int workers: The maximal number of concurrent fetches.
+    :param CommitStore store: An optional commit store to consult before fetching from GitHub.
+    :param int max_main_branch_commits: The maximal number of main branch commits to list per base branch.
+    :returns: The branch trees by pull request number, pull requests that failed are omitted.
+    :rtype: Dict[int, BranchTree]
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='branch-trees') as executor:
+        resolved = [
+            r for r in map_in_context(executor, lambda n: _resolve_pull_request(repo, n, store), pr_numbers) if r
+        ]
+        pull_requests_per_base = defaultdict(list)
+        for pull_request, diverge_sha, _ in resolved:
+            pull_requests_per_base[pull_request.base.ref].append((pull_request, diverge_sha))
+        graphs = dict(zip(pull_requests_per_base, map_in_context(
+            executor,
+            lambda prs: _main_branch_graph(repo, prs, max_main_branch_commits),
+            pull_requests_per_base.values()
+        )))
+        trees = map_in_context(
+            executor, lambda r: _build_branch_tree(repo, graphs[r[0].base.ref], *r, store), resolved
+        )
+        return {pull_request.number: tree for (pull_request, _, _), tree in zip(resolved, trees) if tree}
+
+
+def write_branch_trees(branch_trees: Dict[int, BranchTree], output_dir: Path) -> None:
+    """ Writes the dot graph of every branch tree to the output directory, named after its branch and pull request.
+
+    :param Dict[int, BranchTree] branch_trees: The branch trees by pull request number.
+    :param Path output_dir: The output directory.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for pr_num, branch_tree in branch_trees.items():
+        # the branch names usually hold slashes, e.g. `feat/x`
+        file_name = f'branch_{branch_tree.feature_branch.replace("/", "_")}_pr{pr_num}_graph.dot'
+        branch_tree.write_graph(output_dir / file_name)
+
+
+def _resolve_pull_request(
+    repo: Repository, pr_num: int, store: Optional[CommitStore]
+) -> Optional[Tuple[PullRequest, str, List[CommitRecord]]]:
+    try:
+        pull_request = get_merged_pull_request(repo, pr_num, store)
+        with step('get_diverge_commit'):
+            diverge_sha = compare(repo, pull_request.base.sha, pull_request.head.sha, store).merge_base_sha
+        return pull_request, diverge_sha, get_pull_request_commits(repo, pull_request, store)
+    except Exception:
+        _LOGGER.exception('Error while retrieving pull request #%d.', pr_num)
+
+
+def _main_branch_graph(
+    repo: Repository, pull_requests: List[Tuple[PullRequest, str]], max_commits: int
+) -> Optional[CommitGraph]:
+    newest_pull_request, _ = max(pull_requests, key=lambda pr: pr[0].merged_at)
+    diverge_shas = {diverge_sha for _, diverge_sha in pull_requests}
+    try:
+        return CommitGraph.from_github(repo, newest_pull_request.merge_commit_sha, diverge_shas, max_commits)
+    except GithubException:
+        # the pull requests of the base branch fall back to a compare each
+        _LOGGER.exception('Error while listing the history of %s.', newest_pull_request.base.ref)
+
+
+def _build_branch_tree(
+    repo: Repository,
+    graph: Optional[CommitGraph],
+    pull_request: PullRequest,
+    diverge_sha: str,
+    feature_branch_commits: List[CommitRecord],
+    store: Optional[CommitStore],
+) -> Optional[BranchTree]:
+    try:
+        diverge_commit = CommitRecord(diverge_sha)
+        merge_commit = get_merge_commit(pull_request)
+        main_branch_shas = None if graph is None else graph.commits_range(diverge_sha, merge_commit.sha)
+        if main_branch_shas is None:
+            main_branch_commits = get_in_between_commits(repo, diverge_commit, merge_commit, store)
+        else:
+            main_branch_commits = [CommitRecord(sha) for sha in main_branch_shas if sha != merge_commit.sha]
+        return BranchTree(
+            feature_branch=pull_request.head.ref,
+            main_branch=pull_request.base.ref,
+            feature_branch_commits=feature_branch_commits,
+            main_branch_commits=[diverge_commit, *main_branch_commits, merge_commit]
+        )
+    except Exception:
+        _LOGGER.exception('Error while building the branch tree of pull request #%d.', pull_request.number)
@@ -0,0 +1,471 @@
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from attr import asdict, define, evolve, field
+from attr.validators import instance_of
+from github import Github
+from github.Repository import Repository
+from more_itertools import first, last, pairwise
+from pydot import Dot, Edge
+
+from repository_stats.branch_tree import BranchTree, _create_node
+from repository_stats.fake_github import FakeGitHub, ReplayBackend, backend_middleware, load_fixtures
+from repository_stats.graphql_summary import summarize_repository_graphql
+from repository_stats.repository_summary import summarize_repository
+from repository_stats.synthetic import SyntheticBackend, generate_repository
+from repository_stats.transport import HttpRequest, HttpResponse, Send, install_middlewares
+
+
+_LOGGER = logging.getLogger(__name__)
+_PER_PAGE = 100
+_LATENCY = 0.02
+_CONCURRENCY = 4
+_TOLERANCE = 0.2
+# wall time differences below this many seconds are noise, whatever the tolerance
+_MIN_TIME_DELTA = 0.05
+_DEFAULT_SIZES = ['small', '10k', '100k']
+_OFFLINE_BASE_URL = 'http://fake-github'
+_REPEAT = 5
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class SyntheticSize:
+    """ Represents the size of a synthetic repository.
+
+    :ivar int pull_requests: Number of pull requests (closed and open).
+    :ivar int contributors: Number of contributors.
+    :ivar int main_branch_commits: Number of main branch commits between the diverge and merge commits of the
+        benchmarked pull request.
+    """
+    pull_requests: int = field(validator=instance_of(int))
+    contributors: int = field(validator=instance_of(int))
+    main_branch_commits: int = field(validator=instance_of(int))
+
+
+SYNTHETIC_SIZES = {
+    'small': SyntheticSize(pull_requests=100, contributors=20, main_branch_commits=50),
+    '10k': SyntheticSize(pull_requests=10_000, contributors=500, main_branch_commits=1_000),
+    '100k': SyntheticSize(pull_requests=100_000, contributors=5_000, main_branch_commits=10_000),
+    '200k': SyntheticSize(pull_requests=200_000, contributors=5_000, main_branch_commits=50_000),
+}
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class Scenario:
+    """ Represents a repository served by the fake GitHub API.
+
+    :ivar str name: The name of the scenario.
+    :ivar Send backend: Answers the GitHub API requests of the scenario.
+    :ivar str repository: The full name of the repository.
+    :ivar str feature_branch: The feature branch of the benchmarked branch tree.
+    :ivar int pr_num: The pull request number of the feature branch.
+    """
+    name: str = field(validator=instance_of(str))
+    backend: Send = field()
+    repository: str = field(validator=instance_of(str))
+    feature_branch: str = field(validator=instance_of(str))
+    pr_num: int = field(validator=instance_of(int))
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class BenchmarkResult:
+    """ Represents the measures of an entry point on a scenario.
+
+    :ivar str scenario: The name of the scenario.
+    :ivar str entry_point: The name of the entry point.
+    :ivar float wall_time: The wall time in seconds.
+    :ivar int requests: The number of GitHub API requests.
+    :ivar int bytes: The number of bytes of the GitHub API responses bodies.
+    :ivar int peak_memory: The peak of the memory allocated by Python in bytes.
+    """
+    scenario: str = field(validator=instance_of(str))
+    entry_point: str = field(validator=instance_of(str))
+    wall_time: float = field(validator=instance_of(float))
+    requests: int = field(validator=instance_of(int))
+    bytes: int = field(validator=instance_of(int))
+    peak_memory: int = field(validator=instance_of(int))
+
+    @property
+    def key(self) -> str:
+        """ The key of the result in the stored results. """
+        return f'{self.scenario}/{self.entry_point}'
+
+
+EntryPoint = Callable[[Repository, Scenario, int], object]
+ENTRY_POINTS: Dict[str, EntryPoint] = {
+    'summarize_repository': lambda repo, scenario, concurrency: summarize_repository(repo, concurrency=concurrency),
+    'summarize_repository_graphql': lambda repo, scenario, concurrency: summarize_repository_graphql(
+        repo, concurrency=concurrency
+    ),
+    'branch_tree': lambda repo, scenario, concurrency: BranchTree.from_github_branch(
+        repo, scenario.feature_branch, scenario.pr_num
+    ),
+    'build_graph': lambda repo, scenario, concurrency: BranchTree.from_github_branch(
+        repo, scenario.feature_branch, scenario.pr_num
+    ).build_graph(),
+}
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class ComparisonResult:
+    """ Represents the wall times of an implementation and of the implementation it replaced, on a scenario.
+
+    :ivar str scenario: The name of the scenario.
+    :ivar str comparison: The name of the comparison.
+    :ivar float wall_time: The best wall time of the current implementation in seconds.
+    :ivar float previous_wall_time: The best wall time of the previous implementation in seconds.
+    """
+    scenario: str = field(validator=instance_of(str))
+    comparison: str = field(validator=instance_of(str))
+    wall_time: float = field(validator=instance_of(float))
+    previous_wall_time: float = field(validator=instance_of(float))
+
+    @property
+    def key(self) -> str:
+        """ The key of the result in the printed results. """
+        return f'{self.scenario}/{self.comparison}'
+
+    @property
+    def speedup(self) -> float:
+        """ The ratio of the previous wall time to the current one. """
+        return self.previous_wall_time / self.wall_time
+
+
+def _build_graph_by_property_chain(branch_tree: BranchTree) -> Dot:
+    # the graph properties before they were memoized: every property rebuilt the nodes it depends on, hence the nodes
+    # of both branches were created four times per `build_graph`
+    def feature_branch_nodes():
+        return list(map(partial(_create_node, branch_tree.feature_branch), branch_tree.feature_branch_commits))
+
+    def main_branch_nodes():
+        return list(map(partial(_create_node, branch_tree.main_branch), branch_tree.main_branch_commits))
+
+    def branch_edges():
+        feature_nodes, main_nodes = feature_branch_nodes(), main_branch_nodes()
+        return [
+            Edge(first(main_nodes), first(feature_nodes)),
+            Edge(last(feature_nodes), last(main_nodes)),
+            *[Edge(n1, n2) for n1, n2 in pairwise(feature_branch_nodes())],
+            *[Edge(n1, n2) for n1, n2 in pairwise(main_branch_nodes())]
+        ]
+
+    graph = Dot(graph_type='digraph', rankdir='LR')
+    list(map(graph.add_node, feature_branch_nodes() + main_branch_nodes()))
+    list(map(graph.add_edge, branch_edges()))
+    return graph
+
+
+def _build_graph_with_eager_logging(branch_tree: BranchTree) -> Dot:
+    # the debug messages before they were logged lazily: formatted by f-strings, whatever the logging level
+    graph = branch_tree.build_graph()
+    feature_nodes, main_nodes = branch_tree.feature_branch_nodes, branch_tree.main_branch_nodes
+    _LOGGER.debug(f'Feature branch nodes: {repr(feature_nodes)}.')
+    _LOGGER.debug(f'Main branch nodes: {repr(main_nodes)}')
+    _LOGGER.debug(f'Feature branch edges: {repr(branch_tree.feature_branch_edges)}.')
+    _LOGGER.debug(f'Main branch edges: {repr(branch_tree.main_branch_edges)}.')
+    _LOGGER.debug(f'All edges:\n{repr(branch_tree.branch_edges)}')
+    _LOGGER.debug(f'The dot graph content:\n {graph.to_string()}')
+    return graph
+
+
+Implementation = Callable[[BranchTree], Dot]
+COMPARISONS: Dict[str, Tuple[Implementation, Implementation]] = {
+    'memoized_graph': (BranchTree.build_graph, _build_graph_by_property_chain),
+    'lazy_logging': (BranchTree.build_graph, _build_graph_with_eager_logging),
+}
+
+
+class _Meter:
+    # counts the GitHub API requests and the bytes of their responses bodies
+    def __init__(self) -> None:
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, request: HttpRequest, send: Send) -> HttpResponse:
+        response = send(request)
+        with self._lock:
+            self.requests += 1
+            self.bytes += len(response.body.encode('utf-8'))
+        return response
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.bytes = 0
+
+
+def run_benchmark(
+    scenario: Scenario,
+    entry_points: Dict[str, EntryPoint],
+    latency: float = _LATENCY,
+    concurrency: int = _CONCURRENCY,
+    offline: bool = False
+) -> List[BenchmarkResult]:
+    """ Runs the entry points against a fake GitHub API serving the scenario.
+
+    Every entry point runs twice, once to measure the wall time and the requests, and once under `tracemalloc`
+    to measure the peak memory, since tracing the allocations slows the run down.
+    Offline, the scenario backend answers the requests in memory instead of a `FakeGitHub` server, without latency.
+
+    :param Scenario scenario: The scenario to serve.
+    :param Dict[str, EntryPoint] entry_points: The entry points to run by their names.
+    :param float latency: The delay of every response of the fake GitHub API in seconds.
+    :param int concurrency: The maximal number of concurrent fetches of the entry points.
+    :param bool offline: Indicates whether to answer the requests in memory.
+    :returns: The measures of the entry points.
+    :rtype: List[BenchmarkResult]
+    """
+    meter = _Meter()
+    install_middlewares(*([meter, backend_middleware(scenario.backend)] if offline else [meter]))
+    results = []
+    with nullcontext() if offline else FakeGitHub(scenario.backend, latency) as server:
+        base_url = _OFFLINE_BASE_URL if offline else server.base_url
+        github = Github(
+            base_url=base_url, per_page=_PER_PAGE, retry=None, seconds_between_requests=None, seconds_between_writes=None
+        )
+        for name, entry_point in entry_points.items():
+            _LOGGER.info('Benchmarking %s on %s', name, scenario.name)
+            meter.reset()
+            start = time.perf_counter()
+            entry_point(github.get_repo(scenario.repository, lazy=True), scenario, concurrency)
+            wall_time = time.perf_counter() - start
+            requests, num_bytes = meter.requests, meter.bytes
+            tracemalloc.start()
+            try:
+                entry_point(github.get_repo(scenario.repository, lazy=True), scenario, concurrency)
+                _, peak_memory = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            results.append(BenchmarkResult(
+                scenario=scenario.name,
+                entry_point=name,
+                wall_time=wall_time,
+                requests=requests,
+                bytes=num_bytes,
+                peak_memory=peak_memory
+            ))
+    return results
+
+
+def run_comparisons(
+    scenario: Scenario, comparisons: Dict[str, Tuple[Implementation, Implementation]], repeat: int = _REPEAT
+) -> List[ComparisonResult]:
+    """ Runs the current and the previous implementations of the comparisons on the branch tree of the scenario.
+
+    The branch tree is fetched once, in memory, and every implementation builds the graph of a fresh copy of it
+    (without the memoized graph) `repeat` times, keeping the best wall time. The implementations run with the
+    `repository_stats` loggers at the INFO level, as the tool runs without `--debug-mode`, and must build the same
+    graph.
+
+    :param Scenario scenario: The scenario of the branch tree.
+    :param Dict[str, Tuple[Implementation, Implementation]] comparisons: The current and previous implementations by
+        the names of the comparisons.
+    :param int repeat: The number of runs of every implementation.
+    :returns: The wall times of the comparisons.
+    :rtype: List[ComparisonResult]
+    """
+    install_middlewares(backend_middleware(scenario.backend))
+    github = Github(base_url=_OFFLINE_BASE_URL, per_page=_PER_PAGE, retry=None, seconds_between_requests=None)
+    branch_tree = BranchTree.from_github_branch(
+        github.get_repo(scenario.repository, lazy=True), scenario.feature_branch, scenario.pr_num
+    )
+    results = []
+    with _logging_level(logging.INFO):
+        for name, (current, previous) in comparisons.items():
+            _LOGGER.info('Comparing %s on %s', name, scenario.name)
+            if current(evolve(branch_tree)).to_string() != previous(evolve(branch_tree)).to_string():
+                raise ValueError(f'The implementations of {name} build different graphs on {scenario.name}.')
+            results.append(ComparisonResult(
+                scenario=scenario.name,
+                comparison=name,
+                wall_time=_best_wall_time(current, branch_tree, repeat),
+                previous_wall_time=_best_wall_time(previous, branch_tree, repeat)
+            ))
+    return results
+
+
+def _best_wall_time(implementation: Implementation, branch_tree: BranchTree, repeat: int) -> float:
+    wall_times = []
+    for _ in range(repeat):
+        branch_tree = evolve(branch_tree)
+        start = time.perf_counter()
+        implementation(branch_tree)
+        wall_times.append(time.perf_counter() - start)
+    return min(wall_times)
+
+
+@contextmanager
+def _logging_level(level: int) -> Iterator[None]:
+    # the records are handled by a null handler, hence only their formatting is measured, not the output
+    logger = logging.getLogger('repository_stats')
+    handler, previous_level, previous_propagate = logging.NullHandler(), logger.level, logger.propagate
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    try:
+        yield
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(previous_level)
+        logger.propagate = previous_propagate
+
+
+def find_regressions(
+    results: List[BenchmarkResult], baseline: Dict[str, BenchmarkResult], tolerance: float = _TOLERANCE
+) -> List[str]:
+    """ Compares the results to a baseline.
+
+    The requests and bytes counts are deterministic, so any increase is a regression. The wall time and the peak
+    memory regress when they exceed the baseline by more than `tolerance`.
+
+    :param List[BenchmarkResult] results: The results to check.
+    :param Dict[str, BenchmarkResult] baseline: The baseline results by their keys.
+    :param float tolerance: The allowed relative increase of the wall time and the peak memory.
+    :returns: A description of every regression.
+    :rtype: List[str]
+    """
+    regressions = []
+    for result in results:
+        expected = baseline.get(result.key)
+        if expected is None:
+            continue
+        if result.requests > expected.requests:
+            regressions.append(f'{result.key}: {result.requests} requests, baseline {expected.requests}')
+        if result.bytes > expected.bytes:
+            regressions.append(f'{result.key}: {result.bytes} bytes, baseline {expected.bytes}')
+        if result.wall_time > max(expected.wall_time * (1 + tolerance), expected.wall_time + _MIN_TIME_DELTA):
+            regressions.append(f'{result.key}: {result.wall_time:.3f}s, baseline {expected.wall_time:.3f}s')
+        if result.peak_memory > expected.peak_memory * (1 + tolerance):
+            regressions.append(f'{result.key}: {result.peak_memory} bytes peak, baseline {expected.peak_memory}')
+    return regressions
+
+
+def read_results(path: Path) -> Dict[str, BenchmarkResult]:
+    """ Reads stored benchmark results by their keys. """
+    return {result.key: result for result in map(lambda r: BenchmarkResult(**r), json.loads(path.read_text()))}
+
+
+def write_results(results: List[BenchmarkResult], path: Path) -> None:
+    """ Stores benchmark results as JSON. """
+    path.write_text(json.dumps([asdict(result) for result in results], indent=2))
+
+
+def synthetic_scenario(name: str, size: SyntheticSize, seed: int = 0) -> Scenario:
+    """ Builds a scenario of a generated synthetic repository of the given size.
+
+    The benchmarked branch tree is the one of the widest merged pull request of the repository.
+
+    :param str name: The name of the scenario.
+    :param SyntheticSize size: The size of the repository.
+    :param int seed: The seed of the repository generator.
+    :returns: The scenario of the synthetic repository.
+    :rtype: Scenario
+    """
+    repository = generate_repository(
+        seed,
+        pull_requests=size.pull_requests,
+        contributors=size.contributors,
+        main_branch_commits=size.main_branch_commits
+    )
+    pull_request = repository.widest_pull_request()
+    return Scenario(
+        name=name,
+        backend=SyntheticBackend(repository),
+        repository=repository.full_name,
+        feature_branch=pull_request.head_ref,
+        pr_num=pull_request.number
+    )
+
+
+def _parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmarks the entry points against a fake GitHub API.')
+    parser.add_argument('--sizes', nargs='*', choices=SYNTHETIC_SIZES, default=_DEFAULT_SIZES)
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the synthetic repositories generator.')
+    parser.add_argument('--offline', action='store_true', help='Answer the requests in memory, without latency.')
+    parser.add_argument('--fixtures', type=Path, default=None, help='Replay recorded fixtures as well.')
+    parser.add_argument('--repository', type=str, default=None, help='The repository of the recorded fixtures.')
+    parser.add_argument('--feature-branch', type=str, default=None, help='The feature branch of the fixtures.')
+    parser.add_argument('--pr-num', type=int, default=None, help='The pull request of the fixtures feature branch.')
+    parser.add_argument('--entry-points', nargs='+', choices=ENTRY_POINTS, default=list(ENTRY_POINTS))
+    parser.add_argument(
+        '--comparisons', nargs='*', choices=COMPARISONS, default=list(COMPARISONS),
+        help='Compare these implementations to the ones they replaced, on the scenarios branch trees.'
+    )
+    parser.add_argument('--latency', type=float, default=_LATENCY, help='Fake GitHub API latency in seconds.')
+    parser.add_argument('--concurrency', type=int, default=_CONCURRENCY, help='Maximal concurrent fetches.')
+    parser.add_argument('--output', type=Path, default=Path('benchmark_results.json'))
+    parser.add_argument('--baseline', type=Path, default=Path('benchmark_baseline.json'))
+    parser.add_argument('--update-baseline', action='store_true', help='Store the results as the new baseline.')
+    parser.add_argument('--tolerance', type=float, default=_TOLERANCE, help='Allowed relative slowdown.')
+    return parser.parse_args()
+
+
+def _scenarios(args: argparse.Namespace) -> List[Scenario]:
+    scenarios = [synthetic_scenario(name, SYNTHETIC_SIZES[name], args.seed) for name in args.sizes]
+    if args.fixtures is not None:
+        scenarios.append(Scenario(
+            name=args.fixtures.stem,
+            backend=ReplayBackend(load_fixtures(args.fixtures)),
+            repository=args.repository,
+            feature_branch=args.feature_branch,
+            pr_num=args.pr_num
+        ))
+    return scenarios
+
+
+def _print_results(results: List[BenchmarkResult]) -> None:
+    print(f'{"benchmark":<40} {"wall time":>10} {"requests":>9} {"bytes":>12} {"peak memory":>12}')
+    for result in results:
+        print(
+            f'{result.key:<40} {result.wall_time:>9.3f}s {result.requests:>9} {result.bytes:>12} '
+            f'{result.peak_memory:>12}'
+        )
+
+
+def _print_comparisons(results: List[ComparisonResult]) -> None:
+    print(f'{"comparison":<40} {"wall time":>10} {"previous":>10} {"speedup":>8}')
+    for result in results:
+        print(
+            f'{result.key:<40} {result.wall_time:>9.4f}s {result.previous_wall_time:>9.4f}s {result.speedup:>7.2f}x'
+        )
+
+
+def _main(args: argparse.Namespace) -> int:
+    logging.basicConfig(level=logging.WARNING)
+    entry_points = {name: ENTRY_POINTS[name] for name in args.entry_points}
+    comparisons = {name: COMPARISONS[name] for name in args.comparisons}
+    scenarios = _scenarios(args)
+    results = [
+        result for scenario in scenarios
+        for result in run_benchmark(scenario, entry_points, args.latency, args.concurrency, args.offline)
+    ]
+    comparison_results = [result for scenario in scenarios for result in run_comparisons(scenario, comparisons)]
+    _print_results(results)
+    _print_comparisons(comparison_results)
+    write_results(results, args.output)
+    # an implementation slower than the one it replaced is a regression, whatever the baseline
+    regressions = [
+        f'{result.key}: {result.wall_time:.4f}s, previously {result.previous_wall_time:.4f}s'
+        for result in comparison_results if result.wall_time > result.previous_wall_time * (1 + args.tolerance)
+    ]
+    if args.update_baseline or not args.baseline.exists():
+        write_results(results, args.baseline)
+    else:
+        regressions += find_regressions(results, read_results(args.baseline), args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main(_parse_arguments()))
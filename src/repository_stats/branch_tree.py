@@ -1,151 +1,265 @@
 import logging
 from functools import partial
+from itertools import chain
 from pathlib import Path
-from typing import List
+from typing import Iterator, List, Optional
 
 from attr import define, field
 from attr.validators import deep_iterable, instance_of
-from github.Commit import Commit
+from github.PullRequest import PullRequest
 from github.Repository import Repository
 from more_itertools import first, last, pairwise
 from pydot import Dot, Node, Edge
 
-from repository_stats.commit_utils import get_diverge_commit, get_merge_commit, get_in_between_commits
+from repository_stats.commit_store import CommitStore
+from repository_stats.commit_utils import (
+    CommitRecord, get_diverge_commit, get_in_between_commits, get_merge_commit, get_merged_pull_request,
+    get_pull_request_commits
+)
+from repository_stats.dot_writer import DotEdge, DotNode, write_digraph
+from repository_stats.local_git import get_commits_range, get_merge_base, sync_mirror
+from repository_stats.logging_setup import lazy
+from repository_stats.metrics import step
+from repository_stats.tracing import span
 
 
 DOT_SUFFIX = '.dot'
 _LOGGER = logging.getLogger(__name__)
 
 
-def _create_node(branch: str, commit: Commit) -> Node:
+def _create_node(branch: str, commit: CommitRecord) -> Node:
     return Node(str(commit.sha), label=f'commit {commit.sha}\n{branch}', shape="circle")
 
 
+@define(frozen=True, kw_only=True, slots=True)
+class _BranchGraph:
+    """ The nodes and edges of a `BranchTree`, computed once per tree. """
+    feature_branch_nodes: List[Node] = field()
+    main_branch_nodes: List[Node] = field()
+    feature_branch_edges: List[Edge] = field()
+    main_branch_edges: List[Edge] = field()
+    branch_nodes: List[Node] = field()
+    branch_edges: List[Edge] = field()
+
+    @classmethod
+    def from_branch_tree(cls, branch_tree: 'BranchTree') -> '_BranchGraph':
+        feature_nodes = list(map(partial(_create_node, branch_tree.feature_branch), branch_tree.feature_branch_commits))
+        _LOGGER.debug('Feature branch nodes: %r.', feature_nodes)
+        main_nodes = list(map(partial(_create_node, branch_tree.main_branch), branch_tree.main_branch_commits))
+        _LOGGER.debug('Main branch nodes: %r', main_nodes)
+        feature_edges = [Edge(n1, n2) for n1, n2 in pairwise(feature_nodes)]
+        _LOGGER.debug('Feature branch edges: %r.', feature_edges)
+        main_edges = [Edge(n1, n2) for n1, n2 in pairwise(main_nodes)]
+        _LOGGER.debug('Main branch edges: %r.', main_edges)
+        all_edges = [
+            Edge(first(main_nodes), first(feature_nodes)),
+            Edge(last(feature_nodes), last(main_nodes)),
+            *feature_edges,
+            *main_edges
+        ]
+        _LOGGER.debug('All edges:\n%r', all_edges)
+        return cls(
+            feature_branch_nodes=feature_nodes,
+            main_branch_nodes=main_nodes,
+            feature_branch_edges=feature_edges,
+            main_branch_edges=main_edges,
+            branch_nodes=feature_nodes + main_nodes,
+            branch_edges=all_edges,
+        )
+
+
 @define(frozen=True, kw_only=True, slots=True)
 class BranchTree:
     """  Represents a commit tree of a feature branch.
 
+    The graph nodes and edges are built once, on first use, and shared by all the graph properties.
+
     :ivar str feature_branch: The feature branch to analyze its commits tree.
     :ivar str main_branch: The main branch of the feature branch from which it has diverged.
-    :ivar List[Commit] feature_branch_commits: The commits of the feature branch by chronological order.
-    :ivar List[Commit] main_branch_commits: The commits of the main branch by chronological order.
-    :ivar Commit diverges_commit: The commit that the feature branch has diverged from.
-    :ivar Commit merged_commit: The commit in the main branch the feature branch has merged to.
+    :ivar List[CommitRecord] feature_branch_commits: The commits of the feature branch by chronological order.
+    :ivar List[CommitRecord] main_branch_commits: The commits of the main branch by chronological order.
+    :ivar CommitRecord diverges_commit: The commit that the feature branch has diverged from.
+    :ivar CommitRecord merged_commit: The commit in the main branch the feature branch has merged to.
     """
     feature_branch: str = field(validator=instance_of(str))
     main_branch: str = field(validator=instance_of(str))
-    feature_branch_commits: List[Commit] = field(
+    feature_branch_commits: List[CommitRecord] = field(
         factory=list,
-        validator=deep_iterable(member_validator=instance_of(Commit), iterable_validator=instance_of(list))
+        validator=deep_iterable(member_validator=instance_of(CommitRecord), iterable_validator=instance_of(list))
     )
-    main_branch_commits: List[Commit] = field(
+    main_branch_commits: List[CommitRecord] = field(
         factory=list,
-        validator=deep_iterable(member_validator=instance_of(Commit), iterable_validator=instance_of(list))
+        validator=deep_iterable(member_validator=instance_of(CommitRecord), iterable_validator=instance_of(list))
     )
+    _graph: Optional[_BranchGraph] = field(init=False, default=None, eq=False, repr=False)
 
+    @span('build_graph')
     def build_graph(self) -> Dot:
         """ Builds a dot graph of the feature branch.
 
         :returns: A dot graph of the feature branch along the main branch.
         :rtype: Dot
         """
-        _LOGGER.debug(f'Building a dot graph of the feature branch ({self.feature_branch})')
+        _LOGGER.debug('Building a dot graph of the feature branch (%s)', self.feature_branch)
         graph = Dot(graph_type='digraph', rankdir='LR')
         list(map(graph.add_node, self.branch_nodes))
         list(map(graph.add_edge, self.branch_edges))
-        _LOGGER.debug(
-            f'The dot graph content:\n {graph.to_string()}'
-        )
+        _LOGGER.debug('The dot graph content:\n %s', lazy(graph.to_string))
         return graph
 
     @property
     def feature_branch_nodes(self) -> List[Node]:
         """ Returns the unique nodes (from the unique commits) of the feature branch."""
-        nodes = list(map(partial(_create_node, self.feature_branch), self.feature_branch_commits))
-        _LOGGER.debug(f'Feature branch nodes: {repr(nodes)}.')
-        return nodes
+        return self._branch_graph().feature_branch_nodes
 
     @property
     def feature_branch_edges(self) -> List[Edge]:
         """ The nodes edges of the feature branch commit tree."""
-        edges = [Edge(n1, n2) for n1, n2 in pairwise(self.feature_branch_nodes)]
-        _LOGGER.debug(f'Feature branch edges: {repr(edges)}.')
-        return edges
+        return self._branch_graph().feature_branch_edges
 
     @property
     def main_branch_nodes(self) -> List[Node]:
         """ The nodes of the main branch commit tree. """
-        nodes = list(map(partial(_create_node, self.main_branch), self.main_branch_commits))
-        _LOGGER.debug(f'Main branch nodes: {repr(nodes)}')
-        return nodes
+        return self._branch_graph().main_branch_nodes
 
     @property
     def main_branch_edges(self) -> List[Edge]:
         """ The edges of the main branch commit tree."""
-        edges = [Edge(n1, n2) for n1, n2 in pairwise(self.main_branch_nodes)]
-        _LOGGER.debug(f'Main branch edges: {repr(edges)}.')
-        return edges
+        return self._branch_graph().main_branch_edges
 
     @property
     def branch_edges(self) -> List[Edge]:
         """ The edges of the feature and main branches commits tree."""
-        _LOGGER.info(f'Creating the branch graph edges.')
-        feature_nodes = self.feature_branch_nodes
-        main_nodes = self.main_branch_nodes
-        all_edges = [
-            Edge(first(main_nodes), first(feature_nodes)),
-            Edge(last(feature_nodes), last(main_nodes)),
-            *self.feature_branch_edges,
-            *self.main_branch_edges
-        ]
-        _LOGGER.debug(f'All edges:\n{repr(all_edges)}')
-        return all_edges
+        return self._branch_graph().branch_edges
 
     @property
     def branch_nodes(self) -> List[Node]:
         """ The nodes of the feature and main branches commits tree. """
-        _LOGGER.info(f'Creating the branch graph nodes.')
-        return self.feature_branch_nodes + self.main_branch_nodes
+        return self._branch_graph().branch_nodes
+
+    def _branch_graph(self) -> _BranchGraph:
+        if self._graph is None:
+            _LOGGER.info('Creating the branch graph nodes and edges.')
+            # the tree is frozen, the graph is a cache of its (immutable) commits
+            object.__setattr__(self, '_graph', _BranchGraph.from_branch_tree(self))
+        return self._graph
 
+    @span('write_graph')
     def write_graph(self, output_file: Path) -> None:
         """ Writes a dot graph of the feature branch.
 
+        The graph is streamed to the file directly from the commits, without building a `Dot` graph in memory.
+
         :param output_file: The output file to write the dot graph.
         """
         try:
             if output_file.suffix != DOT_SUFFIX:
                 output_file = output_file.with_suffix(DOT_SUFFIX)
-            _LOGGER.info(f'Writing branch graph to {output_file}.')
-            self.build_graph().write(output_file)
+            _LOGGER.info('Writing branch graph to %s.', output_file)
+            write_digraph(output_file, self._dot_nodes(), self._dot_edges(), rankdir='LR')
         except Exception:
             _LOGGER.exception('Error while writing the branch graph.')
 
+    def _dot_nodes(self) -> Iterator[DotNode]:
+        for branch, commits in [(self.feature_branch, self.feature_branch_commits),
+                                (self.main_branch, self.main_branch_commits)]:
+            for commit in commits:
+                yield commit.sha, {'label': f'commit {commit.sha}\n{branch}', 'shape': 'circle'}
+
+    def _dot_edges(self) -> Iterator[DotEdge]:
+        # the cross edges are resolved eagerly, so that empty branches fail before anything is written
+        cross_edges = [
+            (first(self.main_branch_commits).sha, first(self.feature_branch_commits).sha),
+            (last(self.feature_branch_commits).sha, last(self.main_branch_commits).sha),
+        ]
+        branch_edges = (
+            (c1.sha, c2.sha) for commits in [self.feature_branch_commits, self.main_branch_commits]
+            for c1, c2 in pairwise(commits)
+        )
+        return chain(cross_edges, branch_edges)
+
     @classmethod
-    def from_github_branch(cls, repo: Repository, feature_branch: str, pr_num: int, ) -> 'BranchTree':
+    @step('from_github_branch')
+    def from_github_branch(
+        cls,
+        repo: Repository,
+        feature_branch: str,
+        pr_num: int,
+        store: Optional[CommitStore] = None,
+        pull_request: Optional[PullRequest] = None,
+    ) -> 'BranchTree':
         """ Generates a `BranchTree` from a GitHub feature branch.
 
         :param Repository repo: The repository object.
         :param str feature_branch: The feature branch to analyze its commits tree.
         :param int pr_num: The pull request nuber of the branch.
+        :param CommitStore store: An optional commit store to consult before fetching from GitHub.
+        :param PullRequest pull_request: The merged pull request of the branch, fetched if `None`.
         :returns: A `BranchTree` instance.
         :rtype: BranchTree
         """
         try:
-            pull_request = repo.get_pull(pr_num)
-            if not pull_request.is_merged():
-                raise ValueError(
-                    f'Pull request #{pull_request.number} for branch {pull_request.head.ref} is not merged yet.'
-                )
-            if pull_request.head.ref != feature_branch:
-                raise ValueError(f'The branch {feature_branch} does not match pull request number {pr_num}.')
-            diverge_commit = get_diverge_commit(repo, pull_request)
-            merge_commit = get_merge_commit(repo, pull_request)
-            main_branch_commits = get_in_between_commits(repo, diverge_commit, merge_commit)
+            pull_request = _get_feature_branch_pull_request(repo, feature_branch, pr_num, store, pull_request)
+            diverge_commit = get_diverge_commit(repo, pull_request, store)
+            merge_commit = get_merge_commit(pull_request)
+            main_branch_commits = get_in_between_commits(repo, diverge_commit, merge_commit, store)
             return cls(
                 feature_branch=feature_branch,
                 main_branch=pull_request.base.ref,
-                feature_branch_commits=[c for c in pull_request.get_commits()],
+                feature_branch_commits=get_pull_request_commits(repo, pull_request, store),
                 main_branch_commits=[diverge_commit, *main_branch_commits, merge_commit]
             )
         except Exception:
-            _LOGGER.exception(f'Error while retrieving the branch tree.')
+            _LOGGER.exception('Error while retrieving the branch tree.')
+
+    @classmethod
+    @step('from_local_mirror')
+    def from_local_mirror(
+        cls, repo: Repository, feature_branch: str, pr_num: int, mirror_path: Path, token: Optional[str] = None
+    ) -> 'BranchTree':
+        """ Generates a `BranchTree` from a local bare mirror of the GitHub repository.
+
+        Only the pull request is fetched from GitHub, the commits are resolved with the local git plumbing.
+
+        :param Repository repo: The repository object.
+        :param str feature_branch: The feature branch to analyze its commits tree.
+        :param int pr_num: The pull request nuber of the branch.
+        :param Path mirror_path: The directory of the local bare mirror, it is cloned or updated if needed.
+        :param Optional[str] token: The GitHub token of the mirror, required for a private repository.
+        :returns: A `BranchTree` instance.
+        :rtype: BranchTree
+        """
+        try:
+            pull_request = _get_feature_branch_pull_request(repo, feature_branch, pr_num)
+            sync_mirror(repo, mirror_path, token)
+            diverge_sha = get_merge_base(mirror_path, pull_request.base.sha, pull_request.head.sha)
+            merge_sha = pull_request.merge_commit_sha
+            main_branch_shas = [
+                sha for sha in get_commits_range(mirror_path, diverge_sha, merge_sha) if sha != merge_sha
+            ]
+            return cls(
+                feature_branch=feature_branch,
+                main_branch=pull_request.base.ref,
+                # the commits of the pull request as listed by GitHub, without the main branch commits merged into it
+                feature_branch_commits=[
+                    CommitRecord(sha)
+                    for sha in get_commits_range(mirror_path, pull_request.base.sha, pull_request.head.sha)
+                ],
+                main_branch_commits=[CommitRecord(sha) for sha in [diverge_sha, *main_branch_shas, merge_sha]]
+            )
+        except Exception:
+            _LOGGER.exception('Error while retrieving the branch tree from the local mirror.')
+
+
+def _get_feature_branch_pull_request(
+    repo: Repository,
+    feature_branch: str,
+    pr_num: int,
+    store: Optional[CommitStore] = None,
+    pull_request: Optional[PullRequest] = None,
+) -> PullRequest:
+    if pull_request is None:
+        pull_request = get_merged_pull_request(repo, pr_num, store)
+    if pull_request.head.ref != feature_branch:
+        raise ValueError(f'The branch {feature_branch} does not match pull request number {pr_num}.')
+    return pull_request
@@ -0,0 +1,106 @@
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from attr import define, field
+from attr.validators import deep_iterable, instance_of
+
+from repository_stats.metrics import record_cache
+
+
+_LOGGER = logging.getLogger(__name__)
+_STORE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS comparisons (
+    base TEXT NOT NULL, head TEXT NOT NULL, merge_base TEXT NOT NULL, commits TEXT NOT NULL,
+    PRIMARY KEY (base, head)
+);
+CREATE TABLE IF NOT EXISTS pull_request_commits (
+    base TEXT NOT NULL, head TEXT NOT NULL, commits TEXT NOT NULL, PRIMARY KEY (base, head)
+);
+CREATE TABLE IF NOT EXISTS merged_pull_requests (
+    repository TEXT NOT NULL, number INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (repository, number)
+);
+'''
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class Comparison:
+    """ Represents the comparison of two commits.
+
+    :ivar str merge_base_sha: The best common ancestor of the compared commits.
+    :ivar List[str] commit_shas: The commits reachable from the head commit but not from the base commit,
+        by chronological order.
+    """
+    merge_base_sha: str = field(validator=instance_of(str))
+    commit_shas: List[str] = field(
+        factory=list,
+        validator=deep_iterable(member_validator=instance_of(str), iterable_validator=instance_of(list))
+    )
+
+
+class CommitStore:
+    """ A permanent local store of the immutable GitHub data, keyed by content.
+
+    Comparisons and commit lists are keyed by their (base, head) shas pair, hence they never change once stored.
+    Merged pull requests are stored as well, since their base, head and merge commit are final.
+    Entries are only ever added, never updated.
+
+    :ivar Path path: The path of the store database.
+    """
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_STORE_SCHEMA)
+        self._db.commit()
+
+    def get_comparison(self, base: str, head: str) -> Optional[Comparison]:
+        """ Returns the stored comparison of the `base` and `head` commits, if any. """
+        row = self._fetch_one('SELECT merge_base, commits FROM comparisons WHERE base = ? AND head = ?', base, head)
+        return None if row is None else Comparison(merge_base_sha=row[0], commit_shas=json.loads(row[1]))
+
+    def put_comparison(self, base: str, head: str, comparison: Comparison) -> None:
+        """ Stores the comparison of the `base` and `head` commits. """
+        self._insert(
+            'INSERT OR IGNORE INTO comparisons VALUES (?, ?, ?, ?)',
+            base, head, comparison.merge_base_sha, json.dumps(comparison.commit_shas)
+        )
+
+    def get_pull_request_commits(self, base: str, head: str) -> Optional[List[str]]:
+        """ Returns the stored commits shas of a pull request from `base` to `head`, if any. """
+        row = self._fetch_one('SELECT commits FROM pull_request_commits WHERE base = ? AND head = ?', base, head)
+        return None if row is None else json.loads(row[0])
+
+    def put_pull_request_commits(self, base: str, head: str, commit_shas: List[str]) -> None:
+        """ Stores the commits shas of a pull request from `base` to `head`. """
+        self._insert('INSERT OR IGNORE INTO pull_request_commits VALUES (?, ?, ?)', base, head, json.dumps(commit_shas))
+
+    def get_merged_pull_request(self, repository: str, number: int) -> Optional[Dict[str, Any]]:
+        """ Returns the raw data of a stored merged pull request, if any. """
+        row = self._fetch_one(
+            'SELECT data FROM merged_pull_requests WHERE repository = ? AND number = ?', repository, number
+        )
+        return None if row is None else json.loads(row[0])
+
+    def put_merged_pull_request(self, repository: str, number: int, data: Dict[str, Any]) -> None:
+        """ Stores the raw data of a merged pull request. """
+        self._insert(
+            'INSERT OR IGNORE INTO merged_pull_requests VALUES (?, ?, ?)', repository, number, json.dumps(data)
+        )
+
+    def _fetch_one(self, query: str, *parameters: Any) -> Optional[tuple]:
+        with self._lock:
+            row = self._db.execute(query, parameters).fetchone()
+        _LOGGER.debug('Commit store %s: %s', 'hit' if row else 'miss', parameters)
+        record_cache('commit_store', row is not None)
+        return row
+
+    def _insert(self, query: str, *parameters: Any) -> None:
+        with self._lock:
+            self._db.execute(query, parameters)
+            self._db.commit()
@@ -1,65 +1,218 @@
 import logging
-from typing import List
+from typing import Dict, List, Optional, Set
 
+from attr import define, field
+from attr.validators import instance_of
 from github import GithubException
-from github.Commit import Commit
 from github.PullRequest import PullRequest
 from github.Repository import Repository
 
+from repository_stats.commit_store import CommitStore, Comparison
+from repository_stats.metrics import step
+
 
 _LOGGER = logging.getLogger(__name__)
 
 
-def get_diverge_commit(repo: Repository, pull_request: PullRequest) -> Commit:
+@define(frozen=True, slots=True)
+class CommitRecord:
+    """ A compact immutable commit, holding only what the branch tree needs.
+
+    :ivar str sha: The commit sha.
+    """
+    sha: str = field(validator=instance_of(str))
+
+
+@step('get_diverge_commit')
+def get_diverge_commit(
+    repo: Repository, pull_request: PullRequest, store: Optional[CommitStore] = None
+) -> CommitRecord:
     """ Get the base commit between a feature branch and the main branch.
 
     :param Repository repo: The repository object.
     :param PullRequest pull_request: The pull request of the branch.
+    :param CommitStore store: An optional commit store to consult before fetching from GitHub.
     :returns: The base commit between a feature branch and the main branch.
-    :rtype: Commit
+    :rtype: CommitRecord
     """
     try:
-        _LOGGER.info(f'Getting diverge commit for {pull_request.head.ref} (#{pull_request.number})')
-        commit = repo.compare(pull_request.base.sha, pull_request.head.sha).merge_base_commit
-        _LOGGER.debug(f'Diverge commit of feature branch ({pull_request.head.ref}): {commit.sha}')
+        _LOGGER.info('Getting diverge commit for %s (#%d)', pull_request.head.ref, pull_request.number)
+        commit = CommitRecord(compare(repo, pull_request.base.sha, pull_request.head.sha, store).merge_base_sha)
+        _LOGGER.debug('Diverge commit of feature branch (%s): %s', pull_request.head.ref, commit.sha)
         return commit
     except GithubException:
         _LOGGER.exception(
-            f'Could not find the base commit for branch: {pull_request.head.ref} (#{pull_request.number})'
+            'Could not find the base commit for branch: %s (#%d)', pull_request.head.ref, pull_request.number
         )
 
 
-def get_merge_commit(repo: Repository, pull_request: PullRequest) -> Commit:
+def get_merge_commit(pull_request: PullRequest) -> CommitRecord:
     """ Get the merge commit for a branch if it has been merged into the main branch.
 
-    :param Repository repo: The repository object.
     :param PullRequest pull_request: The pull request of the branch.
     :returns: The merge commit for a branch if it has been merged into the main branch.
-    :rtype: Commit
+    :rtype: CommitRecord
     """
-    try:
-        _LOGGER.info(f'Getting merge commit for branch: {pull_request.head.ref} (#{pull_request.number})')
-        commit = pull_request.merge_commit_sha
-        _LOGGER.debug(f'Merge commit for branch ({pull_request.head.ref}): {commit}')
-        return repo.get_commit(commit)
-    except GithubException:
-        _LOGGER.exception(
-            f'Failed to retrieve merge commit for branch: {pull_request.head.ref} (#{pull_request.number})'
-        )
+    _LOGGER.info('Getting merge commit for branch: %s (#%d)', pull_request.head.ref, pull_request.number)
+    commit = pull_request.merge_commit_sha
+    _LOGGER.debug('Merge commit for branch (%s): %s', pull_request.head.ref, commit)
+    return CommitRecord(commit)
 
 
-def get_in_between_commits(repo: Repository, base: Commit, head: Commit) -> List[Commit]:
+@step('get_in_between_commits')
+def get_in_between_commits(
+    repo: Repository, base: CommitRecord, head: CommitRecord, store: Optional[CommitStore] = None
+) -> List[CommitRecord]:
     """ Return the commits between the `base` and `head` commits.
 
     :param Repository repo: The repository object.
-    :param Commit base: The base commit to compare.
-    :param Commit head: The head commit to compare.
+    :param CommitRecord base: The base commit to compare.
+    :param CommitRecord head: The head commit to compare.
+    :param CommitStore store: An optional commit store to consult before fetching from GitHub.
     :returns: The commits between the base and head commits.
-    :rtype: List[Commit]
+    :rtype: List[CommitRecord]
     """
     try:
-        commits = [c for c in repo.compare(base.sha, head.sha).commits if c.sha != head.sha]
-        _LOGGER.debug(f'Commits between the base ({base.sha}) and head ({head.sha}) commits: {repr(commits)}')
+        commits = [
+            CommitRecord(sha) for sha in compare(repo, base.sha, head.sha, store).commit_shas if sha != head.sha
+        ]
+        _LOGGER.debug('Commits between the base (%s) and head (%s) commits: %r', base.sha, head.sha, commits)
         return commits
     except GithubException:
         _LOGGER.exception('Failed to retrieve commits between base and head.')
+
+
+@step('get_pull_request_commits')
+def get_pull_request_commits(
+    repo: Repository, pull_request: PullRequest, store: Optional[CommitStore] = None
+) -> List[CommitRecord]:
+    """ Return the commits of a pull request by chronological order.
+
+    :param Repository repo: The repository object.
+    :param PullRequest pull_request: The pull request to get its commits.
+    :param CommitStore store: An optional commit store to consult before fetching from GitHub.
+    :returns: The commits of the pull request.
+    :rtype: List[CommitRecord]
+    """
+    base, head = pull_request.base.sha, pull_request.head.sha
+    commit_shas = None if store is None else store.get_pull_request_commits(base, head)
+    if commit_shas is None:
+        commit_shas = [c.sha for c in pull_request.get_commits()]
+        if store is not None:
+            store.put_pull_request_commits(base, head, commit_shas)
+    return [CommitRecord(sha) for sha in commit_shas]
+
+
+@step('get_merged_pull_request')
+def get_merged_pull_request(repo: Repository, pr_num: int, store: Optional[CommitStore] = None) -> PullRequest:
+    """ Returns a merged pull request of the repository.
+
+    :param Repository repo: The repository object.
+    :param int pr_num: The pull request number.
+    :param CommitStore store: An optional commit store to consult before fetching from GitHub.
+    :returns: The merged pull request.
+    :rtype: PullRequest
+    :raises ValueError: If the pull request is not merged.
+    """
+    data = None if store is None else store.get_merged_pull_request(repo.full_name, pr_num)
+    if data is not None:
+        return PullRequest(repo.requester, {}, data, completed=True)
+    pull_request = repo.get_pull(pr_num)
+    if not pull_request.merged:
+        raise ValueError(
+            f'Pull request #{pull_request.number} for branch {pull_request.head.ref} is not merged yet.'
+        )
+    if store is not None:
+        store.put_merged_pull_request(repo.full_name, pr_num, pull_request.raw_data)
+    return pull_request
+
+
+def compare(repo: Repository, base_sha: str, head_sha: str, store: Optional[CommitStore] = None) -> Comparison:
+    """ Compares two commits of the repository.
+
+    :param Repository repo: The repository object.
+    :param str base_sha: The base commit sha.
+    :param str head_sha: The head commit sha.
+    :param CommitStore store: An optional commit store to consult before fetching from GitHub.
+    :returns: The comparison of the commits.
+    :rtype: Comparison
+    """
+    comparison = None if store is None else store.get_comparison(base_sha, head_sha)
+    if comparison is None:
+        github_comparison = repo.compare(base_sha, head_sha)
+        comparison = Comparison(
+            merge_base_sha=github_comparison.merge_base_commit.sha,
+            commit_shas=[c.sha for c in github_comparison.commits]
+        )
+        if store is not None:
+            store.put_comparison(base_sha, head_sha, comparison)
+    return comparison
+
+
+class CommitGraph:
+    """ A local view of a span of the commit history of a branch, used to resolve commit ranges without compares.
+
+    :ivar Dict[str, List[str]] parents: The parents shas of every commit of the span.
+    """
+
+    def __init__(self, parents: Dict[str, List[str]], order: List[str]) -> None:
+        self.parents = parents
+        self._position = {sha: position for position, sha in enumerate(order)}
+
+    @classmethod
+    @step('list_commit_history')
+    def from_github(cls, repo: Repository, head_sha: str, stop_shas: Set[str], max_commits: int) -> 'CommitGraph':
+        """ Fetches the history of `head_sha` until all the `stop_shas` are listed or `max_commits` commits are listed.
+
+        :param Repository repo: The repository object.
+        :param str head_sha: The newest commit of the span.
+        :param Set[str] stop_shas: The oldest commits the span has to include.
+        :param int max_commits: The maximal number of commits to list.
+        :returns: A `CommitGraph` of the span.
+        :rtype: CommitGraph
+        """
+        parents, order, missing = {}, [], set(stop_shas)
+        for commit in repo.get_commits(sha=head_sha):
+            parents[commit.sha] = [p.sha for p in commit.parents]
+            order.append(commit.sha)
+            missing.discard(commit.sha)
+            if not missing or len(order) >= max_commits:
+                break
+        _LOGGER.info(
+            'Listed %d commits of the history of %s, %d stop commits missing.', len(order), head_sha, len(missing)
+        )
+        return cls(parents, order)
+
+    def commits_range(self, base_sha: str, head_sha: str) -> Optional[List[str]]:
+        """ Returns the commits reachable from `head_sha` but not from `base_sha`, by chronological order.
+
+        :param str base_sha: The base commit sha (excluded).
+        :param str head_sha: The head commit sha (included).
+        :returns: The commits shas of the range, or `None` if the range is not within the span, e.g. when it includes
+            commits of a merged branch older than the span.
+        :rtype: Optional[List[str]]
+        """
+        if base_sha not in self.parents or head_sha not in self.parents:
+            return None
+        excluded = self._ancestors(base_sha)
+        commits, pending = set(), [head_sha]
+        while pending:
+            current = pending.pop()
+            if current in commits or current in excluded:
+                continue
+            if current not in self.parents:
+                # the range leaves the span through a commit not known to be reachable from the base
+                return None
+            commits.add(current)
+            pending.extend(self.parents[current])
+        return sorted(commits, key=self._position.__getitem__, reverse=True)
+
+    def _ancestors(self, sha: str) -> Set[str]:
+        ancestors, pending = set(), [sha]
+        while pending:
+            current = pending.pop()
+            if current in ancestors or current not in self.parents:
+                continue
+            ancestors.add(current)
+            pending.extend(self.parents[current])
+        return ancestors
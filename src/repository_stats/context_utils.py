@@ -0,0 +1,34 @@
+import contextvars
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+
+
+T = TypeVar('T')
+
+
+def submit_in_context(executor: Executor, function: Callable[..., T], *args: Any, **kwargs: Any) -> Future:
+    """ Submits a function to an executor, to run in a copy of the current context.
+
+    The pool threads do not inherit the context variables of the submitting thread, such as the current
+    instrumentation step (see `repository_stats.metrics.step`).
+
+    :param Executor executor: The executor to submit the function to.
+    :param Callable function: The function to run.
+    :returns: The future of the function result.
+    :rtype: Future
+    """
+    return executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+
+def map_in_context(executor: Executor, function: Callable[..., T], iterable: Iterable) -> Iterator[T]:
+    """ Maps a function over an iterable on an executor, every call running in a copy of the current context.
+
+    :param Executor executor: The executor to run the calls on.
+    :param Callable function: The function to map.
+    :param Iterable iterable: The arguments of the calls.
+    :returns: An iterator of the results, in the order of the arguments.
+    :rtype: Iterator
+    """
+    context = contextvars.copy_context()
+    # a context can be entered by a single thread at a time, hence every call runs in its own copy
+    return executor.map(lambda item: context.copy().run(function, item), iterable)
@@ -0,0 +1,43 @@
+import logging
+from typing import Optional
+
+from github.PaginatedList import PaginatedList
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def count_items(paginated_list: PaginatedList) -> int:
+    """ Returns the total number of items of a paginated GitHub listing without downloading all of its pages.
+
+    Falls back to enumerating all the pages only when the total can not be resolved by `fast_count`.
+
+    :param PaginatedList paginated_list: The paginated GitHub listing to count.
+    :returns: The total number of items of the listing.
+    :rtype: int
+    """
+    total = fast_count(paginated_list)
+    if total is not None:
+        return total
+    _LOGGER.info('Counting the listing items by enumerating all of its pages.')
+    return sum(1 for _ in paginated_list)
+
+
+def fast_count(paginated_list: PaginatedList) -> Optional[int]:
+    """ Returns the total number of items of a paginated GitHub listing in a single request, if possible.
+
+    The total is resolved from the last page number of the `Link` header at `per_page=1`,
+    the `total_count` of search results, or the `totalCount` of GraphQL connections.
+
+    :param PaginatedList paginated_list: The paginated GitHub listing to count.
+    :returns: The total number of items of the listing, or `None` if it can not be resolved that way.
+    :rtype: Optional[int]
+    """
+    try:
+        total = paginated_list.totalCount
+        if total is None:
+            _LOGGER.debug('The listing does not provide a total count.')
+        return total
+    except (KeyError, IndexError, ValueError, RuntimeError):
+        _LOGGER.debug('Unable to resolve the total count of the listing.', exc_info=True)
+        return None
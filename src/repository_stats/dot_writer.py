@@ -0,0 +1,36 @@
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+
+
+_LOGGER = logging.getLogger(__name__)
+DotNode = Tuple[str, Dict[str, str]]
+DotEdge = Tuple[str, str]
+
+
+def write_digraph(output_file: Path, nodes: Iterable[DotNode], edges: Iterable[DotEdge], **attributes: str) -> None:
+    """ Writes a directed dot graph, streaming the nodes and edges to the file as they are iterated.
+
+    Unlike building a `pydot.Dot`, no graph object is held in memory, hence the memory use does not depend on the
+    graph size when the nodes and edges are generated lazily.
+
+    :param Path output_file: The output file to write the dot graph.
+    :param Iterable[DotNode] nodes: The nodes of the graph, as (name, attributes) pairs.
+    :param Iterable[DotEdge] edges: The edges of the graph, as (source name, destination name) pairs.
+    :param str attributes: The graph attributes (e.g. `rankdir='LR'`).
+    """
+    with output_file.open('w') as dot_file:
+        dot_file.write('digraph G {\n')
+        dot_file.writelines(f'{name}={_quote(value)};\n' for name, value in attributes.items())
+        dot_file.writelines(f'{_quote(name)} [{_attributes(node_attributes)}];\n' for name, node_attributes in nodes)
+        dot_file.writelines(f'{_quote(source)} -> {_quote(destination)};\n' for source, destination in edges)
+        dot_file.write('}\n')
+    _LOGGER.debug('The dot graph has been written to %s.', output_file)
+
+
+def _attributes(attributes: Dict[str, str]) -> str:
+    return ', '.join(f'{name}={_quote(value)}' for name, value in attributes.items())
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
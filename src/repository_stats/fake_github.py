@@ -0,0 +1,284 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import ceil
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Type, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from repository_stats.transport import HttpRequest, HttpResponse, Middleware, Send
+
+
+_LOGGER = logging.getLogger(__name__)
+BASE_URL_PLACEHOLDER = '{base_url}'
+_JSON_HEADERS = {'content-type': 'application/json; charset=utf-8'}
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+# the bodies are served decoded, hence the recorded transfer headers do not apply
+_TRANSFER_HEADERS = {'content-length', 'content-encoding', 'transfer-encoding', 'connection'}
+
+
+def fixture_key(request: HttpRequest) -> str:
+    """ Returns the key of a request in the fixtures, independent of the server and of the query parameters order.
+
+    :param HttpRequest request: The request, its URL may be absolute or relative.
+    :returns: The verb, the path and the sorted query of the request, and the digest of its body, if any.
+    :rtype: str
+    """
+    url = urlsplit(request.url)
+    query = urlencode(sorted(parse_qsl(url.query, keep_blank_values=True)))
+    key = f'{request.verb} {url.path}?{query}' if query else f'{request.verb} {url.path}'
+    if request.body:
+        key = f'{key} {hashlib.sha256(_canonical_body(request.body)).hexdigest()}'
+    return key
+
+
+def load_fixtures(path: Path) -> Dict[str, HttpResponse]:
+    """ Loads the recorded responses of a fixtures file, the latest recording of a request wins.
+
+    :param Path path: The JSON lines fixtures file.
+    :returns: The recorded responses by their `fixture_key`.
+    :rtype: Dict[str, HttpResponse]
+    """
+    fixtures = {}
+    with path.open(encoding='utf-8') as fixtures_file:
+        for line in fixtures_file:
+            entry = json.loads(line)
+            fixtures[entry['key']] = HttpResponse(status=entry['status'], headers=entry['headers'], body=entry['body'])
+    return fixtures
+
+
+def page_response(
+    base_url: str,
+    path: str,
+    params: Dict[str, Any],
+    items: List[Any],
+    per_page: int,
+    page: int,
+    wrap: Callable[[List[Any]], Any] = list
+) -> HttpResponse:
+    """ Renders a page of a GitHub listing, with the `Link` header to its next and last pages.
+
+    :param str base_url: The base URL of the links.
+    :param str path: The path of the listing.
+    :param Dict[str, Any] params: The query parameters of the listing, besides the pagination ones.
+    :param List[Any] items: All the items of the listing.
+    :param int per_page: The page size.
+    :param int page: The page number, starting from 1.
+    :param wrap: Renders the JSON body of the page from its items.
+    :returns: The page response.
+    :rtype: HttpResponse
+    """
+    num_pages = max(1, ceil(len(items) / per_page))
+    headers = dict(_JSON_HEADERS)
+    if page < num_pages:
+        headers['link'] = (
+            f'<{_page_url(base_url, path, params, per_page, page + 1)}>; rel="next", '
+            f'<{_page_url(base_url, path, params, per_page, num_pages)}>; rel="last"'
+        )
+    body = json.dumps(wrap(items[(page - 1) * per_page:page * per_page]))
+    return HttpResponse(status=200, headers=headers, body=body)
+
+
+def base_url(request: HttpRequest) -> str:
+    """ Returns the base URL of a request as PyGithub expects it in the links, without a default port. """
+    parts = urlsplit(request.url)
+    if parts.port == _DEFAULT_PORTS.get(parts.scheme):
+        return f'{parts.scheme}://{parts.hostname}'
+    return f'{parts.scheme}://{parts.netloc}'
+
+
+def json_response(data: Any, status: int = 200) -> HttpResponse:
+    """ Returns a JSON response of the fake GitHub API. """
+    return HttpResponse(status=status, headers=dict(_JSON_HEADERS), body=json.dumps(data))
+
+
+class FixtureRecorder:
+    """ A transport middleware recording the GitHub API responses into a JSON lines fixtures file.
+
+    The base URL of the API is replaced by a placeholder in the recorded headers and bodies, so the fixtures can be
+    replayed by a `FakeGitHub` server on any address. Install it as the outermost middleware to record the responses
+    as PyGithub receives them.
+
+    :ivar Path path: The fixtures file, the recordings are appended to it.
+    """
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, request: HttpRequest, send: Send) -> HttpResponse:
+        response = send(request)
+        base_urls = _base_urls(request.url)
+        recorded = HttpResponse(
+            status=response.status,
+            headers={name: _template(value, base_urls) for name, value in response.headers.items()},
+            body=_template(response.body, base_urls)
+        )
+        with self._lock, self.path.open('a', encoding='utf-8') as fixtures_file:
+            fixtures_file.write(_fixture_line(fixture_key(request), recorded))
+        return response
+
+
+class ReplayBackend:
+    """ Answers the GitHub API requests with recorded responses, unknown requests are answered with a 404.
+
+    :ivar Dict[str, HttpResponse] fixtures: The recorded responses by their `fixture_key`.
+    """
+
+    def __init__(self, fixtures: Dict[str, HttpResponse]) -> None:
+        self.fixtures = fixtures
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        response = self.fixtures.get(fixture_key(request))
+        if response is None:
+            _LOGGER.debug('No recorded response for %s %s', request.verb, request.url)
+            return json_response({'message': 'Not Found'}, status=404)
+        request_base_url = base_url(request)
+        return HttpResponse(
+            status=response.status,
+            headers={
+                name: value.replace(BASE_URL_PLACEHOLDER, request_base_url) for name, value in response.headers.items()
+            },
+            body=response.body.replace(BASE_URL_PLACEHOLDER, request_base_url)
+        )
+
+
+def backend_middleware(backend: Send) -> Middleware:
+    """ Returns a transport middleware answering the GitHub API requests in memory with a backend, e.g. a
+    `ReplayBackend`, so the tool runs offline without a `FakeGitHub` server.
+
+    :param Send backend: Answers the requests.
+    :returns: A terminal middleware, the requests are never sent.
+    :rtype: Middleware
+    """
+    return lambda request, send: backend(request)
+
+
+class FakeGitHub:
+    """ A local HTTP server answering the GitHub API requests with a backend, e.g. a `ReplayBackend`.
+
+    The server runs in a child process, so it shares neither the interpreter lock nor the memory of the measured
+    client. Every request is answered after `latency` seconds, concurrent requests are served concurrently.
+    The backend must be picklable.
+
+    :ivar Send backend: Answers the requests, the request URLs are absolute URLs of the server.
+    :ivar float latency: The delay of every response in seconds.
+    :ivar str base_url: The base URL of the server, once started.
+    """
+
+    def __init__(self, backend: Send, latency: float = 0.0) -> None:
+        self.backend = backend
+        self.latency = latency
+        self.base_url: Optional[str] = None
+        self._process: Optional[multiprocessing.Process] = None
+
+    def __enter__(self) -> 'FakeGitHub':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def start(self) -> str:
+        """ Starts the server.
+
+        :returns: The base URL of the server.
+        :rtype: str
+        """
+        context = multiprocessing.get_context('spawn')
+        receiver, sender = context.Pipe(duplex=False)
+        self._process = context.Process(
+            target=_serve, args=(self.backend, self.latency, sender), name='fake-github', daemon=True
+        )
+        self._process.start()
+        # the server end is closed here, so that the receiver fails instead of hanging if the server dies
+        sender.close()
+        self.base_url = f'http://127.0.0.1:{receiver.recv()}'
+        _LOGGER.info('Fake GitHub API listening on %s', self.base_url)
+        return self.base_url
+
+    def stop(self) -> None:
+        """ Stops the server. """
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+
+def _serve(backend: Send, latency: float, sender: Connection) -> None:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _handler_class(backend, latency))
+    sender.send(server.server_port)
+    sender.close()
+    server.serve_forever()
+
+
+def _handler_class(backend: Send, latency: float) -> Type[BaseHTTPRequestHandler]:
+
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # the headers and the body are written separately, Nagle's algorithm would delay the body
+        disable_nagle_algorithm = True
+
+        def do_GET(self) -> None:
+            self._reply()
+
+        def do_POST(self) -> None:
+            self._reply()
+
+        def log_message(self, format: str, *args: Any) -> None:
+            _LOGGER.debug(format, *args)
+
+        def _reply(self) -> None:
+            length = int(self.headers.get('Content-Length', 0))
+            request = HttpRequest(
+                verb=self.command,
+                url=f'http://{self.headers["Host"]}{self.path}',
+                headers=dict(self.headers),
+                body=self.rfile.read(length) if length else None
+            )
+            time.sleep(latency)
+            response = backend(request)
+            payload = response.body.encode('utf-8')
+            self.send_response(response.status)
+            for name, value in response.headers.items():
+                if name not in _TRANSFER_HEADERS:
+                    self.send_header(name, value)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return _Handler
+
+
+def _canonical_body(body: Union[str, bytes]) -> bytes:
+    try:
+        return json.dumps(json.loads(body), sort_keys=True).encode('utf-8')
+    except ValueError:
+        return body if isinstance(body, bytes) else body.encode('utf-8')
+
+
+def _base_urls(url: str) -> List[str]:
+    # the transport URLs hold an explicit port, while the GitHub API bodies do not
+    parts = urlsplit(url)
+    return [f'{parts.scheme}://{parts.netloc}', f'{parts.scheme}://{parts.hostname}']
+
+
+def _template(text: str, base_urls: List[str]) -> str:
+    for base_url in base_urls:
+        text = text.replace(base_url, BASE_URL_PLACEHOLDER)
+    return text
+
+
+def _page_url(base_url: str, path: str, params: Dict[str, Any], per_page: int, page: int) -> str:
+    return f'{base_url}{path}?{urlencode({**params, "per_page": per_page, "page": page})}'
+
+
+def _fixture_line(key: str, response: HttpResponse) -> str:
+    entry = {'key': key, 'status': response.status, 'headers': response.headers, 'body': response.body}
+    return json.dumps(entry) + '\n'
@@ -0,0 +1,137 @@
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from github import GithubException, UnknownObjectException
+from github.Repository import Repository
+
+from repository_stats.context_utils import submit_in_context
+from repository_stats.logging_setup import lazy
+from repository_stats.metrics import step
+from repository_stats.pull_request_store import PullRequestStore
+from repository_stats.repository_summary import (
+    RepositorySummary, count_pull_requests_by_author, get_contributors, rank_contributors, summarize_repository
+)
+
+
+_LOGGER = logging.getLogger(__name__)
+_PULL_REQUESTS_PAGE_SIZE = 100
+
+_REPOSITORY_QUERY = '''
+query RepositorySummary($owner: String!, $name: String!, $releases: Int!) {
+  repository(owner: $owner, name: $name) {
+    name
+    forkCount
+    stargazerCount
+    pullRequests(states: OPEN) { totalCount }
+    releases(first: $releases, orderBy: {field: CREATED_AT, direction: DESC}) { nodes { tagName } }
+  }
+}
+'''
+
+_PULL_REQUEST_AUTHORS_QUERY = '''
+query PullRequestAuthors($owner: String!, $name: String!, $pageSize: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(first: $pageSize, after: $cursor) {
+      pageInfo { hasNextPage endCursor }
+      nodes { author { login } }
+    }
+  }
+}
+'''
+
+
+@step('summarize_repository_graphql')
+def summarize_repository_graphql(
+    repo: Repository,
+    recent_releases: int = 3,
+    concurrency: int = 1,
+    pull_request_store: Optional[PullRequestStore] = None
+) -> RepositorySummary:
+    """ Summarizes a GitHub repository using the GitHub GraphQL API.
+
+    The repository metadata, open pull requests count and latest releases are fetched in a single query,
+    and the pull requests authors are fetched in pages of 100 selecting only the author login.
+    The contributors are not exposed by the GraphQL API, hence they are fetched from the REST API.
+    With a pull requests store, the authors are counted from the store instead, synchronized from the REST API.
+    The queries run concurrently by up to `concurrency` threads.
+    Falls back to the REST `summarize_repository` if the GraphQL API fails.
+
+    :param Repository repo: A GitHub repository.
+    :param int recent_releases: The number of recent releases to return.
+    :param int concurrency: The maximal number of concurrent fetches.
+    :param PullRequestStore pull_request_store: The store of the pull requests authors, synchronized incrementally
+        instead of querying all the pull requests.
+    :returns: A `RepositorySummary` object.
+    :rtype: RepositorySummary
+    """
+    _LOGGER.info('summarizing repository %s using GraphQL', repo.full_name)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='summary') as executor:
+        repository = submit_in_context(executor, _query_repository, repo, recent_releases)
+        if pull_request_store is None:
+            pull_requests_per_author = submit_in_context(executor, count_pull_requests_by_author_graphql, repo)
+        else:
+            pull_requests_per_author = submit_in_context(
+                executor, count_pull_requests_by_author, repo, concurrency, pull_request_store
+            )
+        contributors = submit_in_context(executor, get_contributors, repo, concurrency)
+        try:
+            summary = RepositorySummary(
+                name=repository.result()['name'],
+                releases=[r['tagName'] for r in repository.result()['releases']['nodes']],
+                forks=repository.result()['forkCount'],
+                stars=repository.result()['stargazerCount'],
+                num_open_pull_requests=repository.result()['pullRequests']['totalCount'],
+                num_contributors=len(contributors.result()),
+                sorted_contributors=rank_contributors(contributors.result(), pull_requests_per_author.result())
+            )
+        except GithubException:
+            _LOGGER.exception('GraphQL summary failed for repository %s, falling back to REST.', repo.full_name)
+            return summarize_repository(repo, recent_releases, concurrency, pull_request_store)
+    _LOGGER.info('repository summary has been completed.')
+    _LOGGER.debug('%s', summary)
+    return summary
+
+
+@step('count_pull_requests_by_author_graphql')
+def count_pull_requests_by_author_graphql(repo: Repository) -> Counter:
+    """ Counts all the pull requests (closed and open) of the repository per author login using GraphQL.
+
+    :param Repository repo: The repository to count the pull requests for.
+    :returns: A counter of the amount of pull requests per author login.
+    :rtype: Counter
+    """
+    pull_requests_per_author = Counter()
+    variables = {**_repository_variables(repo), 'pageSize': _PULL_REQUESTS_PAGE_SIZE, 'cursor': None}
+    while True:
+        pull_requests = _graphql_repository(repo, _PULL_REQUEST_AUTHORS_QUERY, variables)['pullRequests']
+        pull_requests_per_author.update(
+            pr['author']['login'] for pr in pull_requests['nodes'] if pr['author'] is not None
+        )
+        if not pull_requests['pageInfo']['hasNextPage']:
+            break
+        variables['cursor'] = pull_requests['pageInfo']['endCursor']
+    _LOGGER.debug('Pull requests per author: %s', lazy(dict, pull_requests_per_author))
+    return pull_requests_per_author
+
+
+@step('query_repository')
+def _query_repository(repo: Repository, recent_releases: int) -> Dict[str, Any]:
+    return _graphql_repository(repo, _REPOSITORY_QUERY, {**_repository_variables(repo), 'releases': recent_releases})
+
+
+def _graphql_repository(repo: Repository, query: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+    # PyGithub raises on the responses with errors, the partial responses are rejected as well
+    headers, data = repo.requester.graphql_query(query, variables)
+    if data.get('errors'):
+        raise GithubException(400, data, headers, 'The GraphQL query failed.')
+    repository = (data.get('data') or {}).get('repository')
+    if repository is None:
+        raise UnknownObjectException(404, data, headers, f'The repository {repo.full_name} was not found.')
+    return repository
+
+
+def _repository_variables(repo: Repository) -> Dict[str, str]:
+    owner, _, name = repo.full_name.partition('/')
+    return {'owner': owner, 'name': name}
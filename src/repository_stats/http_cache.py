@@ -0,0 +1,163 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from repository_stats.metrics import record_cache
+from repository_stats.transport import HttpRequest, HttpResponse, Send
+
+
+_LOGGER = logging.getLogger(__name__)
+_CACHE_FILE = 'http_cache.sqlite3'
+_CACHE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+)
+'''
+_RATE_LIMIT_HEADERS_PREFIX = 'x-ratelimit-'
+_ACCESS_FLUSH_READS = 100
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class HttpCache:
+    """ A persistent conditional requests cache for the GitHub API, to be installed as a transport middleware.
+
+    Successful `GET` responses carrying an `ETag` or `Last-Modified` header are stored on disk, and replayed
+    as conditional requests (`If-None-Match` / `If-Modified-Since`). When GitHub answers `304 Not Modified`
+    the cached response is served, and the request does not count against the rate limit.
+    The least recently used responses are evicted when the cache exceeds its size limits. The access times of the
+    reads are kept in memory, and written along the next stored response or once 100 entries were read.
+
+    :ivar Path cache_dir: The directory of the cache database.
+    :ivar int max_bytes: The maximal total size of the cached bodies.
+    :ivar int max_entries: The maximal amount of cached responses, unlimited if `None`.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = DEFAULT_MAX_BYTES, max_entries: Optional[int] = None) -> None:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._accessed: Dict[str, float] = {}
+        self._db = sqlite3.connect(cache_dir / _CACHE_FILE, check_same_thread=False)
+        self._db.execute(_CACHE_SCHEMA)
+        self._db.commit()
+
+    def __call__(self, request: HttpRequest, send: Send) -> HttpResponse:
+        if request.verb != 'GET':
+            return send(request)
+        key = _cache_key(request)
+        cached = self._get(key)
+        if cached is None:
+            record_cache('http', hit=False)
+            response = send(request)
+        else:
+            etag, last_modified, cached_response = cached
+            conditions = {}
+            if etag:
+                conditions['If-None-Match'] = etag
+            if last_modified:
+                conditions['If-Modified-Since'] = last_modified
+            response = send(request.with_headers(**conditions))
+            record_cache('http', hit=response.status == 304)
+            if response.status == 304:
+                _LOGGER.debug('HTTP cache hit: %s', request.url)
+                return _refresh_rate_limit(cached_response, response)
+        if response.status == 200 and ('etag' in response.headers or 'last-modified' in response.headers):
+            self._put(key, response)
+        return response
+
+    def clear(self) -> None:
+        """ Removes all the cached responses. """
+        with self._lock:
+            self._accessed.clear()
+            self._db.execute('DELETE FROM responses')
+            self._db.commit()
+
+    def _get(self, key: str) -> Optional[Tuple[Optional[str], Optional[str], HttpResponse]]:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT etag, last_modified, status, headers, body FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._accessed[key] = time.time()
+            if len(self._accessed) >= _ACCESS_FLUSH_READS:
+                self._flush_accessed()
+                self._db.commit()
+        etag, last_modified, status, headers, body = row
+        return etag, last_modified, HttpResponse(status=status, headers=json.loads(headers), body=body)
+
+    def _put(self, key: str, response: HttpResponse) -> None:
+        size = len(response.body.encode())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    key,
+                    response.headers.get('etag'),
+                    response.headers.get('last-modified'),
+                    response.status,
+                    json.dumps(response.headers),
+                    response.body,
+                    size,
+                    time.time(),
+                )
+            )
+            self._flush_accessed()
+            self._evict()
+            self._db.commit()
+
+    def _flush_accessed(self) -> None:
+        self._db.executemany(
+            'UPDATE responses SET accessed = ? WHERE key = ?',
+            [(accessed, key) for key, accessed in self._accessed.items()]
+        )
+        self._accessed.clear()
+
+    def _evict(self) -> None:
+        total_bytes, total_entries = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0), COUNT(*) FROM responses'
+        ).fetchone()
+        if not self._exceeds_limits(total_bytes, total_entries):
+            return
+        for key, size in self._db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall():
+            if not self._exceeds_limits(total_bytes, total_entries):
+                break
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total_bytes -= size
+            total_entries -= 1
+            _LOGGER.debug('Evicted HTTP cache entry %s.', key)
+
+    def _exceeds_limits(self, total_bytes: int, total_entries: int) -> bool:
+        return total_bytes > self.max_bytes or (self.max_entries is not None and total_entries > self.max_entries)
+
+
+def _cache_key(request: HttpRequest) -> str:
+    # the credentials and media type are part of the key, since they affect the response content
+    headers = {k.lower(): v for k, v in request.headers.items()}
+    identity = '\n'.join([request.url, headers.get('authorization', ''), headers.get('accept', '')])
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+def _refresh_rate_limit(cached_response: HttpResponse, response: HttpResponse) -> HttpResponse:
+    rate_limit_headers = {k: v for k, v in response.headers.items() if k.startswith(_RATE_LIMIT_HEADERS_PREFIX)}
+    return HttpResponse(
+        status=cached_response.status,
+        headers={**cached_response.headers, **rate_limit_headers},
+        body=cached_response.body
+    )
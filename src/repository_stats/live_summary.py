@@ -0,0 +1,426 @@
+import hashlib
+import hmac
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from attr import asdict, define, evolve, field
+from attr.validators import instance_of
+from github import Github
+from more_itertools import first
+
+from repository_stats.batch import Summarize
+from repository_stats.metrics import REGISTRY, Counter, step
+from repository_stats.repository_summary import RepositorySummary, summarize_repository
+
+
+_LOGGER = logging.getLogger(__name__)
+DEFAULT_RECONCILE_INTERVAL = 86400.0
+WEBHOOK_PATH = '/webhook'
+_STORE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS live_summaries (
+    repository TEXT PRIMARY KEY, summary TEXT NOT NULL, cursor TEXT, reconciled_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS applied_events (
+    repository TEXT NOT NULL, event_id TEXT NOT NULL, PRIMARY KEY (repository, event_id)
+);
+'''
+_FEED_EVENT_TYPE = re.compile(r'(?<!^)(?=[A-Z])')
+_SUMMARY_ROUTE = re.compile(r'^/repos/(?P<repository>[^/]+/[^/]+)/summary$')
+_SIGNATURE_PREFIX = 'sha256='
+LIVE_EVENTS = REGISTRY.register(Counter(
+    'repository_stats_live_events_total', 'Repository events applied to the live summaries.', ['event', 'action']
+))
+LIVE_RECONCILIATIONS = REGISTRY.register(Counter(
+    'repository_stats_live_reconciliations_total', 'Full rescans of the live summaries.', ['reason']
+))
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class RepositoryEvent:
+    """ Represents an event of a repository, from the events feed or a webhook delivery.
+
+    :ivar str id: The event id, or the webhook delivery id.
+    :ivar str repository: The repository full name.
+    :ivar str name: The webhook event name, e.g. `pull_request` (the feed `WatchEvent` is a `star` event).
+    :ivar Optional[str] action: The event action, e.g. `opened`.
+    :ivar Dict[str, Any] payload: The event payload.
+    """
+    id: str = field(validator=instance_of(str))
+    repository: str = field(validator=instance_of(str))
+    name: str = field(validator=instance_of(str))
+    action: Optional[str] = field(default=None)
+    payload: Dict[str, Any] = field(factory=dict)
+
+    @classmethod
+    def from_feed(cls, event: Dict[str, Any]) -> 'RepositoryEvent':
+        """ Parses an event of the repository events feed (`GET /repos/{owner}/{repo}/events`). """
+        name = _FEED_EVENT_TYPE.sub('_', event['type'].removesuffix('Event')).lower()
+        payload = event.get('payload') or {}
+        # a `WatchEvent` is sent when the repository is starred, unstarring is not in the feed
+        if name == 'watch':
+            return cls(id=str(event['id']), repository=event['repo']['name'], name='star', action='created')
+        return cls(
+            id=str(event['id']), repository=event['repo']['name'], name=name, action=payload.get('action'),
+            payload=payload
+        )
+
+    @classmethod
+    def from_webhook(cls, name: str, delivery: str, payload: Dict[str, Any]) -> 'RepositoryEvent':
+        """ Parses a webhook delivery, given its `X-GitHub-Event` and `X-GitHub-Delivery` headers. """
+        return cls(
+            id=delivery, repository=payload['repository']['full_name'], name=name, action=payload.get('action'),
+            payload=payload
+        )
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class LiveState:
+    """ Represents the live summary of a repository.
+
+    :ivar RepositorySummary summary: The summary, as of the last reconciliation and the events applied since.
+    :ivar Optional[str] cursor: The id of the newest applied event of the events feed.
+    :ivar float reconciled_at: The time of the last full rescan, in seconds since the epoch.
+    """
+    summary: RepositorySummary = field(validator=instance_of(RepositorySummary))
+    cursor: Optional[str] = field(default=None)
+    reconciled_at: float = field(validator=instance_of(float))
+
+
+def apply_event(summary: RepositorySummary, event: RepositoryEvent, recent_releases: int = 3) -> RepositorySummary:
+    """ Applies the delta of an event to a repository summary.
+
+    Stars, forks, opened, closed and reopened pull requests and published or deleted releases are applied, the other
+    events are ignored. The fields unknown to the summary are left unknown.
+
+    :param RepositorySummary summary: The summary to update.
+    :param RepositoryEvent event: The event to apply.
+    :param int recent_releases: The number of recent releases of the summary.
+    :returns: The updated summary.
+    :rtype: RepositorySummary
+    """
+    if event.name == 'star' and event.action in ('created', 'deleted') and summary.stars is not None:
+        return evolve(summary, stars=summary.stars + (1 if event.action == 'created' else -1))
+    if event.name == 'fork' and summary.forks is not None:
+        return evolve(summary, forks=summary.forks + 1)
+    if event.name == 'pull_request' and event.action in ('opened', 'reopened', 'closed'):
+        if summary.num_open_pull_requests is not None:
+            delta = -1 if event.action == 'closed' else 1
+            return evolve(summary, num_open_pull_requests=summary.num_open_pull_requests + delta)
+    if event.name == 'release' and event.action in ('published', 'deleted') and summary.releases is not None:
+        try:
+            tag = event.payload['release']['tag_name']
+        except (KeyError, TypeError):
+            _LOGGER.warning('Ignored the release event %s of %s without a release tag.', event.id, event.repository)
+            return summary
+        releases = [release for release in summary.releases if release != tag]
+        # a deleted release is replaced by the previous one at the next reconciliation
+        return evolve(summary, releases=[tag, *releases][:recent_releases] if event.action == 'published' else releases)
+    return summary
+
+
+class LiveSummaryStore:
+    """ A local store of the live summaries of repositories, updated by their events.
+
+    The ids of the applied events are kept as well, hence an event delivered twice is applied once.
+
+    :ivar Path path: The path of the store database.
+    """
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_STORE_SCHEMA)
+        self._db.commit()
+
+    def load(self, repository: str) -> Optional[LiveState]:
+        """ Returns the live summary of a repository, `None` if never reconciled. """
+        with self._lock:
+            return self._load(repository)
+
+    def reconcile(self, repository: str, state: LiveState) -> None:
+        """ Replaces the live summary of a repository by the result of a full rescan. """
+        with self._lock:
+            self._save(repository, state)
+            self._db.commit()
+
+    def apply(
+        self,
+        repository: str,
+        events: Iterable[RepositoryEvent],
+        recent_releases: int = 3,
+        cursor: Optional[str] = None
+    ) -> int:
+        """ Applies the events not applied yet to the live summary of a repository, atomically.
+
+        :param str repository: The repository full name.
+        :param Iterable[RepositoryEvent] events: The events, by chronological order.
+        :param int recent_releases: The number of recent releases of the summary.
+        :param Optional[str] cursor: The new events feed cursor, if the events are read from the feed.
+        :returns: The number of applied events, the events of a repository never reconciled are dropped.
+        :rtype: int
+        """
+        with self._lock:
+            state = self._load(repository)
+            if state is None:
+                _LOGGER.warning('Dropped the events of %s, its live summary was never reconciled.', repository)
+                return 0
+            summary, applied = state.summary, 0
+            for event in events:
+                inserted = self._db.execute(
+                    'INSERT OR IGNORE INTO applied_events VALUES (?, ?)', (repository, event.id)
+                ).rowcount
+                if inserted:
+                    summary = apply_event(summary, event, recent_releases)
+                    LIVE_EVENTS.inc(event=event.name, action=str(event.action))
+                    applied += 1
+            self._save(repository, evolve(state, summary=summary, cursor=cursor or state.cursor))
+            self._db.commit()
+        return applied
+
+    def _load(self, repository: str) -> Optional[LiveState]:
+        row = self._db.execute(
+            'SELECT summary, cursor, reconciled_at FROM live_summaries WHERE repository = ?', (repository,)
+        ).fetchone()
+        if row is None:
+            return None
+        return LiveState(summary=RepositorySummary(**json.loads(row[0])), cursor=row[1], reconciled_at=row[2])
+
+    def _save(self, repository: str, state: LiveState) -> None:
+        self._db.execute(
+            'INSERT OR REPLACE INTO live_summaries VALUES (?, ?, ?, ?)',
+            (repository, json.dumps(asdict(state.summary)), state.cursor, state.reconciled_at)
+        )
+
+
+class LiveSummaryUpdater:
+    """ Keeps the stars, forks, open pull requests and releases of repository summaries up to date from their events.
+
+    The events are read from the repository events feed (see `poll`), or pushed from webhook deliveries or recorded
+    event files (see `ingest`), and applied as deltas to the stored summaries. The summaries are fully rescanned only
+    periodically, to reconcile the deltas (see `reconcile_if_due`), or when the feed lost events since the last poll.
+    The contributors are not updated by the events, hence they are as of the last reconciliation.
+
+    :ivar Github github: The GitHub client.
+    :ivar LiveSummaryStore store: The store of the live summaries.
+    :ivar int recent_releases: The number of recent releases of the summaries.
+    :ivar int concurrency: The maximal number of concurrent fetches of a rescan.
+    :ivar float reconcile_interval: The interval in seconds between the full rescans of a summary.
+    :ivar Summarize summarize: The summary backend of the rescans.
+    """
+
+    def __init__(
+        self,
+        github: Github,
+        store: LiveSummaryStore,
+        recent_releases: int = 3,
+        concurrency: int = 1,
+        reconcile_interval: float = DEFAULT_RECONCILE_INTERVAL,
+        summarize: Summarize = summarize_repository,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.github = github
+        self.store = store
+        self.recent_releases = recent_releases
+        self.concurrency = concurrency
+        self.reconcile_interval = reconcile_interval
+        self.summarize = summarize
+        self._clock = clock
+
+    def summary(self, full_name: str) -> Optional[RepositorySummary]:
+        """ Returns the live summary of a repository, `None` if never reconciled. """
+        state = self.store.load(full_name)
+        return None if state is None else state.summary
+
+    @step('reconcile_live_summary')
+    def reconcile(self, full_name: str, reason: str = 'due') -> RepositorySummary:
+        """ Rescans the summary of a repository, and moves its events feed cursor to the newest event.
+
+        The cursor is read before the rescan, hence the events of the rescan time may be counted twice, until the
+        next reconciliation.
+
+        :param str full_name: The repository full name.
+        :param str reason: Why the summary is rescanned, in the metrics.
+        :returns: The rescanned summary.
+        :rtype: RepositorySummary
+        """
+        repo = self.github.get_repo(full_name)
+        newest = first(repo.get_events().get_page(0), None)
+        summary = self.summarize(repo, self.recent_releases, concurrency=self.concurrency)
+        self.store.reconcile(full_name, LiveState(
+            summary=summary, cursor=None if newest is None else str(newest.id), reconciled_at=float(self._clock())
+        ))
+        LIVE_RECONCILIATIONS.inc(reason=reason)
+        _LOGGER.info('Reconciled the live summary of %s (%s).', full_name, reason)
+        return summary
+
+    def reconcile_if_due(self, full_name: str) -> bool:
+        """ Rescans the summary of a repository if never reconciled or its last reconciliation is too old.
+
+        :param str full_name: The repository full name.
+        :returns: Whether the summary was rescanned.
+        :rtype: bool
+        """
+        state = self.store.load(full_name)
+        if state is not None and self._clock() < state.reconciled_at + self.reconcile_interval:
+            return False
+        self.reconcile(full_name, 'missing' if state is None else 'due')
+        return True
+
+    @step('poll_events')
+    def poll(self, full_name: str) -> int:
+        """ Applies the events of the repository events feed since the last poll, reconciling the summary if due.
+
+        The feed is read from the newest event down to the cursor. If the cursor is no longer in the feed, which keeps
+        a limited amount of recent events, events were lost and the summary is rescanned instead.
+
+        :param str full_name: The repository full name.
+        :returns: The number of applied events.
+        :rtype: int
+        """
+        if self.reconcile_if_due(full_name):
+            return 0
+        cursor = self.store.load(full_name).cursor
+        events: List[RepositoryEvent] = []
+        for event in self.github.get_repo(full_name).get_events():
+            if cursor is not None and int(event.id) <= int(cursor):
+                break
+            events.append(RepositoryEvent.from_feed(event.raw_data))
+        else:
+            if cursor is not None:
+                _LOGGER.warning('Lost events of %s since the event %s, rescanning it.', full_name, cursor)
+                self.reconcile(full_name, 'gap')
+                return 0
+        if not events:
+            return 0
+        applied = self.store.apply(full_name, reversed(events), self.recent_releases, cursor=events[0].id)
+        _LOGGER.info('Applied %d events of %s.', applied, full_name)
+        return applied
+
+    def ingest(self, events: Iterable[RepositoryEvent]) -> int:
+        """ Applies pushed events, e.g. webhook deliveries or recorded events, by chronological order.
+
+        :param Iterable[RepositoryEvent] events: The events, of any repositories.
+        :returns: The number of applied events.
+        :rtype: int
+        """
+        per_repository: Dict[str, List[RepositoryEvent]] = defaultdict(list)
+        for event in events:
+            per_repository[event.repository].append(event)
+        return sum(
+            self.store.apply(repository, repository_events, self.recent_releases)
+            for repository, repository_events in per_repository.items()
+        )
+
+
+def read_events(path: Path) -> List[RepositoryEvent]:
+    """ Reads recorded repository events, e.g. as a stand-in for the events feed or the webhooks.
+
+    The file is either a JSON array of feed events, as returned by the events feed (newest first), or one JSON record
+    per line by chronological order: a feed event, or a webhook delivery as `{"event", "delivery", "payload"}`
+    (as recorded by `serve_webhooks`).
+
+    :param Path path: The events file.
+    :returns: The events by chronological order.
+    :rtype: List[RepositoryEvent]
+    """
+    text = path.read_text()
+    if text.lstrip().startswith('['):
+        return [RepositoryEvent.from_feed(event) for event in reversed(json.loads(text))]
+    return [_parse_record(json.loads(line)) for line in text.splitlines() if line.strip()]
+
+
+def serve_webhooks(
+    updater: LiveSummaryUpdater,
+    port: int,
+    host: str = '127.0.0.1',
+    secret: Optional[str] = None,
+    record: Optional[Path] = None
+) -> ThreadingHTTPServer:
+    """ Creates the server receiving the repositories webhooks, to be run with `serve_forever`.
+
+    The routes are:
+
+    - `POST /webhook`: applies a webhook delivery to the live summaries.
+    - `GET /repos/{owner}/{repo}/summary`: the live summary of a repository.
+
+    :param LiveSummaryUpdater updater: The updater applying the deliveries.
+    :param int port: The local port to listen on, 0 for any free port.
+    :param str host: The address to listen on.
+    :param Optional[str] secret: The webhook secret, the deliveries are verified by their signature if given.
+    :param Optional[Path] record: A file to append the deliveries to, readable by `read_events`.
+    :returns: The server.
+    :rtype: ThreadingHTTPServer
+    """
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            if self.path != WEBHOOK_PATH:
+                self._send(404, {'error': f'Unknown route {self.path}.'})
+                return
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if secret is not None and not _valid_signature(secret, body, self.headers.get('X-Hub-Signature-256')):
+                self._send(401, {'error': 'Invalid signature.'})
+                return
+            name, delivery = self.headers.get('X-GitHub-Event', ''), self.headers.get('X-GitHub-Delivery', '')
+            try:
+                payload = json.loads(body)
+                if 'repository' not in payload:
+                    # e.g. the `ping` event of an organization webhook
+                    self._send(200, {'applied': 0})
+                    return
+                event = RepositoryEvent.from_webhook(name, delivery, payload)
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                _LOGGER.warning('Rejected the malformed webhook delivery %s: %r', delivery, e)
+                self._send(400, {'error': f'Malformed {name} webhook payload.'})
+                return
+            if record is not None:
+                with lock, record.open('a') as record_file:
+                    record_file.write(json.dumps({'event': name, 'delivery': delivery, 'payload': payload}) + '\n')
+            applied = updater.ingest([event])
+            self._send(202, {'applied': applied})
+
+        def do_GET(self) -> None:
+            match = _SUMMARY_ROUTE.match(self.path)
+            summary = None if match is None else updater.summary(match['repository'])
+            if summary is None:
+                self._send(404, {'error': f'No live summary at {self.path}.'})
+                return
+            self._send(200, asdict(summary))
+
+        def _send(self, status: int, data: Any) -> None:
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            _LOGGER.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    _LOGGER.info('Receiving the webhooks at http://%s:%d%s', host, server.server_port, WEBHOOK_PATH)
+    return server
+
+
+def _parse_record(record: Dict[str, Any]) -> RepositoryEvent:
+    if 'delivery' in record:
+        return RepositoryEvent.from_webhook(record['event'], record['delivery'], record['payload'])
+    return RepositoryEvent.from_feed(record)
+
+
+def _valid_signature(secret: str, body: bytes, signature: Optional[str]) -> bool:
+    expected = _SIGNATURE_PREFIX + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return signature is not None and hmac.compare_digest(expected, signature)
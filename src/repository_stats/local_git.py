@@ -0,0 +1,82 @@
+import base64
+import logging
+import os
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from github.Repository import Repository
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def sync_mirror(repo: Repository, mirror_path: Path, token: Optional[str] = None) -> Path:
+    """ Creates or updates a local bare mirror of the repository.
+
+    A GitHub mirror includes the `refs/pull/*` refs, hence the heads of all the pull requests are available locally.
+    The token is passed to git through its environment, hence it is neither visible in the processes arguments nor
+    stored in the mirror configuration.
+
+    :param Repository repo: The repository to mirror.
+    :param Path mirror_path: The directory of the local bare mirror.
+    :param Optional[str] token: The GitHub token, required to mirror a private repository.
+    :returns: The directory of the local bare mirror.
+    :rtype: Path
+    """
+    env = _credentials_env(token)
+    if mirror_path.exists():
+        _LOGGER.info('Updating the local mirror of %s at %s.', repo.full_name, mirror_path)
+        _git(mirror_path, 'remote', 'update', '--prune', env=env)
+    else:
+        _LOGGER.info('Cloning a local mirror of %s to %s.', repo.full_name, mirror_path)
+        subprocess.run(
+            ['git', 'clone', '--mirror', repo.clone_url, str(mirror_path)], check=True, capture_output=True, env=env
+        )
+    return mirror_path
+
+
+def get_merge_base(mirror_path: Path, base_sha: str, head_sha: str) -> str:
+    """ Returns the best common ancestor of two commits.
+
+    :param Path mirror_path: The directory of the local bare mirror.
+    :param str base_sha: The base commit sha.
+    :param str head_sha: The head commit sha.
+    :returns: The sha of the common ancestor commit.
+    :rtype: str
+    """
+    merge_base = _git(mirror_path, 'merge-base', base_sha, head_sha).strip()
+    _LOGGER.debug('Merge base of %s and %s: %s', base_sha, head_sha, merge_base)
+    return merge_base
+
+
+def get_commits_range(mirror_path: Path, base_sha: str, head_sha: str) -> List[str]:
+    """ Returns the commits reachable from `head_sha` but not from `base_sha`, by chronological order.
+
+    :param Path mirror_path: The directory of the local bare mirror.
+    :param str base_sha: The base commit sha (excluded).
+    :param str head_sha: The head commit sha (included).
+    :returns: The commits shas of the range.
+    :rtype: List[str]
+    """
+    commits = _git(mirror_path, 'rev-list', '--reverse', f'{base_sha}..{head_sha}').split()
+    _LOGGER.debug('Commits between the base (%s) and head (%s) commits: %s', base_sha, head_sha, commits)
+    return commits
+
+
+def _git(mirror_path: Path, *args: str, env: Optional[Dict[str, str]] = None) -> str:
+    return subprocess.run(
+        ['git', '--git-dir', str(mirror_path), *args], check=True, capture_output=True, text=True, env=env
+    ).stdout
+
+
+def _credentials_env(token: Optional[str]) -> Optional[Dict[str, str]]:
+    if token is None:
+        return None
+    credentials = base64.b64encode(f'x-access-token:{token}'.encode()).decode()
+    return {
+        **os.environ,
+        'GIT_CONFIG_COUNT': '1',
+        'GIT_CONFIG_KEY_0': 'http.extraHeader',
+        'GIT_CONFIG_VALUE_0': f'Authorization: Basic {credentials}',
+    }
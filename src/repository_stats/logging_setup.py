@@ -1,7 +1,11 @@
+import atexit
 import logging
 import logging.config
+import logging.handlers
+import queue
 from enum import Enum
 from pathlib import Path
+from typing import Any, Callable, List, Optional
 
 from yaml import safe_load
 
@@ -16,20 +20,141 @@ class LogLevel(Enum):
     NOTSET = 'NOTSET'
 
 
-def setup_logging(logging_yaml: Path, debug_mode: bool = False, log_to_file: bool = False) -> None:
+class LazyMessage:
+    """ A logging argument that is evaluated only when the log record is formatted.
+
+    Pass it as a `%`-style argument, e.g. `_LOGGER.debug('Nodes: %s', lazy(repr, nodes))`, so the payload is not
+    serialized unless the logger level is enabled and a handler formats the record.
+    """
+    __slots__ = ('_function', '_args')
+
+    def __init__(self, function: Callable[..., Any], *args: Any) -> None:
+        self._function = function
+        self._args = args
+
+    def __str__(self) -> str:
+        return str(self._function(*self._args))
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+
+def lazy(function: Callable[..., Any], *args: Any) -> LazyMessage:
+    """ Defers calling `function` with `args` until the log record is formatted.
+
+    :param Callable function: The function that computes the logged value.
+    :param args: The arguments of the function.
+    :returns: A `LazyMessage` to pass as a `%`-style logging argument.
+    :rtype: LazyMessage
+    """
+    return LazyMessage(function, *args)
+
+
+class BufferedFileHandler(logging.handlers.RotatingFileHandler):
+    """ A file handler that buffers the formatted records and writes them in batches.
+
+    The buffer is written once it holds `capacity` records, when a record of `flush_level` or above is handled,
+    or when the handler is flushed explicitly (the `QueueLoggingListener` flushes it whenever its queue drains).
+    The file is rotated before a batch would exceed `maxBytes`, unless `maxBytes` is 0.
+
+    :ivar int capacity: The maximal number of buffered records.
+    :ivar int flush_level: The level from which a record is written immediately.
+    """
+
+    def __init__(
+        self, filename: str, mode: str = 'a', maxBytes: int = 0, backupCount: int = 0, encoding: Optional[str] = None,
+        delay: bool = False, capacity: int = 1024, flush_level: int = logging.ERROR
+    ) -> None:
+        super().__init__(filename, mode, maxBytes, backupCount, encoding, delay)
+        self.capacity = capacity
+        self.flush_level = flush_level
+        self._buffer: List[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self._buffer.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+        if len(self._buffer) >= self.capacity or record.levelno >= self.flush_level:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            if not self._buffer:
+                return
+            batch = ''.join(self._buffer)
+            self._buffer.clear()
+            if self.stream is None:
+                self.stream = self._open()
+            position = self.stream.tell()
+            if self.maxBytes > 0 and position and position + len(batch) >= self.maxBytes:
+                self.doRollover()
+            self.stream.write(batch)
+            self.stream.flush()
+
+    def close(self) -> None:
+        self.flush()
+        super().close()
+
+
+class QueueLoggingListener(logging.handlers.QueueListener):
+    """ A queue listener that flushes its handlers whenever the queue drains.
+
+    The handlers run on the listener thread, so logging calls only enqueue their records, and a burst of records
+    is written by the buffered handlers as one batch.
+    """
+
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        if block and self.queue.empty():
+            self._flush_handlers()
+        return super().dequeue(block)
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        super().stop()
+        self._flush_handlers()
+
+    def _flush_handlers(self) -> None:
+        for handler in self.handlers:
+            handler.flush()
+
+
+class _LocalQueueHandler(logging.handlers.QueueHandler):
+    # the queue is in-process, so the records are neither copied nor formatted on the logging thread
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(
+    logging_yaml: Path, debug_mode: bool = False, log_to_file: bool = False, queued: bool = False,
+    max_bytes: int = 0, backup_count: int = 3
+) -> Optional[QueueLoggingListener]:
     """ Configure the loggers with the logging config when using the project as main.
 
+    In queued mode the configured handlers run on a background `QueueLoggingListener` thread, the loggers only
+    enqueue their records, and the log file is written in buffered batches. The listener is stopped at exit.
+
     :param Path logging_yaml: Path to the logging config file.
     :param str debug_mode: Indicates whether to enable debug mode (`DEBUG` logging level),
                        otherwise `INFO` logging level is applied.
     :param bool log_to_file: Indicates whether to enable logging to a file.
+    :param bool queued: Indicates whether to handle the log records on a background thread.
+    :param int max_bytes: The size from which the log file is rotated, 0 disables the rotation.
+    :param int backup_count: The number of rotated log files to keep.
+    :returns: The started queue listener in queued mode, otherwise None.
+    :rtype: Optional[QueueLoggingListener]
     """
     config = safe_load(logging_yaml.read_text())
     if debug_mode:
         _update_logger_level(config, LogLevel.DEBUG.value)
     if log_to_file:
         _update_logger_file_handler(config)
+        _update_file_handler_class(config, max_bytes, backup_count, queued)
     logging.config.dictConfig(config)
+    if queued:
+        return _start_queue_listener(logging.getLogger('repository_stats'), logging.getLogger())
+    return None
 
 
 def _update_logger_level(logger_config: dict, log_level: str) -> None:
@@ -40,3 +165,26 @@ def _update_logger_level(logger_config: dict, log_level: str) -> None:
 def _update_logger_file_handler(logger_config: dict) -> None:
     logger_config['loggers']['repository_stats']['handlers'] = ['file']
     logger_config['root']['handlers'] = ['file']
+
+
+def _update_file_handler_class(logger_config: dict, max_bytes: int, backup_count: int, buffered: bool) -> None:
+    # the buffered handler is flushed by the queue listener, synchronous logging writes every record
+    handler_class = BufferedFileHandler if buffered else logging.handlers.RotatingFileHandler
+    logger_config['handlers']['file'].update({
+        'class': f'{handler_class.__module__}.{handler_class.__qualname__}',
+        'maxBytes': max_bytes,
+        'backupCount': backup_count,
+    })
+
+
+def _start_queue_listener(*loggers: logging.Logger) -> QueueLoggingListener:
+    records = queue.SimpleQueue()
+    handlers = list(dict.fromkeys(handler for logger in loggers for handler in logger.handlers))
+    for logger in loggers:
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(_LocalQueueHandler(records))
+    listener = QueueLoggingListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
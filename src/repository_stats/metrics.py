@@ -0,0 +1,259 @@
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from repository_stats.tracing import span
+from repository_stats.transport import HttpRequest, HttpResponse, Send, normalize_endpoint
+
+
+_LOGGER = logging.getLogger(__name__)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_NO_STEP = 'none'
+_current_step: contextvars.ContextVar[str] = contextvars.ContextVar('step', default=_NO_STEP)
+
+Labels = Tuple[str, ...]
+
+
+class _Metric:
+    # a metric family, holding one value per labels combination
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name}{_format_labels(labels)} {_format_value(value)}' for name, labels, value in self.samples())
+        return '\n'.join(lines) + '\n'
+
+    def _labels(self, labels: Dict[str, str]) -> Labels:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+
+class Counter(_Metric):
+    """ A monotonically increasing value per labels combination. """
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._labels(labels), 0)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, dict(zip(self.label_names, key)), value
+
+
+class Gauge(Counter):
+    """ A value per labels combination that can go up and down. """
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """ Observations counted in cumulative buckets per labels combination, along their count and sum. """
+    kind = 'histogram'
+
+    def __init__(
+        self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Labels, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = counts, total + value
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip([*self.buckets, float('inf')], counts):
+                cumulative += count
+                yield f'{self.name}_bucket', {**labels, 'le': _format_value(bound)}, cumulative
+            yield f'{self.name}_count', labels, cumulative
+            yield f'{self.name}_sum', labels, total
+
+
+class Registry:
+    """ A collection of metrics, exposed together in the Prometheus text format. """
+
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        """ Returns the metrics in the Prometheus text exposition format. """
+        return ''.join(metric.expose() for metric in self._metrics)
+
+
+REGISTRY = Registry()
+GITHUB_REQUESTS = REGISTRY.register(Counter(
+    'repository_stats_github_requests_total', 'GitHub API requests.', ['step', 'endpoint', 'method', 'status']
+))
+GITHUB_REQUEST_DURATION = REGISTRY.register(Histogram(
+    'repository_stats_github_request_duration_seconds', 'GitHub API requests latency.', ['step', 'endpoint']
+))
+GITHUB_RESPONSE_BYTES = REGISTRY.register(Counter(
+    'repository_stats_github_response_bytes_total', 'GitHub API responses body size.', ['step', 'endpoint']
+))
+GITHUB_RATE_LIMIT_CONSUMED = REGISTRY.register(Counter(
+    'repository_stats_github_rate_limit_consumed_total', 'GitHub API requests counted against the rate limit.',
+    ['step']
+))
+GITHUB_RATE_LIMIT_REMAINING = REGISTRY.register(Gauge(
+    'repository_stats_github_rate_limit_remaining', 'GitHub API requests left in the rate limit window.', ['resource']
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'repository_stats_cache_requests_total', 'Cache lookups.', ['step', 'cache', 'result']
+))
+
+
+@contextmanager
+def step(name: str) -> Iterator[None]:
+    """ Attributes the GitHub requests and cache lookups made within the context (or the decorated function).
+
+    The step is a context variable, hence it applies to the threads only through `submit_in_context`
+    (see `repository_stats.context_utils`). The innermost step wins. The step is traced as a span as well, if tracing
+    was started (see `repository_stats.tracing`).
+
+    :param str name: The logical step name, e.g. `latest_releases`.
+    """
+    token = _current_step.set(name)
+    try:
+        with span(name):
+            yield
+    finally:
+        _current_step.reset(token)
+
+
+def current_step() -> str:
+    """ Returns the name of the current logical step. """
+    return _current_step.get()
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """ Counts a cache lookup of the current step.
+
+    :param str cache: The cache name.
+    :param bool hit: Whether the lookup found the entry.
+    """
+    CACHE_REQUESTS.inc(step=current_step(), cache=cache, result='hit' if hit else 'miss')
+
+
+class MetricsMiddleware:
+    """ A transport middleware measuring every GitHub request per logical step and endpoint.
+
+    Should be installed as the innermost middleware, so that only the requests actually sent are measured.
+    """
+
+    def __call__(self, request: HttpRequest, send: Send) -> HttpResponse:
+        start = time.perf_counter()
+        response = send(request)
+        duration = time.perf_counter() - start
+        labels = {'step': current_step(), 'endpoint': normalize_endpoint(request.url)}
+        GITHUB_REQUESTS.inc(method=request.verb, status=str(response.status), **labels)
+        GITHUB_REQUEST_DURATION.observe(duration, **labels)
+        GITHUB_RESPONSE_BYTES.inc(len(response.body), **labels)
+        if response.status != 304:
+            GITHUB_RATE_LIMIT_CONSUMED.inc(step=labels['step'])
+        if 'x-ratelimit-remaining' in response.headers:
+            GITHUB_RATE_LIMIT_REMAINING.set(
+                int(response.headers['x-ratelimit-remaining']),
+                resource=response.headers.get('x-ratelimit-resource', 'core')
+            )
+        return response
+
+
+def write_metrics(path: Path, registry: Registry = REGISTRY) -> None:
+    """ Writes the metrics to a file in the Prometheus text format, e.g. for the node exporter textfile collector.
+
+    :param Path path: The output file, replaced atomically.
+    :param Registry registry: The metrics to write.
+    """
+    temporary = path.with_name(f'{path.name}.tmp')
+    temporary.write_text(registry.expose())
+    temporary.replace(path)
+    _LOGGER.info('Wrote the metrics to %s.', path)
+
+
+def serve_metrics(port: int, host: str = '127.0.0.1', registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """ Serves the metrics at `/metrics` for Prometheus to scrape, from a daemon thread.
+
+    :param int port: The local port to listen on, 0 for any free port.
+    :param str host: The address to listen on.
+    :param Registry registry: The metrics to serve.
+    :returns: The running server, to be shut down with `shutdown`.
+    :rtype: ThreadingHTTPServer
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.expose().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            _LOGGER.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    _LOGGER.info('Serving the metrics at http://%s:%d/metrics', host, server.server_port)
+    return server
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
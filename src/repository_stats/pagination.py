@@ -0,0 +1,47 @@
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from math import ceil
+from typing import Iterator, TypeVar
+
+from github.PaginatedList import PaginatedList
+
+from repository_stats.context_utils import submit_in_context
+from repository_stats.counting import fast_count
+
+
+T = TypeVar('T')
+_LOGGER = logging.getLogger(__name__)
+
+
+def iterate_concurrently(paginated_list: PaginatedList[T], per_page: int, concurrency: int = 1) -> Iterator[T]:
+    """ Iterates a paginated GitHub listing, prefetching up to `concurrency` pages concurrently.
+
+    The number of pages is resolved in a single request (see `fast_count`), then the pages are fetched by a bounded
+    thread pool and their items are yielded in order, as soon as each page (and all the pages before it) arrived.
+    Falls back to the sequential iteration when the number of pages can not be resolved or `concurrency` is 1.
+
+    :param PaginatedList paginated_list: The paginated GitHub listing to iterate.
+    :param int per_page: The page size of the listing (the `per_page` of the GitHub client).
+    :param int concurrency: The maximal number of pages fetched concurrently.
+    :returns: An iterator over the listing items.
+    :rtype: Iterator
+    """
+    total = None if concurrency <= 1 else fast_count(paginated_list)
+    if total is None:
+        yield from paginated_list
+        return
+    num_pages = ceil(total / per_page)
+    _LOGGER.debug('Fetching %d pages (%d items) with %d concurrent requests.', num_pages, total, concurrency)
+    pages = iter(range(num_pages))
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='pages') as executor:
+        window = deque(
+            submit_in_context(executor, paginated_list.get_page, page) for page in islice(pages, concurrency)
+        )
+        while window:
+            items = window.popleft().result()
+            next_page = next(pages, None)
+            if next_page is not None:
+                window.append(submit_in_context(executor, paginated_list.get_page, next_page))
+            yield from items
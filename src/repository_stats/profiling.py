@@ -0,0 +1,225 @@
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from types import FrameType
+from typing import Dict, Iterator, List, Optional
+
+
+_LOGGER = logging.getLogger(__name__)
+DETERMINISTIC = 'deterministic'
+SAMPLING = 'sampling'
+PROFILE_MODES = (DETERMINISTIC, SAMPLING)
+DEFAULT_SAMPLING_INTERVAL = 0.005
+COLLAPSED_SUFFIX = '.collapsed'
+AGGREGATED_PROFILE = 'all'
+_REPORT_LINES = 50
+_MAX_STACK_DEPTH = 256
+_PROFILER_PER_THREAD = sys.version_info < (3, 12)
+_profiler: Optional['_Profiler'] = None
+
+Stacks = Counter
+
+
+class _Sampler:
+    # samples the stacks of all the threads from a background thread, the sampled code is barely slowed down
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.stacks: Stacks = Counter()
+        self.self_samples: Counter = Counter()
+        self.total_samples: Counter = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _sample(self) -> None:
+        sampler_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            threads = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                frames = _frame_names(frame)
+                self.stacks[';'.join([_thread_group(threads.get(thread_id, 'unknown')), *frames])] += 1
+                self.self_samples[frames[-1]] += 1
+                self.total_samples.update(set(frames))
+
+
+class _Profiler:
+    # profiles the stages of a run and writes a report per stage, along the collapsed stacks of all the stages
+
+    def __init__(self, output_dir: Path, interval: float) -> None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        self.output_dir = output_dir
+        self.interval = interval
+        self.stacks: Dict[str, Stacks] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        sampler = _Sampler(self.interval)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            with self._profile(name):
+                yield
+        finally:
+            sampler.stop()
+            self._write_stage(name, time.perf_counter() - start, sampler)
+
+    def write_aggregate(self) -> Path:
+        path = self.output_dir / f'{AGGREGATED_PROFILE}{COLLAPSED_SUFFIX}'
+        _write_collapsed(path, Counter({
+            f'{stage};{stack}': count for stage, stacks in self.stacks.items() for stack, count in stacks.items()
+        }))
+        return path
+
+    @contextmanager
+    def _profile(self, name: str) -> Iterator[None]:
+        yield
+
+    def _report(self, name: str, duration: float, sampler: _Sampler) -> str:
+        lines = [
+            f'Stage {name}: {duration:.3f}s, {sum(sampler.self_samples.values())} wall clock samples every '
+            f'{self.interval * 1000:g}ms of all the threads (including the blocked ones).',
+            '',
+            f'{"self":>8} {"total":>8}  function',
+        ]
+        lines.extend(
+            f'{count:>8} {sampler.total_samples[function]:>8}  {function}'
+            for function, count in sampler.self_samples.most_common(_REPORT_LINES)
+        )
+        return '\n'.join(lines) + '\n'
+
+    def _write_stage(self, name: str, duration: float, sampler: _Sampler) -> None:
+        self.stacks[name] = sampler.stacks
+        (self.output_dir / f'{name}.txt').write_text(self._report(name, duration, sampler))
+        _write_collapsed(self.output_dir / f'{name}{COLLAPSED_SUFFIX}', sampler.stacks)
+        _LOGGER.info('Wrote the %s profile (%.3fs) to %s.', name, duration, self.output_dir)
+
+
+class _DeterministicProfiler(_Profiler):
+    # before Python 3.12, cProfile profiles only the thread enabling it, hence the threads started during a stage get
+    # their own profiler. From 3.12 on, cProfile is a `sys.monitoring` tool of all the threads, and a second profiler
+    # fails to start, so the single profiler of the stage covers the other threads.
+
+    def __init__(self, output_dir: Path, interval: float) -> None:
+        super().__init__(output_dir, interval)
+        self._stats: Dict[str, pstats.Stats] = {}
+
+    @contextmanager
+    def _profile(self, name: str) -> Iterator[None]:
+        profilers: List[cProfile.Profile] = []
+        lock = threading.Lock()
+
+        def profile_thread(frame: FrameType, event: str, arg: object) -> None:
+            profiler = cProfile.Profile()
+            with lock:
+                profilers.append(profiler)
+            profiler.enable()
+
+        main_profiler = cProfile.Profile()
+        if _PROFILER_PER_THREAD:
+            threading.setprofile(profile_thread)
+        main_profiler.enable()
+        try:
+            yield
+        finally:
+            main_profiler.disable()
+            if _PROFILER_PER_THREAD:
+                threading.setprofile(None)
+            stats = pstats.Stats(main_profiler)
+            with lock:
+                for profiler in profilers:
+                    stats.add(profiler)
+            stats.dump_stats(self.output_dir / f'{name}.pstats')
+            self._stats[name] = stats
+
+    def _report(self, name: str, duration: float, sampler: _Sampler) -> str:
+        report = io.StringIO()
+        report.write(f'Stage {name}: {duration:.3f}s.\n')
+        stats = self._stats.pop(name)
+        stats.stream = report
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(_REPORT_LINES)
+        return report.getvalue()
+
+
+def start_profiling(mode: str, output_dir: Path, interval: float = DEFAULT_SAMPLING_INTERVAL) -> None:
+    """ Starts profiling the stages of the run (see `profile_stage`), which are not profiled by default.
+
+    :param str mode: `deterministic` to profile every call with cProfile, or `sampling` to only sample the threads
+        stacks, with a low overhead.
+    :param Path output_dir: The directory of the profiles.
+    :param float interval: The interval in seconds of the stacks samples, taken in both modes.
+    """
+    global _profiler
+    if mode not in PROFILE_MODES:
+        raise ValueError(f'Unknown profile mode {mode}, expected one of {PROFILE_MODES}.')
+    _profiler = (_DeterministicProfiler if mode == DETERMINISTIC else _Profiler)(output_dir, interval)
+    _LOGGER.info('Profiling the run (%s) into %s.', mode, output_dir)
+
+
+def stop_profiling() -> Optional[Path]:
+    """ Stops profiling, and writes the collapsed stacks of all the profiled stages.
+
+    :returns: The path of the aggregated collapsed stacks, if profiling was started.
+    :rtype: Optional[Path]
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return None
+    path = profiler.write_aggregate()
+    _LOGGER.info('Wrote the aggregated collapsed stacks to %s.', path)
+    return path
+
+
+@contextmanager
+def profile_stage(name: str) -> Iterator[None]:
+    """ Profiles the context as a stage of the run, does nothing unless profiling was started.
+
+    The stage is reported to `<output_dir>/<name>.txt` and its sampled stacks to `<output_dir>/<name>.collapsed`
+    (one `thread;frame;frame;... samples` line per stack, as read by `flamegraph.pl` or speedscope).
+    The deterministic profiler writes the raw `pstats` to `<output_dir>/<name>.pstats` as well.
+
+    :param str name: The stage name, e.g. `summary`.
+    """
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
+
+def _frame_names(frame: FrameType) -> List[str]:
+    names = []
+    while frame is not None and len(names) < _MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f'{Path(code.co_filename).stem}:{code.co_name}')
+        frame = frame.f_back
+    return names[::-1]
+
+
+def _thread_group(thread_name: str) -> str:
+    # the pool threads are named `<prefix>_<index>`
+    prefix, _, index = thread_name.rpartition('_')
+    return prefix if prefix and index.isdigit() else thread_name
+
+
+def _write_collapsed(path: Path, stacks: Stacks) -> None:
+    with path.open('w') as output:
+        for stack, count in sorted(stacks.items()):
+            output.write(f'{stack} {count}\n')
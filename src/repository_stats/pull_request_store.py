@@ -0,0 +1,142 @@
+import logging
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from github.PullRequest import PullRequest
+from github.Repository import Repository
+from more_itertools import chunked, first
+
+from repository_stats.metrics import step
+from repository_stats.pagination import iterate_concurrently
+
+
+_LOGGER = logging.getLogger(__name__)
+_STORE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pull_requests (
+    repository TEXT NOT NULL, number INTEGER NOT NULL, author TEXT, updated_at TEXT NOT NULL,
+    PRIMARY KEY (repository, number)
+);
+CREATE INDEX IF NOT EXISTS pull_requests_authors ON pull_requests (repository, author);
+CREATE TABLE IF NOT EXISTS cursors (repository TEXT PRIMARY KEY, updated_at TEXT NOT NULL);
+'''
+_BATCH_SIZE = 1000
+_MAX_SYNC_PASSES = 3
+
+
+class PullRequestStore:
+    """ A local store of the pull requests authors of repositories, synchronized incrementally.
+
+    Every repository keeps a high-water mark: the last update date of its pull requests already stored. A sync lists
+    the pull requests by most recently updated, and stops at the first one updated before the mark, hence a daily sync
+    costs a few requests, whatever the amount of pull requests of the repository.
+
+    :ivar Path path: The path of the store database.
+    """
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_STORE_SCHEMA)
+        self._db.commit()
+
+    def cursor(self, repository: str) -> Optional[datetime]:
+        """ Returns the last update date of the stored pull requests of a repository, `None` if never synchronized. """
+        with self._lock:
+            row = self._db.execute('SELECT updated_at FROM cursors WHERE repository = ?', (repository,)).fetchone()
+        return None if row is None else datetime.fromisoformat(row[0])
+
+    def count_by_author(self, repository: str) -> Counter:
+        """ Counts the stored pull requests of a repository per author login.
+
+        :param str repository: The repository full name.
+        :returns: A counter of the amount of pull requests per author login.
+        :rtype: Counter
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT author, COUNT(*) FROM pull_requests '
+                'WHERE repository = ? AND author IS NOT NULL GROUP BY author',
+                (repository,)
+            ).fetchall()
+        return Counter(dict(rows))
+
+    @step('sync_pull_requests')
+    def sync(self, repo: Repository, concurrency: int = 1) -> int:
+        """ Fetches the pull requests of the repository updated since the last sync.
+
+        The first sync lists all the pull requests by creation date, which is stable while they are updated, with up to
+        `concurrency` pages fetched concurrently. The next syncs list the pull requests by most recently updated until
+        the high-water mark; since the pull requests updated meanwhile move to the first page and may shift another one
+        past a page boundary, such a sync is repeated until the most recent update did not change while listing.
+
+        :param Repository repo: The repository to synchronize.
+        :param int concurrency: The maximal number of pages fetched concurrently by the first sync.
+        :returns: The number of pull requests fetched.
+        :rtype: int
+        """
+        cursor = self.cursor(repo.full_name)
+        if cursor is None:
+            return self._sync_all(repo, concurrency)
+        fetched = 0
+        for _ in range(_MAX_SYNC_PASSES):
+            newest, updated = self._sync_since(repo, cursor)
+            fetched += updated
+            if newest is None or newest == _newest_update(repo):
+                if newest is not None:
+                    self._set_cursor(repo.full_name, newest)
+                _LOGGER.info('Synchronized %d pull requests of %s updated since %s.', fetched, repo.full_name, cursor)
+                return fetched
+        # the cursor is kept, hence the next sync lists the pull requests updated since then again
+        _LOGGER.warning('The pull requests of %s kept changing while synchronizing them.', repo.full_name)
+        return fetched
+
+    def _sync_all(self, repo: Repository, concurrency: int) -> int:
+        # the pull requests updated after the newest update known before listing are synchronized by the next sync
+        newest = _newest_update(repo)
+        pull_requests = iterate_concurrently(
+            repo.get_pulls(state='all', sort='created', direction='asc'), repo.requester.per_page, concurrency
+        )
+        fetched = self._put(repo.full_name, pull_requests)
+        if newest is not None:
+            self._set_cursor(repo.full_name, newest)
+        _LOGGER.info('Synchronized all the %d pull requests of %s.', fetched, repo.full_name)
+        return fetched
+
+    def _sync_since(self, repo: Repository, cursor: datetime) -> Tuple[Optional[datetime], int]:
+        newest, pull_requests = None, []
+        for pull_request in repo.get_pulls(state='all', sort='updated', direction='desc'):
+            newest = newest or pull_request.updated_at
+            # the pull requests updated at the cursor date are fetched again, as more may have been updated since
+            if pull_request.updated_at < cursor:
+                break
+            pull_requests.append(pull_request)
+        return newest, self._put(repo.full_name, pull_requests)
+
+    def _put(self, repository: str, pull_requests: Iterable[PullRequest]) -> int:
+        count = 0
+        for batch in chunked(pull_requests, _BATCH_SIZE):
+            rows: List[tuple] = [
+                (repository, pr.number, None if pr.user is None else pr.user.login, pr.updated_at.isoformat())
+                for pr in batch
+            ]
+            with self._lock:
+                self._db.executemany('INSERT OR REPLACE INTO pull_requests VALUES (?, ?, ?, ?)', rows)
+                self._db.commit()
+            count += len(rows)
+        return count
+
+    def _set_cursor(self, repository: str, updated_at: datetime) -> None:
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO cursors VALUES (?, ?)', (repository, updated_at.isoformat()))
+            self._db.commit()
+
+
+def _newest_update(repo: Repository) -> Optional[datetime]:
+    pull_request = first(repo.get_pulls(state='all', sort='updated', direction='desc').get_page(0), None)
+    return None if pull_request is None else pull_request.updated_at
@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+from typing import Optional
+
+from attr import define, field
+from attr.validators import instance_of
+
+from repository_stats.transport import HttpRequest, HttpResponse, Send
+
+
+_LOGGER = logging.getLogger(__name__)
+_SECONDARY_RATE_LIMIT_MESSAGE = 'secondary rate limit'
+_MAX_BACKOFF_SECONDS = 60.0
+_QUOTA_RESERVE = 0.1
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class RateLimitState:
+    """ A snapshot of the state of a `RateLimitScheduler`.
+
+    :ivar int limit: The primary rate limit quota, `None` until a response reported it.
+    :ivar int remaining: The remaining primary rate limit quota, `None` until a response reported it.
+    :ivar float reset: The epoch time in which the primary quota is reset, `None` until a response reported it.
+    :ivar int concurrency: The current limit of concurrent requests.
+    :ivar int in_flight: The number of requests currently in flight.
+    :ivar float backoff_until: The epoch time until which requests are held back, after a throttled response.
+    :ivar int throttled: The number of throttled responses (primary or secondary rate limits) so far.
+    """
+    limit: Optional[int] = field(default=None)
+    remaining: Optional[int] = field(default=None)
+    reset: Optional[float] = field(default=None)
+    concurrency: int = field(validator=instance_of(int))
+    in_flight: int = field(validator=instance_of(int))
+    backoff_until: float = field(default=0.0)
+    throttled: int = field(default=0)
+
+
+class RateLimitScheduler:
+    """ A transport middleware that schedules the GitHub requests within the GitHub rate limits.
+
+    Requests are admitted by a token bucket of `rate` requests per second (bursts of up to `burst` requests), and by an
+    adaptive concurrency limit. Once the remaining primary quota drops below 10%, the rate is slowed down to spread it
+    until its reset time.
+    Throttled responses (429, or 403 due to a primary or secondary rate limit) are retried after their `Retry-After`
+    or the quota reset time, or with an exponential backoff, and halve the concurrency limit, which then grows back
+    by one on every successful response (AIMD).
+    Server errors (5xx) are retried up to `server_error_retries` times with an exponential backoff of the request only,
+    since the GitHub client retries are disabled in favor of the scheduler.
+
+    :ivar float rate: The maximal sustained rate of requests per second.
+    :ivar int burst: The maximal burst of requests.
+    :ivar int max_concurrency: The maximal limit of concurrent requests.
+    :ivar int max_retries: The maximal number of retries of a throttled request.
+    :ivar int server_error_retries: The maximal number of retries of a request failing with a server error.
+    :ivar float server_error_backoff: The delay in seconds before the first retry of a server error, doubled on every
+        retry.
+    """
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: int = 20,
+        max_concurrency: int = 8,
+        max_retries: int = 5,
+        server_error_retries: int = 3,
+        server_error_backoff: float = 1.0,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.server_error_retries = server_error_retries
+        self.server_error_backoff = server_error_backoff
+        self._condition = threading.Condition()
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._concurrency = max_concurrency
+        self._in_flight = 0
+        self._limit: Optional[int] = None
+        self._remaining: Optional[int] = None
+        self._reset: Optional[float] = None
+        self._backoff_until = 0.0
+        self._throttled = 0
+
+    @property
+    def state(self) -> RateLimitState:
+        """ A snapshot of the current state of the scheduler. """
+        with self._condition:
+            return RateLimitState(
+                limit=self._limit,
+                remaining=self._remaining,
+                reset=self._reset,
+                concurrency=self._concurrency,
+                in_flight=self._in_flight,
+                backoff_until=self._backoff_until,
+                throttled=self._throttled,
+            )
+
+    def __call__(self, request: HttpRequest, send: Send) -> HttpResponse:
+        for attempt in range(self.max_retries + 1):
+            self._acquire()
+            try:
+                response = send(request)
+            finally:
+                self._release()
+            delay = self._observe(response, attempt)
+            if delay is None and _is_server_error(response) and attempt < self.server_error_retries:
+                delay = min(self.server_error_backoff * 2.0 ** attempt, _MAX_BACKOFF_SECONDS)
+                _LOGGER.warning('GitHub server error (%d), retrying %s in %.1fs.', response.status, request.url, delay)
+                time.sleep(delay)
+                continue
+            if delay is None or attempt == self.max_retries:
+                return response
+            _LOGGER.warning('GitHub rate limit hit (%d), retrying %s in %.1fs.', response.status, request.url, delay)
+        return response
+
+    def _acquire(self) -> None:
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = self._backoff_until - time.time()
+                if wait <= 0 and self._in_flight >= self._concurrency:
+                    wait = None
+                elif wait <= 0:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self._in_flight += 1
+                        return
+                    wait = (1 - self._tokens) / self._current_rate()
+                self._condition.wait(wait)
+
+    def _release(self) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self._current_rate())
+        self._last_refill = now
+
+    def _current_rate(self) -> float:
+        # once the primary quota is running low, spread what is left over the time left until it is reset
+        if self._remaining is None or self._reset is None or self._remaining > self._limit * _QUOTA_RESERVE:
+            return self.rate
+        seconds_to_reset = max(self._reset - time.time(), 1.0)
+        return max(min(self.rate, self._remaining / seconds_to_reset), 1 / seconds_to_reset)
+
+    def _observe(self, response: HttpResponse, attempt: int) -> Optional[float]:
+        """ Updates the state from the response, and returns the retry delay if the response is throttled. """
+        with self._condition:
+            headers = response.headers
+            if 'x-ratelimit-remaining' in headers:
+                self._limit = int(headers.get('x-ratelimit-limit', self._limit or 0))
+                self._remaining = int(headers['x-ratelimit-remaining'])
+                self._reset = float(headers.get('x-ratelimit-reset', self._reset or 0))
+            if not _is_throttled(response):
+                self._concurrency = min(self.max_concurrency, self._concurrency + 1)
+                return None
+            self._throttled += 1
+            self._concurrency = max(1, self._concurrency // 2)
+            if 'retry-after' in headers:
+                delay = float(headers['retry-after'])
+            elif headers.get('x-ratelimit-remaining') == '0' and self._reset is not None:
+                delay = max(self._reset - time.time(), 0.0) + 1
+            else:
+                delay = min(2.0 ** attempt, _MAX_BACKOFF_SECONDS)
+            self._backoff_until = max(self._backoff_until, time.time() + delay)
+            self._condition.notify_all()
+            return delay
+
+
+def _is_throttled(response: HttpResponse) -> bool:
+    if response.status == 429:
+        return True
+    return response.status == 403 and (
+        'retry-after' in response.headers
+        or response.headers.get('x-ratelimit-remaining') == '0'
+        or _SECONDARY_RATE_LIMIT_MESSAGE in response.body.lower()
+    )
+
+
+def _is_server_error(response: HttpResponse) -> bool:
+    return 500 <= response.status < 600
@@ -1,11 +1,20 @@
 import logging
-from typing import List
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
 
 from attr import define, field
 from attr.validators import instance_of
 from github import Repository, GithubException
 from github.NamedUser import NamedUser
-from more_itertools import first, last
+
+from repository_stats.context_utils import submit_in_context
+from repository_stats.counting import count_items
+from repository_stats.logging_setup import lazy
+from repository_stats.metrics import step
+from repository_stats.pagination import iterate_concurrently
+from repository_stats.pull_request_store import PullRequestStore
+from repository_stats.transport import limit_concurrent_requests
 
 
 _LOGGER = logging.getLogger(__name__)
@@ -44,47 +53,70 @@ class RepositorySummary:
         )
 
 
-def summarize_repository(repo: Repository, recent_releases: int = 3) -> RepositorySummary:
+@step('summarize_repository')
+def summarize_repository(
+    repo: Repository,
+    recent_releases: int = 3,
+    concurrency: int = 1,
+    pull_request_store: Optional[PullRequestStore] = None
+) -> RepositorySummary:
     """ Summarizes a GitHub repository in a certain format.
 
+    The releases, contributors, open pull requests and pull requests authors are fetched concurrently, along the pages
+    of the contributors and pull requests listings. The summary and its listings share a single limit: at most
+    `concurrency` GitHub requests of the summary are in flight at once (see
+    `repository_stats.transport.limit_concurrent_requests`). Concurrent fetches require the GitHub client to be created
+    after installing the thread safe transport (see `repository_stats.transport.install_middlewares`).
+
     :param Repository repo: A GitHub repository.
     :param int recent_releases: The number of recent releases to return.
+    :param int concurrency: The maximal number of GitHub requests in flight at once.
+    :param PullRequestStore pull_request_store: The store of the pull requests authors, synchronized incrementally
+        instead of listing all the pull requests.
     :returns: A `RepositorySummary` object.
     :rtype: RepositorySummary
     """
-    _LOGGER.info(f'summarizing repository {repo.name}')
-    contributors = get_contributors(repo)
-    summary = RepositorySummary(
-        name=repo.name,
-        releases=latest_releases(repo, recent_releases),
-        forks=repo.forks_count,
-        stars=repo.stargazers_count,
-        num_open_pull_requests=len([p for p in repo.get_pulls(state='open')]),
-        num_contributors=len(contributors),
-        sorted_contributors=sort_contributors_by_prs(repo, contributors)
-    )
+    _LOGGER.info('summarizing repository %s', repo.name)
+    with limit_concurrent_requests(concurrency), \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='summary') as executor:
+        contributors = submit_in_context(executor, get_contributors, repo, concurrency)
+        releases = submit_in_context(executor, latest_releases, repo, recent_releases)
+        num_open_pull_requests = submit_in_context(executor, count_open_pull_requests, repo)
+        pull_requests_per_author = submit_in_context(
+            executor, count_pull_requests_by_author, repo, concurrency, pull_request_store
+        )
+        summary = RepositorySummary(
+            name=repo.name,
+            releases=releases.result(),
+            forks=repo.forks_count,
+            stars=repo.stargazers_count,
+            num_open_pull_requests=num_open_pull_requests.result(),
+            num_contributors=len(contributors.result()),
+            sorted_contributors=_rank_contributors(repo, contributors.result(), pull_requests_per_author)
+        )
     _LOGGER.info('repository summary has been completed.')
-    _LOGGER.debug(str(summary))
+    _LOGGER.debug('%s', summary)
     return summary
 
 
-def get_contributors(repo: Repository) -> List[NamedUser]:
+@step('get_contributors')
+def get_contributors(repo: Repository, concurrency: int = 1) -> List[NamedUser]:
     """ Returns the list of contributors of the repository.
 
     :param Repository repo: The repository to get the contributors for.
+    :param int concurrency: The maximal number of pages fetched concurrently.
     :returns: A list of contributors of the repository.
     :rtype: List[NamedUser]
     """
     try:
-        contributors = [c for c in repo.get_contributors()]
-        _LOGGER.debug(f'contributors of repository ({repo.name}): {[c.login for c in contributors]}')
+        contributors = list(iterate_concurrently(repo.get_contributors(), repo.requester.per_page, concurrency))
+        _LOGGER.debug('contributors of repository (%s): %s', repo.name, lazy(_logins, contributors))
         return contributors
     except GithubException as e:
-        _LOGGER.exception(
-            f'Unable to get contributors for repository {repo.name}.\nException: {e.message}'
-        )
+        _LOGGER.exception('Unable to get contributors for repository %s.\nException: %s', repo.name, e.message)
 
 
+@step('latest_releases')
 def latest_releases(repo: Repository, latest: int) -> List[str]:
     """ Returns the latest releases of the repository.
 
@@ -95,29 +127,91 @@ def latest_releases(repo: Repository, latest: int) -> List[str]:
     """
     try:
         releases = [r.tag_name for r in repo.get_releases()[:latest]]
-        _LOGGER.debug(f'{latest} latest repository releases: {releases}')
+        _LOGGER.debug('%d latest repository releases: %s', latest, releases)
         return releases
     except GithubException:
-        _LOGGER.exception(f'Unable to get releases for repository {repo.name}.')
+        _LOGGER.exception('Unable to get releases for repository %s.', repo.name)
+
+
+@step('count_pull_requests_by_author')
+def count_pull_requests_by_author(
+    repo: Repository, concurrency: int = 1, pull_request_store: Optional[PullRequestStore] = None
+) -> Counter:
+    """ Counts all the pull requests (closed and open) of the repository per author login.
 
+    The pull requests are streamed once, so the cost is linear in the number of pull requests. With a store, only the
+    pull requests updated since its last sync are fetched, and the authors are counted from the store.
 
-def sort_contributors_by_prs(repo: Repository, contributors: List[NamedUser]) -> List[str]:
+    :param Repository repo: The repository to count the pull requests for.
+    :param int concurrency: The maximal number of pages fetched concurrently.
+    :param PullRequestStore pull_request_store: The store of the pull requests authors, if any.
+    :returns: A counter of the amount of pull requests per author login.
+    :rtype: Counter
+    """
+    if pull_request_store is not None:
+        pull_request_store.sync(repo, concurrency)
+        return pull_request_store.count_by_author(repo.full_name)
+    pull_requests = iterate_concurrently(repo.get_pulls(state='all'), repo.requester.per_page, concurrency)
+    pull_requests_per_author = Counter(pr.user.login for pr in pull_requests if pr.user is not None)
+    _LOGGER.debug('Pull requests per author: %s', lazy(dict, pull_requests_per_author))
+    return pull_requests_per_author
+
+
+@step('sort_contributors_by_prs')
+def sort_contributors_by_prs(
+    repo: Repository,
+    contributors: List[NamedUser],
+    concurrency: int = 1,
+    pull_request_store: Optional[PullRequestStore] = None
+) -> List[str]:
     """ Sorts the list of contributors of the repository per amount of pull requests.
 
     The contributors are sorted based on the number of all pull requests, including the closed ones.
+    Contributors with the same amount of pull requests keep their original order.
 
     :param Repository repo: The repository to get the contributors for.
     :param List[NamedUser] contributors: A list of repository contributors.
+    :param int concurrency: The maximal number of pull requests pages fetched concurrently.
+    :param PullRequestStore pull_request_store: The store of the pull requests authors, if any.
     :returns: A list of contributors of the repository.
     :rtype: List[str]
     """
     try:
-        pull_requests = repo.get_pulls(state='all')
-        contributions = {contributor: [
-            pr for pr in pull_requests if pr.user.login == contributor.login
-        ]
-            for contributor in contributors}
-        _LOGGER.debug(repr({k: [p.title for p in v] for k, v in contributions.items()}))
-        return [first(c).login for c in sorted(contributions.items(), key=lambda item: len(last(item)), reverse=True)]
+        return rank_contributors(contributors, count_pull_requests_by_author(repo, concurrency, pull_request_store))
     except GithubException:
-        _LOGGER.exception(f'Unable to get releases for repository {repo.name}.')
+        _LOGGER.exception('Unable to get pull requests for repository %s.', repo.name)
+
+
+@step('count_open_pull_requests')
+def count_open_pull_requests(repo: Repository) -> int:
+    """ Counts the open pull requests of the repository.
+
+    :param Repository repo: The repository to count the open pull requests for.
+    :returns: The number of open pull requests.
+    :rtype: int
+    """
+    return count_items(repo.get_pulls(state='open'))
+
+
+def _rank_contributors(repo: Repository, contributors: List[NamedUser], pull_requests_per_author: Future) -> List[str]:
+    try:
+        return rank_contributors(contributors, pull_requests_per_author.result())
+    except GithubException:
+        _LOGGER.exception('Unable to get pull requests for repository %s.', repo.name)
+
+
+def rank_contributors(contributors: List[NamedUser], pull_requests_per_author: Counter) -> List[str]:
+    """ Ranks the contributors logins by their amount of pull requests.
+
+    Contributors with the same amount of pull requests keep their original order.
+
+    :param List[NamedUser] contributors: A list of repository contributors.
+    :param Counter pull_requests_per_author: The amount of pull requests per author login.
+    :returns: The contributors logins ordered by their amount of pull requests.
+    :rtype: List[str]
+    """
+    return [c.login for c in sorted(contributors, key=lambda c: pull_requests_per_author[c.login], reverse=True)]
+
+
+def _logins(users: List[NamedUser]) -> List[str]:
+    return [user.login for user in users]
@@ -0,0 +1,446 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+from urllib.parse import parse_qs, urlsplit
+
+from attr import asdict, define, field
+from github import Github, GithubException
+from github.Repository import Repository
+
+from repository_stats.branch_tree import BranchTree
+from repository_stats.commit_store import CommitStore
+from repository_stats.commit_utils import get_merged_pull_request
+from repository_stats.context_utils import submit_in_context
+from repository_stats.metrics import CONTENT_TYPE, REGISTRY, Counter, Histogram, record_cache, step
+from repository_stats.pull_request_store import PullRequestStore
+from repository_stats.repository_summary import (
+    RepositorySummary, count_open_pull_requests, count_pull_requests_by_author, get_contributors, latest_releases,
+    rank_contributors
+)
+from repository_stats.tracing import span
+
+
+_LOGGER = logging.getLogger(__name__)
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+DEFAULT_FIELD_TTLS = {
+    'name': 3600.0,
+    'forks': 60.0,
+    'stars': 60.0,
+    'num_open_pull_requests': 60.0,
+    'releases': 3600.0,
+    'num_contributors': 3600.0,
+    'sorted_contributors': 3600.0,
+}
+# how long a field is served after its TTL while it is refreshed in the background
+DEFAULT_FIELD_MAX_STALE = {
+    'name': 86400.0,
+    'forks': 600.0,
+    'stars': 600.0,
+    'num_open_pull_requests': 600.0,
+    'releases': 86400.0,
+    'num_contributors': 86400.0,
+    'sorted_contributors': 86400.0,
+}
+# the summary fields fetched together, the repository fields are fetched first since the others need the repository
+_REPOSITORY_FIELDS = ('name', 'forks', 'stars')
+_FIELD_GROUPS = (('releases',), ('num_open_pull_requests',), ('num_contributors', 'sorted_contributors'))
+_FRESH, _STALE, _EXPIRED = 'fresh', 'stale', 'expired'
+_STALE_FIELDS_HEADER = 'X-Stale-Fields'
+_JSON_CONTENT_TYPE = 'application/json'
+_SUMMARY_ROUTE = re.compile(r'^/repos/(?P<repository>[^/]+/[^/]+)/summary$')
+_BRANCH_TREE_ROUTE = re.compile(r'^/repos/(?P<repository>[^/]+/[^/]+)/pulls/(?P<number>\d+)/branch-tree$')
+SERVICE_REQUESTS = REGISTRY.register(Counter(
+    'repository_stats_service_requests_total', 'Service API requests.', ['route', 'status']
+))
+SERVICE_REQUEST_DURATION = REGISTRY.register(Histogram(
+    'repository_stats_service_request_duration_seconds', 'Service API requests latency.', ['route']
+))
+SUMMARY_REFRESHES = REGISTRY.register(Counter(
+    'repository_stats_service_summary_refreshes_total', 'Summary fields fetches.', ['fields', 'mode']
+))
+
+_Response = Tuple[int, Dict[str, str], bytes]
+
+
+class UpstreamError(Exception):
+    """ Raised when summary fields could not be fetched from GitHub, and are not cached. """
+
+
+class LruCache(Generic[K, V]):
+    """ A thread safe in-memory cache, evicting the least recently used entries.
+
+    :ivar str name: The cache name, in the cache metrics.
+    :ivar int max_entries: The maximal amount of entries.
+    """
+
+    def __init__(self, name: str, max_entries: int) -> None:
+        self.name = name
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def peek(self, key: K) -> Optional[V]:
+        """ Returns the entry of the key, if any, without marking it as used nor counting the lookup. """
+        return self._entries.get(key)
+
+    def get(self, key: K) -> Optional[V]:
+        """ Returns the entry of the key, if any, and marks it as the most recently used. """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        record_cache(self.name, hit=value is not None)
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        """ Stores the entry of the key, evicting the least recently used entries beyond `max_entries`. """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                _LOGGER.debug('Evicted %s cache entry %s.', self.name, evicted)
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class _SummaryEntry:
+    # a cached summary, with the fetch time of every field
+    repo: Repository = field()
+    values: Dict[str, Any] = field()
+    fetched_at: Dict[str, float] = field()
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class _BranchTreeEntry:
+    tree: BranchTree = field()
+    fetched_at: float = field()
+
+
+class RepositoryService:
+    """ Serves repository summaries and branch trees from in-memory caches, for a long-running process.
+
+    Every summary field expires after its own TTL, and only the expired fields are fetched again, e.g. the stars and
+    forks are refreshed without listing the contributors and pull requests again. Once expired, a field is still
+    served while it is stale, up to its own staleness bound, and refreshed in the background (stale-while-revalidate).
+    The fields fetched together are fetched by a single refresh at a time, shared by all the concurrent callers, and
+    replace the cached fields atomically.
+    The branch trees of merged pull requests never change, hence they do not expire by default.
+
+    :ivar Github github: The GitHub client, its HTTP connections pool is kept for the process lifetime.
+    :ivar int concurrency: The maximal number of concurrent fetches of a summary.
+    :ivar int recent_releases: The number of recent releases of the summaries.
+    :ivar Dict[str, float] field_ttls: The TTL in seconds of every summary field.
+    :ivar Dict[str, float] field_max_stale: How long in seconds every summary field is served stale after its TTL.
+    :ivar Optional[float] branch_tree_ttl: The TTL in seconds of the branch trees, they never expire if `None`.
+    :ivar CommitStore store: An optional commit store to consult before fetching the branch trees from GitHub.
+    :ivar PullRequestStore pull_request_store: An optional store of the pull requests authors, synchronized
+        incrementally when the contributors are refreshed.
+    """
+
+    def __init__(
+        self,
+        github: Github,
+        concurrency: int = 4,
+        recent_releases: int = 3,
+        field_ttls: Optional[Dict[str, float]] = None,
+        field_max_stale: Optional[Dict[str, float]] = None,
+        refresh_workers: int = 8,
+        max_summaries: int = 128,
+        max_branch_trees: int = 1024,
+        branch_tree_ttl: Optional[float] = None,
+        store: Optional[CommitStore] = None,
+        pull_request_store: Optional[PullRequestStore] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.github = github
+        self.concurrency = concurrency
+        self.recent_releases = recent_releases
+        self.field_ttls = {**DEFAULT_FIELD_TTLS, **(field_ttls or {})}
+        self.field_max_stale = {**DEFAULT_FIELD_MAX_STALE, **(field_max_stale or {})}
+        self.branch_tree_ttl = branch_tree_ttl
+        self.store = store
+        self.pull_request_store = pull_request_store
+        self._clock = clock
+        self._started_at = clock()
+        self._summaries: LruCache[str, _SummaryEntry] = LruCache('summaries', max_summaries)
+        self._branch_trees: LruCache[Tuple[str, int], _BranchTreeEntry] = LruCache('branch_trees', max_branch_trees)
+        self._refresher = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='refresh')
+        self._refreshes: Dict[Tuple[str, Tuple[str, ...]], Future] = {}
+        self._lock = threading.Lock()
+
+    def summary(self, full_name: str) -> RepositorySummary:
+        """ Returns the summary of a repository, see `summary_with_stale_fields`.
+
+        :param str full_name: The repository full name.
+        :returns: A `RepositorySummary` object.
+        :rtype: RepositorySummary
+        """
+        summary, _ = self.summary_with_stale_fields(full_name)
+        return summary
+
+    def summary_with_stale_fields(self, full_name: str) -> Tuple[RepositorySummary, List[str]]:
+        """ Returns the summary of a repository, and its fields served stale.
+
+        The missing fields, and the fields past their staleness bound, are fetched before returning. The stale fields
+        are returned as is, and refreshed in the background.
+
+        :param str full_name: The repository full name.
+        :returns: A `RepositorySummary` object, and the names of its stale fields.
+        :rtype: Tuple[RepositorySummary, List[str]]
+        :raises UpstreamError: If missing fields could not be fetched from GitHub.
+        """
+        entry = self._summaries.get(full_name)
+        freshness = self._freshness(entry, _REPOSITORY_FIELDS)
+        if freshness == _EXPIRED:
+            entry = self._refresh(full_name, _REPOSITORY_FIELDS, mode='blocking').result()
+        elif freshness == _STALE:
+            self._refresh(full_name, _REPOSITORY_FIELDS, mode='background')
+        blocking = []
+        for fields in _FIELD_GROUPS:
+            freshness = self._freshness(entry, fields)
+            if freshness == _EXPIRED:
+                blocking.append(self._refresh(full_name, fields, entry.repo, mode='blocking'))
+            elif freshness == _STALE:
+                self._refresh(full_name, fields, entry.repo, mode='background')
+        for refresh in blocking:
+            entry = refresh.result()
+        # the latest entry holds the fields refreshed meanwhile by the other callers as well
+        entry = self._summaries.peek(full_name) or entry
+        now = self._clock()
+        stale_fields = [
+            name for name, fetched_at in entry.fetched_at.items() if now - fetched_at >= self.field_ttls[name]
+        ]
+        _LOGGER.debug('Summary of %s, stale fields: %s', full_name, stale_fields)
+        # the summary functions log their GitHub errors and return `None`
+        missing_fields = [name for name, value in entry.values.items() if value is None]
+        if missing_fields:
+            raise UpstreamError(
+                f'Unable to fetch the {", ".join(missing_fields)} of {full_name} from GitHub, see the service log.'
+            )
+        return RepositorySummary(**entry.values), stale_fields
+
+    def branch_tree(self, full_name: str, pr_num: int, feature_branch: Optional[str] = None) -> Optional[BranchTree]:
+        """ Returns the branch tree of a merged pull request.
+
+        :param str full_name: The repository full name.
+        :param int pr_num: The pull request number.
+        :param str feature_branch: The feature branch of the pull request, resolved from the pull request if `None`.
+        :returns: A `BranchTree` instance, or `None` if it could not be built.
+        :rtype: Optional[BranchTree]
+        """
+        entry = self._branch_trees.get((full_name, pr_num))
+        now = self._clock()
+        if entry is not None and (self.branch_tree_ttl is None or now - entry.fetched_at < self.branch_tree_ttl):
+            if feature_branch not in (None, entry.tree.feature_branch):
+                raise ValueError(f'The branch {feature_branch} does not match pull request number {pr_num}.')
+            return entry.tree
+        repo = self._repository(full_name)
+        pull_request = get_merged_pull_request(repo, pr_num, self.store)
+        tree = BranchTree.from_github_branch(
+            repo, feature_branch or pull_request.head.ref, pr_num, self.store, pull_request
+        )
+        if tree is not None:
+            self._branch_trees.put((full_name, pr_num), _BranchTreeEntry(tree=tree, fetched_at=now))
+        return tree
+
+    def health(self) -> Dict[str, Any]:
+        """ Returns the service status, the cache sizes and the GitHub rate limit left (-1 until known). """
+        remaining, limit = self.github.requester.rate_limiting
+        return {
+            'status': 'ok',
+            'uptime': self._clock() - self._started_at,
+            'cached_summaries': len(self._summaries),
+            'cached_branch_trees': len(self._branch_trees),
+            'rate_limit_remaining': remaining,
+            'rate_limit': limit,
+        }
+
+    def close(self) -> None:
+        """ Waits for the background refreshes to complete. """
+        self._refresher.shutdown()
+
+    def _repository(self, full_name: str) -> Repository:
+        entry = self._summaries.get(full_name)
+        if entry is not None:
+            return entry.repo
+        with step('get_repo'):
+            return self.github.get_repo(full_name)
+
+    def _freshness(self, entry: Optional[_SummaryEntry], fields: Tuple[str, ...]) -> str:
+        if entry is None or any(name not in entry.fetched_at for name in fields):
+            return _EXPIRED
+        ages = {name: self._clock() - entry.fetched_at[name] for name in fields}
+        if any(age >= self.field_ttls[name] + self.field_max_stale[name] for name, age in ages.items()):
+            return _EXPIRED
+        return _STALE if any(age >= self.field_ttls[name] for name, age in ages.items()) else _FRESH
+
+    def _refresh(
+        self, full_name: str, fields: Tuple[str, ...], repo: Optional[Repository] = None, mode: str = 'background'
+    ) -> Future:
+        # a single refresh of the fields is in flight at a time, the concurrent callers share it
+        key = (full_name, fields)
+        with self._lock:
+            refresh = self._refreshes.get(key)
+            if refresh is None:
+                SUMMARY_REFRESHES.inc(fields=','.join(fields), mode=mode)
+                refresh = submit_in_context(self._refresher, self._fetch_and_merge, full_name, fields, repo)
+                self._refreshes[key] = refresh
+        return refresh
+
+    def _fetch_and_merge(self, full_name: str, fields: Tuple[str, ...], repo: Optional[Repository]) -> _SummaryEntry:
+        try:
+            started = self._clock()
+            if fields == _REPOSITORY_FIELDS:
+                with step('get_repo'):
+                    repo = self.github.get_repo(full_name)
+                values = {'name': repo.name, 'forks': repo.forks_count, 'stars': repo.stargazers_count}
+            else:
+                values = self._fetch_fields(repo, fields)
+            with self._lock:
+                entry = self._summaries.peek(full_name)
+                merged_values = {} if entry is None else dict(entry.values)
+                fetched_at = {} if entry is None else dict(entry.fetched_at)
+                if all(values[name] is not None for name in fields):
+                    merged_values.update(values)
+                    fetched_at.update(dict.fromkeys(fields, started))
+                else:
+                    # a failed fetch (logged by the summary functions) keeps the stale fields, and is retried later
+                    merged_values.update({name: value for name, value in values.items() if name not in merged_values})
+                merged = _SummaryEntry(
+                    repo=repo if entry is None or fields == _REPOSITORY_FIELDS else entry.repo,
+                    values=merged_values,
+                    fetched_at=fetched_at
+                )
+                self._summaries.put(full_name, merged)
+            return merged
+        except Exception:
+            _LOGGER.exception('Failed to refresh the %s of %s.', fields, full_name)
+            raise
+        finally:
+            with self._lock:
+                self._refreshes.pop((full_name, fields), None)
+
+    def _fetch_fields(self, repo: Repository, fields: Tuple[str, ...]) -> Dict[str, Any]:
+        if fields == ('releases',):
+            return {'releases': latest_releases(repo, self.recent_releases)}
+        if fields == ('num_open_pull_requests',):
+            return {'num_open_pull_requests': count_open_pull_requests(repo)}
+        contributors = get_contributors(repo, self.concurrency)
+        if contributors is None:
+            return dict.fromkeys(fields)
+        return {
+            'num_contributors': len(contributors),
+            'sorted_contributors': rank_contributors(
+                contributors, count_pull_requests_by_author(repo, self.concurrency, self.pull_request_store)
+            ),
+        }
+
+
+def serve(service: RepositoryService, port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """ Creates the HTTP/JSON API server of the service, to be run with `serve_forever`.
+
+    The routes are:
+
+    - `GET /repos/{owner}/{repo}/summary`: the repository summary, the fields served stale are listed in the
+      `X-Stale-Fields` header.
+    - `GET /repos/{owner}/{repo}/pulls/{number}/branch-tree[?feature_branch=BRANCH]`: the branch tree of a merged
+      pull request, as the commits shas of its feature and main branches.
+    - `GET /health`: the service status.
+    - `GET /metrics`: the Prometheus metrics (see `repository_stats.metrics`).
+
+    :param RepositoryService service: The service answering the requests.
+    :param int port: The local port to listen on, 0 for any free port.
+    :param str host: The address to listen on.
+    :returns: The server.
+    :rtype: ThreadingHTTPServer
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self) -> None:
+            url = urlsplit(self.path)
+            start = time.perf_counter()
+            route, status = _route(url.path), 500
+            try:
+                with span(f'GET {route}'):
+                    status, headers, body = _handle(service, route, url.path, parse_qs(url.query))
+            except GithubException as e:
+                status, headers, body = _error(502 if e.status >= 500 else e.status, _github_error_message(e))
+            except UpstreamError as e:
+                status, headers, body = _error(502, str(e))
+            except ValueError as e:
+                status, headers, body = _error(400, str(e))
+            except Exception as e:
+                _LOGGER.exception('Error while serving %s.', self.path)
+                status, headers, body = _error(500, str(e))
+            finally:
+                SERVICE_REQUESTS.inc(route=route, status=str(status))
+                SERVICE_REQUEST_DURATION.observe(time.perf_counter() - start, route=route)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            _LOGGER.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    _LOGGER.info('Serving the repository stats at http://%s:%d', host, server.server_port)
+    return server
+
+
+def _route(path: str) -> str:
+    if _SUMMARY_ROUTE.match(path):
+        return '/repos/{owner}/{repo}/summary'
+    if _BRANCH_TREE_ROUTE.match(path):
+        return '/repos/{owner}/{repo}/pulls/{number}/branch-tree'
+    return path if path in ('/health', '/metrics') else 'unknown'
+
+
+def _handle(service: RepositoryService, route: str, path: str, query: Dict[str, list]) -> _Response:
+    if route == '/health':
+        return _json(200, service.health())
+    if route == '/metrics':
+        return 200, {'Content-Type': CONTENT_TYPE}, REGISTRY.expose().encode()
+    summary_match = _SUMMARY_ROUTE.match(path)
+    if summary_match:
+        summary, stale_fields = service.summary_with_stale_fields(summary_match['repository'])
+        return _json(200, asdict(summary), {_STALE_FIELDS_HEADER: ','.join(stale_fields)} if stale_fields else {})
+    branch_tree_match = _BRANCH_TREE_ROUTE.match(path)
+    if branch_tree_match:
+        feature_branch = query.get('feature_branch', [None])[0]
+        tree = service.branch_tree(branch_tree_match['repository'], int(branch_tree_match['number']), feature_branch)
+        if tree is None:
+            return _error(404, 'The branch tree could not be built, see the service log.')
+        return _json(200, {
+            'feature_branch': tree.feature_branch,
+            'main_branch': tree.main_branch,
+            'feature_branch_commits': [commit.sha for commit in tree.feature_branch_commits],
+            'main_branch_commits': [commit.sha for commit in tree.main_branch_commits],
+        })
+    return _error(404, f'Unknown route {path}.')
+
+
+def _github_error_message(error: GithubException) -> str:
+    return error.data.get('message', str(error)) if isinstance(error.data, dict) else str(error)
+
+
+def _json(status: int, data: Any, headers: Optional[Dict[str, str]] = None) -> _Response:
+    return status, {'Content-Type': _JSON_CONTENT_TYPE, **(headers or {})}, json.dumps(data).encode()
+
+
+def _error(status: int, message: str) -> _Response:
+    return _json(status, {'error': message})
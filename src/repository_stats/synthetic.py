@@ -0,0 +1,490 @@
+import json
+import logging
+import random
+import re
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from attr import define, field
+from attr.validators import instance_of
+
+from repository_stats.fake_github import base_url, json_response, page_response
+from repository_stats.transport import HttpRequest, HttpResponse
+
+
+_LOGGER = logging.getLogger(__name__)
+_EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+_COMMIT_INTERVAL = timedelta(hours=1)
+_MAX_REVIEW_TIME = timedelta(days=30)
+_OPEN_RATIO = 0.05
+# the exponent of the Zipf distribution of the pull requests authors, a few contributors author most of them
+_AUTHORS_SKEW = 1.1
+_DEFAULT_PER_PAGE = 30
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+_OPERATION_NAME = re.compile(r'^\s*(?:query|mutation)\s+(\w+)')
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class SyntheticCommit:
+    """ Represents a commit of a synthetic repository.
+
+    :ivar str sha: The commit sha.
+    :ivar List[str] parents: The parents shas, the first one is on the same branch.
+    :ivar datetime date: The commit date.
+    """
+    sha: str = field(validator=instance_of(str))
+    parents: List[str] = field(factory=list)
+    date: datetime = field(validator=instance_of(datetime))
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class SyntheticPullRequest:
+    """ Represents a pull request of a synthetic repository.
+
+    Only the merged pull requests have their commits in the commit graph of the repository.
+
+    :ivar int number: The pull request number.
+    :ivar str author: The author login.
+    :ivar str state: Either `open` or `closed`.
+    :ivar str head_ref: The feature branch.
+    :ivar str head_sha: The feature branch head commit.
+    :ivar str base_sha: The main branch commit the feature branch is based on.
+    :ivar Optional[str] merge_commit_sha: The merge commit, if merged.
+    :ivar List[str] commit_shas: The feature branch commits by chronological order, if merged.
+    :ivar datetime created_at: The creation date.
+    :ivar datetime updated_at: The last update date.
+    :ivar Optional[datetime] closed_at: The closing date, if closed.
+    :ivar Optional[datetime] merged_at: The merge date, if merged.
+    """
+    number: int = field(validator=instance_of(int))
+    author: str = field(validator=instance_of(str))
+    state: str = field(validator=instance_of(str))
+    head_ref: str = field(validator=instance_of(str))
+    head_sha: str = field(validator=instance_of(str))
+    base_sha: str = field(validator=instance_of(str))
+    merge_commit_sha: Optional[str] = field(default=None)
+    commit_shas: List[str] = field(factory=list)
+    created_at: datetime = field(validator=instance_of(datetime))
+    updated_at: datetime = field(validator=instance_of(datetime))
+    closed_at: Optional[datetime] = field(default=None)
+    merged_at: Optional[datetime] = field(default=None)
+
+    @property
+    def merged(self) -> bool:
+        return self.merge_commit_sha is not None
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class SyntheticRepository:
+    """ Represents a complete synthetic GitHub repository.
+
+    :ivar str owner: The owner login.
+    :ivar str name: The repository name.
+    :ivar str default_branch: The main branch.
+    :ivar int forks: Number of forks.
+    :ivar int stars: Number of stars.
+    :ivar List[str] releases: The releases tag names, newest first.
+    :ivar List[str] contributors: The contributors logins, by descending number of contributions.
+    :ivar List[SyntheticPullRequest] pull_requests: The pull requests, by number.
+    :ivar Dict[str, SyntheticCommit] commits: The commit graph by sha.
+    :ivar List[str] main_branch: The first parent history of the main branch by chronological order.
+    :ivar List[Dict[str, Any]] events: The events feed, newest first, as returned by the GitHub API.
+    """
+    owner: str = field(validator=instance_of(str))
+    name: str = field(validator=instance_of(str))
+    default_branch: str = field(validator=instance_of(str))
+    forks: int = field(validator=instance_of(int))
+    stars: int = field(validator=instance_of(int))
+    releases: List[str] = field(factory=list)
+    contributors: List[str] = field(factory=list)
+    pull_requests: List[SyntheticPullRequest] = field(factory=list)
+    commits: Dict[str, SyntheticCommit] = field(factory=dict)
+    main_branch: List[str] = field(factory=list)
+    events: List[Dict[str, Any]] = field(factory=list)
+
+    @property
+    def full_name(self) -> str:
+        return f'{self.owner}/{self.name}'
+
+    def pull_request(self, number: int) -> Optional[SyntheticPullRequest]:
+        """ Returns the pull request of the given number, if any. """
+        return self.pull_requests[number - 1] if 0 < number <= len(self.pull_requests) else None
+
+    def widest_pull_request(self) -> SyntheticPullRequest:
+        """ Returns the merged pull request with the most main branch commits between its diverge and merge commits.
+        """
+        position = {sha: position for position, sha in enumerate(self.main_branch)}
+        return max(
+            (pr for pr in self.pull_requests if pr.merged),
+            key=lambda pr: position[pr.merge_commit_sha] - position[pr.base_sha]
+        )
+
+
+def generate_repository(
+    seed: int = 0,
+    pull_requests: int = 1_000,
+    contributors: int = 50,
+    main_branch_commits: int = 1_000,
+    merged_pull_requests: int = 20,
+    feature_branch_commits: int = 20,
+    releases: int = 10,
+    owner: str = 'synthetic',
+    name: str = 'repository'
+) -> SyntheticRepository:
+    """ Generates a synthetic repository, the same seed and sizes always generate the same repository.
+
+    The main branch is a chain of commits, with a merge commit per merged pull request. The feature branch of a
+    merged pull request diverges from the main branch, has up to `feature_branch_commits` commits and is merged back.
+    The widest merged pull request spans exactly `main_branch_commits` main branch commits between its diverge and
+    merge commits. The other pull requests are either open or closed without merging, and only have a head commit.
+    The pull requests authors follow a Zipf distribution over the contributors.
+
+    :param int seed: The seed of the generator.
+    :param int pull_requests: Number of pull requests.
+    :param int contributors: Number of contributors.
+    :param int main_branch_commits: Number of main branch commits spanned by the widest merged pull request.
+    :param int merged_pull_requests: Number of merged pull requests, at least 1.
+    :param int feature_branch_commits: Maximal number of commits of a feature branch.
+    :param int releases: Number of releases.
+    :param str owner: The owner login.
+    :param str name: The repository name.
+    :returns: The synthetic repository.
+    :rtype: SyntheticRepository
+    """
+    rng = random.Random(seed)
+    logins = [f'contributor-{i}' for i in range(contributors)]
+    cum_weights = list(accumulate(1 / (rank + 1) ** _AUTHORS_SKEW for rank in range(contributors)))
+    merged_pull_requests = max(1, min(merged_pull_requests, pull_requests))
+
+    def new_sha() -> str:
+        return f'{rng.getrandbits(160):040x}'
+
+    def new_author() -> str:
+        return rng.choices(logins, cum_weights=cum_weights)[0]
+
+    length = main_branch_commits + merged_pull_requests + 1
+    main_branch = [new_sha() for _ in range(length)]
+    dates = [_EPOCH + position * _COMMIT_INTERVAL for position in range(length)]
+    # the merge positions of the merged pull requests, the first one spans `main_branch_commits` commits
+    merges = {length - 1: length - 2 - main_branch_commits}
+    for position in rng.sample(range(2, length - 1), merged_pull_requests - 1):
+        merges[position] = rng.randrange(0, position - 1)
+    commits, pull_request_fields = {}, []
+    for position, sha in enumerate(main_branch):
+        parents = [main_branch[position - 1]] if position else []
+        if position in merges:
+            diverge = merges[position]
+            feature_shas = _feature_branch(
+                commits, main_branch[diverge], dates[diverge], dates[position], rng.randint(1, feature_branch_commits),
+                new_sha
+            )
+            parents.append(feature_shas[-1])
+            pull_request_fields.append(dict(
+                author=new_author(), state='closed', head_sha=feature_shas[-1], base_sha=main_branch[diverge],
+                merge_commit_sha=sha, commit_shas=feature_shas, created_at=dates[diverge] + _COMMIT_INTERVAL / 2,
+                updated_at=dates[position], closed_at=dates[position], merged_at=dates[position]
+            ))
+        commits[sha] = SyntheticCommit(sha=sha, parents=parents, date=dates[position])
+    for _ in range(pull_requests - merged_pull_requests):
+        position = rng.randrange(length)
+        created_at = dates[position] + rng.random() * _COMMIT_INTERVAL
+        closed_at = None if rng.random() < _OPEN_RATIO else created_at + rng.random() * _MAX_REVIEW_TIME
+        pull_request_fields.append(dict(
+            author=new_author(), state='open' if closed_at is None else 'closed', head_sha=new_sha(),
+            base_sha=main_branch[position], created_at=created_at, updated_at=closed_at or created_at,
+            closed_at=closed_at
+        ))
+    # the pull requests are numbered by creation order
+    pull_request_fields.sort(key=lambda fields: fields['created_at'])
+    synthetic_pull_requests = [
+        SyntheticPullRequest(number=number, head_ref=f'feature-{number}', **fields)
+        for number, fields in enumerate(pull_request_fields, start=1)
+    ]
+    contributions = Counter(pull_request.author for pull_request in synthetic_pull_requests)
+    return SyntheticRepository(
+        owner=owner,
+        name=name,
+        default_branch='main',
+        forks=rng.randint(0, pull_requests),
+        stars=rng.randint(0, 10 * pull_requests),
+        releases=[f'v{release // 10 + 1}.{release % 10}.0' for release in reversed(range(releases))],
+        contributors=sorted(logins, key=lambda login: contributions[login], reverse=True),
+        pull_requests=synthetic_pull_requests,
+        commits=commits,
+        main_branch=main_branch
+    )
+
+
+def _feature_branch(
+    commits: Dict[str, SyntheticCommit],
+    diverge_sha: str,
+    diverged_at: datetime,
+    merged_at: datetime,
+    num_commits: int,
+    new_sha: Callable[[], str]
+) -> List[str]:
+    shas, parent = [], diverge_sha
+    interval = (merged_at - diverged_at) / (num_commits + 1)
+    for index in range(1, num_commits + 1):
+        sha = new_sha()
+        commits[sha] = SyntheticCommit(sha=sha, parents=[parent], date=diverged_at + index * interval)
+        shas.append(sha)
+        parent = sha
+    return shas
+
+
+class SyntheticBackend:
+    """ Answers the GitHub API requests of the tool from a synthetic repository.
+
+    Serves the repository, its contributors, releases, pull requests (with their commits and merge status), commits
+    history, comparisons and events feed from the REST API, and the queries of `repository_stats.graphql_summary` from
+    the GraphQL API, with the GitHub pagination. Use it with a `FakeGitHub` server, or in memory with
+    `backend_middleware`. The listings and comparisons are computed once per distinct request, ignoring the pagination.
+
+    :ivar SyntheticRepository repository: The served repository.
+    """
+
+    def __init__(self, repository: SyntheticRepository) -> None:
+        self.repository = repository
+        self._cache: Dict[Tuple, Any] = {}
+        self._user_ids = {
+            login: user_id for user_id, login in enumerate(
+                dict.fromkeys([*repository.contributors, *(pr.author for pr in repository.pull_requests)]), start=1
+            )
+        }
+        self._routes: List[Tuple[re.Pattern, Callable[..., HttpResponse]]] = [
+            (re.compile(r''), self._get_repository),
+            (re.compile(r'/contributors'), self._get_contributors),
+            (re.compile(r'/releases'), self._get_releases),
+            (re.compile(r'/pulls'), self._get_pull_requests),
+            (re.compile(r'/pulls/(\d+)'), self._get_pull_request),
+            (re.compile(r'/pulls/(\d+)/commits'), self._get_pull_request_commits),
+            (re.compile(r'/pulls/(\d+)/merge'), self._get_pull_request_merge),
+            (re.compile(r'/commits'), self._get_commits),
+            (re.compile(r'/compare/(\w+)\.\.\.(\w+)'), self._compare),
+            (re.compile(r'/events'), self._get_events),
+        ]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the routes are bound methods, they are rebuilt with the cache by the unpickled backend
+        return {'repository': self.repository}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state['repository'])
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        url = urlsplit(request.url)
+        if request.verb == 'POST' and url.path == '/graphql':
+            return self._graphql(json.loads(request.body))
+        prefix = f'/repos/{self.repository.full_name}'
+        if request.verb == 'GET' and url.path.startswith(prefix):
+            route = url.path[len(prefix):]
+            for pattern, handler in self._routes:
+                match = pattern.fullmatch(route)
+                if match:
+                    return handler(base_url(request), url.path, dict(parse_qsl(url.query)), *match.groups())
+        _LOGGER.debug('No synthetic route for %s %s', request.verb, request.url)
+        return json_response({'message': 'Not Found'}, status=404)
+
+    def _get_repository(self, base_url: str, path: str, params: Dict[str, str]) -> HttpResponse:
+        repository = self.repository
+        return json_response({
+            'name': repository.name,
+            'full_name': repository.full_name,
+            'owner': {'login': repository.owner},
+            'url': f'{base_url}{path}',
+            'default_branch': repository.default_branch,
+            'forks_count': repository.forks,
+            'stargazers_count': repository.stars,
+            'open_issues_count': sum(pr.state == 'open' for pr in repository.pull_requests),
+        })
+
+    def _get_contributors(self, base_url: str, path: str, params: Dict[str, str]) -> HttpResponse:
+        return _page(base_url, path, params, self.repository.contributors, lambda logins: [
+            self._render_user(base_url, login) for login in logins
+        ])
+
+    def _get_releases(self, base_url: str, path: str, params: Dict[str, str]) -> HttpResponse:
+        return _page(base_url, path, params, self.repository.releases, lambda tags: [
+            {'tag_name': tag, 'name': tag} for tag in tags
+        ])
+
+    def _get_events(self, base_url: str, path: str, params: Dict[str, str]) -> HttpResponse:
+        return _page(base_url, path, params, self.repository.events, list)
+
+    def _get_pull_requests(self, base_url: str, path: str, params: Dict[str, str]) -> HttpResponse:
+        state, base = params.get('state', 'open'), params.get('base')
+        sort = params.get('sort', 'created')
+        direction = params.get('direction', 'desc' if sort == 'created' else 'asc')
+        key = ('pulls', state, base, sort, direction)
+        if key not in self._cache:
+            self._cache[key] = sorted(
+                (
+                    pr for pr in self.repository.pull_requests
+                    if state in ('all', pr.state) and base in (None, self.repository.default_branch)
+                ),
+                key=lambda pr: (pr.updated_at if sort == 'updated' else pr.created_at, pr.number),
+                reverse=direction == 'desc'
+            )
+        return _page(base_url, path, params, self._cache[key], lambda pull_requests: [
+            self._render_pull_request(base_url, pr) for pr in pull_requests
+        ])
+
+    def _get_pull_request(self, base_url: str, path: str, params: Dict[str, str], number: str) -> HttpResponse:
+        pull_request = self.repository.pull_request(int(number))
+        if pull_request is None:
+            return json_response({'message': 'Not Found'}, status=404)
+        return json_response({
+            **self._render_pull_request(base_url, pull_request),
+            'merged': pull_request.merged,
+            'commits': len(pull_request.commit_shas),
+        })
+
+    def _get_pull_request_merge(self, base_url: str, path: str, params: Dict[str, str], number: str) -> HttpResponse:
+        pull_request = self.repository.pull_request(int(number))
+        if pull_request is None or not pull_request.merged:
+            return json_response({'message': 'Not Found'}, status=404)
+        return HttpResponse(status=204, headers={}, body='')
+
+    def _get_pull_request_commits(
+        self, base_url: str, path: str, params: Dict[str, str], number: str
+    ) -> HttpResponse:
+        pull_request = self.repository.pull_request(int(number))
+        if pull_request is None:
+            return json_response({'message': 'Not Found'}, status=404)
+        return _page(base_url, path, params, pull_request.commit_shas, lambda shas: [
+            self._render_commit(base_url, sha) for sha in shas
+        ])
+
+    def _get_commits(self, base_url: str, path: str, params: Dict[str, str]) -> HttpResponse:
+        head_sha = params.get('sha', self.repository.main_branch[-1])
+        if head_sha not in self.repository.commits:
+            return json_response({'message': 'Not Found'}, status=404)
+        key = ('history', head_sha)
+        if key not in self._cache:
+            self._cache[key] = sorted(self._ancestors(head_sha), key=self._date, reverse=True)
+        return _page(base_url, path, params, self._cache[key], lambda shas: [
+            self._render_commit(base_url, sha) for sha in shas
+        ])
+
+    def _compare(self, base_url: str, path: str, params: Dict[str, str], base_sha: str, head_sha: str) -> HttpResponse:
+        if base_sha not in self.repository.commits or head_sha not in self.repository.commits:
+            return json_response({'message': 'Not Found'}, status=404)
+        key = ('compare', base_sha, head_sha)
+        if key not in self._cache:
+            base_ancestors, head_ancestors = self._ancestors(base_sha), self._ancestors(head_sha)
+            self._cache[key] = (
+                max(base_ancestors & head_ancestors, key=self._date),
+                sorted(head_ancestors - base_ancestors, key=self._date),
+                len(base_ancestors - head_ancestors)
+            )
+        merge_base_sha, commit_shas, behind_by = self._cache[key]
+        return _page(base_url, path, params, commit_shas, lambda shas: {
+            'url': f'{base_url}{path}',
+            'status': 'ahead' if not behind_by else 'diverged',
+            'ahead_by': len(commit_shas),
+            'behind_by': behind_by,
+            'total_commits': len(commit_shas),
+            'base_commit': self._render_commit(base_url, base_sha),
+            'merge_base_commit': self._render_commit(base_url, merge_base_sha),
+            'commits': [self._render_commit(base_url, sha) for sha in shas],
+            'files': [],
+        })
+
+    def _graphql(self, body: Dict[str, Any]) -> HttpResponse:
+        match = _OPERATION_NAME.match(body['query'])
+        variables = body.get('variables') or {}
+        if f'{variables.get("owner")}/{variables.get("name")}' != self.repository.full_name:
+            return json_response({'data': {'repository': None}})
+        if match and match.group(1) == 'RepositorySummary':
+            return json_response({'data': {'repository': self._repository_summary(variables['releases'])}})
+        if match and match.group(1) == 'PullRequestAuthors':
+            return json_response({'data': {'repository': self._pull_request_authors(
+                variables['pageSize'], variables.get('cursor')
+            )}})
+        return json_response({'errors': [{'message': 'Unsupported synthetic GraphQL operation.'}]})
+
+    def _repository_summary(self, releases: int) -> Dict[str, Any]:
+        repository = self.repository
+        return {
+            'name': repository.name,
+            'forkCount': repository.forks,
+            'stargazerCount': repository.stars,
+            'pullRequests': {'totalCount': sum(pr.state == 'open' for pr in repository.pull_requests)},
+            'releases': {'nodes': [{'tagName': tag} for tag in repository.releases[:releases]]},
+        }
+
+    def _pull_request_authors(self, page_size: int, cursor: Optional[str]) -> Dict[str, Any]:
+        start = int(cursor) if cursor else 0
+        end = min(start + page_size, len(self.repository.pull_requests))
+        return {'pullRequests': {
+            'pageInfo': {'hasNextPage': end < len(self.repository.pull_requests), 'endCursor': str(end)},
+            'nodes': [{'author': {'login': pr.author}} for pr in self.repository.pull_requests[start:end]],
+        }}
+
+    def _render_pull_request(self, base_url: str, pull_request: SyntheticPullRequest) -> Dict[str, Any]:
+        url = f'{base_url}/repos/{self.repository.full_name}/pulls/{pull_request.number}'
+        return {
+            'url': url,
+            'number': pull_request.number,
+            'state': pull_request.state,
+            'title': f'Synthetic pull request #{pull_request.number}',
+            'user': self._render_user(base_url, pull_request.author),
+            'created_at': _timestamp(pull_request.created_at),
+            'updated_at': _timestamp(pull_request.updated_at),
+            'closed_at': _timestamp(pull_request.closed_at),
+            'merged_at': _timestamp(pull_request.merged_at),
+            'merge_commit_sha': pull_request.merge_commit_sha,
+            'head': {'ref': pull_request.head_ref, 'sha': pull_request.head_sha},
+            'base': {'ref': self.repository.default_branch, 'sha': pull_request.base_sha},
+        }
+
+    def _render_user(self, base_url: str, login: str) -> Dict[str, Any]:
+        # the users are complete, PyGithub hashes them by their ids and would fetch the missing fields
+        return {
+            'login': login,
+            'id': self._user_ids.get(login, 0),
+            'url': f'{base_url}/users/{login}',
+            'html_url': f'https://github.com/{login}',
+            'type': 'User',
+            'site_admin': False,
+        }
+
+    def _render_commit(self, base_url: str, sha: str) -> Dict[str, Any]:
+        commit = self.repository.commits.get(sha)
+        return {
+            'sha': sha,
+            'url': f'{base_url}/repos/{self.repository.full_name}/commits/{sha}',
+            'parents': [{'sha': parent} for parent in commit.parents] if commit else [],
+            'commit': {'message': f'Synthetic commit {sha[:7]}', 'author': {
+                'name': 'synthetic', 'date': _timestamp(commit.date) if commit else None
+            }},
+        }
+
+    def _ancestors(self, sha: str) -> Set[str]:
+        ancestors, pending = set(), [sha]
+        while pending:
+            current = pending.pop()
+            if current not in ancestors:
+                ancestors.add(current)
+                pending.extend(self.repository.commits[current].parents)
+        return ancestors
+
+    def _date(self, sha: str) -> Tuple[datetime, str]:
+        return self.repository.commits[sha].date, sha
+
+
+def _page(
+    base_url: str, path: str, params: Dict[str, str], items: List[Any], render: Callable[[List[Any]], Any]
+) -> HttpResponse:
+    params = dict(params)
+    per_page = int(params.pop('per_page', _DEFAULT_PER_PAGE))
+    page = int(params.pop('page', 1))
+    return page_response(base_url, path, params, items, per_page, page, render)
+
+
+def _timestamp(date: Optional[datetime]) -> Optional[str]:
+    return None if date is None else date.strftime(_TIMESTAMP_FORMAT)
@@ -0,0 +1,266 @@
+import argparse
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+from attr import define, field
+
+from repository_stats.transport import HttpRequest, HttpResponse, Send, normalize_endpoint
+
+
+_LOGGER = logging.getLogger(__name__)
+SERVICE_NAME = 'repository_stats'
+OTLP_TRACES_PATH = '/v1/traces'
+DEFAULT_COLLECTOR_PORT = 4318
+_SPAN_KIND_INTERNAL = 1
+_SPAN_KIND_CLIENT = 3
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('span', default=None)
+_tracer: Optional['Tracer'] = None
+
+
+@define(kw_only=True, slots=True)
+class Span:
+    """ A timed operation of a trace.
+
+    :ivar str name: The operation name.
+    :ivar str trace_id: The trace id, as 32 hex digits.
+    :ivar str span_id: The span id, as 16 hex digits.
+    :ivar str parent_span_id: The id of the enclosing span, if any.
+    :ivar int kind: The OTLP span kind.
+    :ivar int start_time: The start time in nanoseconds since the epoch.
+    :ivar int end_time: The end time in nanoseconds since the epoch, set when the span ends.
+    :ivar Dict[str, Any] attributes: The span attributes.
+    :ivar str error: The error message if the operation failed.
+    """
+    name: str = field()
+    trace_id: str = field()
+    span_id: str = field()
+    parent_span_id: Optional[str] = field(default=None)
+    kind: int = field(default=_SPAN_KIND_INTERNAL)
+    start_time: int = field(factory=time.time_ns)
+    end_time: Optional[int] = field(default=None)
+    attributes: Dict[str, Any] = field(factory=dict)
+    error: Optional[str] = field(default=None)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """ Returns the span in the OTLP JSON encoding. """
+        otlp = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_time),
+            'endTimeUnixNano': str(self.end_time),
+            'attributes': _otlp_attributes(self.attributes),
+            'status': {'code': _STATUS_OK} if self.error is None else {'code': _STATUS_ERROR, 'message': self.error},
+        }
+        if self.parent_span_id is not None:
+            otlp['parentSpanId'] = self.parent_span_id
+        return otlp
+
+
+class Tracer:
+    """ Collects the finished spans of the process.
+
+    :ivar str service_name: The traced service name, exported as the `service.name` resource attribute.
+    """
+
+    def __init__(self, service_name: str = SERVICE_NAME) -> None:
+        self.service_name = service_name
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    @property
+    def spans(self) -> List[Span]:
+        """ The finished spans, by end time. """
+        with self._lock:
+            return list(self._spans)
+
+    def finish(self, span: Span) -> None:
+        span.end_time = time.time_ns()
+        with self._lock:
+            self._spans.append(span)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """ Returns the finished spans as an OTLP JSON `ExportTraceServiceRequest`. """
+        return {'resourceSpans': [{
+            'resource': {'attributes': _otlp_attributes({'service.name': self.service_name})},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': [span.to_otlp() for span in self.spans]}],
+        }]}
+
+
+def start_tracing(service_name: str = SERVICE_NAME) -> Tracer:
+    """ Starts recording the spans of the process, which are not recorded by default.
+
+    :param str service_name: The traced service name.
+    :returns: The tracer collecting the spans.
+    :rtype: Tracer
+    """
+    global _tracer
+    _tracer = Tracer(service_name)
+    return _tracer
+
+
+def stop_tracing() -> Optional[Tracer]:
+    """ Stops recording the spans.
+
+    :returns: The tracer of the finished spans, if tracing was started.
+    :rtype: Optional[Tracer]
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+@contextmanager
+def span(name: str, kind: int = _SPAN_KIND_INTERNAL, **attributes: Any) -> Iterator[Optional[Span]]:
+    """ Traces the context (or the decorated function) as a span, nested in the current span.
+
+    Does nothing unless tracing was started (see `start_tracing`). The current span is a context variable, hence
+    the spans of the pool threads are nested only through `submit_in_context` (see `repository_stats.context_utils`).
+
+    :param str name: The span name.
+    :param int kind: The OTLP span kind.
+    :param attributes: The span attributes.
+    :returns: The span, or `None` if tracing was not started.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield None
+        return
+    parent = _current_span.get()
+    current = Span(
+        name=name,
+        trace_id=_random_id(128) if parent is None else parent.trace_id,
+        span_id=_random_id(64),
+        parent_span_id=None if parent is None else parent.span_id,
+        kind=kind,
+        attributes=attributes,
+    )
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        _current_span.reset(token)
+        tracer.finish(current)
+
+
+class TracingMiddleware:
+    """ A transport middleware tracing every GitHub request as a client span of the current span.
+
+    Installed as the outermost middleware, the spans include the time spent in the cache and the rate limit scheduler.
+    """
+
+    def __call__(self, request: HttpRequest, send: Send) -> HttpResponse:
+        with span(
+            f'{request.verb} {normalize_endpoint(request.url)}',
+            kind=_SPAN_KIND_CLIENT,
+            **{'http.request.method': request.verb, 'url.full': request.url}
+        ) as current:
+            response = send(request)
+            if current is not None:
+                current.attributes['http.response.status_code'] = response.status
+                current.attributes['http.response.body.size'] = len(response.body)
+            return response
+
+
+def write_trace(tracer: Tracer, path: Path) -> None:
+    """ Writes the finished spans to a file in the OTLP JSON format.
+
+    :param Tracer tracer: The tracer of the spans.
+    :param Path path: The output file.
+    """
+    path.write_text(json.dumps(tracer.to_otlp()))
+    _LOGGER.info('Wrote %d spans to %s.', len(tracer.spans), path)
+
+
+def export_trace(tracer: Tracer, endpoint: str, timeout: float = 10.0) -> None:
+    """ Exports the finished spans to an OTLP/HTTP collector.
+
+    :param Tracer tracer: The tracer of the spans.
+    :param str endpoint: The collector traces URL, e.g. `http://localhost:4318/v1/traces`.
+    :param float timeout: The request timeout in seconds.
+    """
+    response = requests.post(endpoint, json=tracer.to_otlp(), timeout=timeout)
+    response.raise_for_status()
+    _LOGGER.info('Exported %d spans to %s.', len(tracer.spans), endpoint)
+
+
+def serve_collector(output: Path, port: int = DEFAULT_COLLECTOR_PORT, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """ Serves a stand-in OTLP/HTTP collector, appending every received JSON export as a line of the output file.
+
+    :param Path output: The output file of the exports.
+    :param int port: The local port to listen on, 0 for any free port.
+    :param str host: The address to listen on.
+    :returns: The server, to be run with `serve_forever`.
+    :rtype: ThreadingHTTPServer
+    """
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            if self.path != OTLP_TRACES_PATH:
+                self.send_error(404)
+                return
+            export = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            with lock, output.open('a') as output_file:
+                output_file.write(json.dumps(export) + '\n')
+            body = b'{}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            _LOGGER.debug(format, *args)
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def _random_id(bits: int) -> str:
+    return f'{random.getrandbits(bits):0{bits // 4}x}'
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items()]
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(description='A stand-in OTLP/HTTP collector writing the traces to a file.')
+    parser.add_argument('--port', type=int, default=DEFAULT_COLLECTOR_PORT)
+    parser.add_argument('--output', type=Path, default=Path('traces.jsonl'))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = serve_collector(args.output, args.port)
+    _LOGGER.info(
+        'Collecting traces at http://127.0.0.1:%d%s into %s', server.server_port, OTLP_TRACES_PATH, args.output
+    )
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,199 @@
+import logging
+import re
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Callable, Dict, ItemsView, Iterator, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from attr import define, evolve, field
+from github.Requester import Requester
+from urllib3 import Retry
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class HttpRequest:
+    """ Represents an HTTP request sent to the GitHub API.
+
+    :ivar str verb: The HTTP method.
+    :ivar str url: The absolute URL of the request.
+    :ivar Dict[str, str] headers: The request headers.
+    :ivar body: The request body, if any.
+    """
+    verb: str = field()
+    url: str = field()
+    headers: Dict[str, str] = field(factory=dict)
+    body: Optional[Union[str, bytes]] = field(default=None)
+
+    def with_headers(self, **headers: str) -> 'HttpRequest':
+        """ Returns a copy of the request with additional headers. """
+        return evolve(self, headers={**self.headers, **headers})
+
+
+@define(frozen=True, kw_only=True, slots=True)
+class HttpResponse:
+    """ Represents an HTTP response of the GitHub API, mimicking the `http.client` response used by PyGithub.
+
+    :ivar int status: The HTTP status code.
+    :ivar Dict[str, str] headers: The response headers, with lower case names.
+    :ivar str body: The response body.
+    """
+    status: int = field()
+    headers: Dict[str, str] = field(factory=dict)
+    body: str = field(default='')
+
+    def getheaders(self) -> ItemsView[str, str]:
+        return self.headers.items()
+
+    def read(self) -> str:
+        return self.body
+
+
+Send = Callable[[HttpRequest], HttpResponse]
+Middleware = Callable[[HttpRequest, Send], HttpResponse]
+_middlewares: Tuple[Middleware, ...] = ()
+_sessions: Dict[Tuple[str, str, int], requests.Session] = {}
+_sessions_lock = threading.Lock()
+_request_slots: ContextVar[Optional[threading.BoundedSemaphore]] = ContextVar('request_slots', default=None)
+_REPOSITORY_PATH = re.compile(r'^/repos/[^/]+/[^/]+')
+_SHA = re.compile(r'^[0-9a-f]{40}$')
+
+
+def install_middlewares(*middlewares: Middleware) -> None:
+    """ Routes all the GitHub requests through the given middlewares.
+
+    Every middleware is called with the request and the next `send` callable in the chain, the first middleware
+    is the outermost one. Must be called before creating the `Github` client.
+    The connections of the installed transport share a single pooled HTTP session per host, and are safe to use
+    from multiple threads.
+
+    :param Middleware middlewares: The middlewares to route the requests through.
+    """
+    global _middlewares
+    _middlewares = middlewares
+    Requester.injectConnectionClasses(_HttpConnection, _HttpsConnection)
+    _LOGGER.debug('Installed GitHub transport middlewares: %s', middlewares)
+
+
+@contextmanager
+def limit_concurrent_requests(limit: int) -> Iterator[None]:
+    """ Limits the number of GitHub requests in flight at once from the context.
+
+    The limit is shared by the threads running work submitted from the context with
+    `repository_stats.context_utils.submit_in_context`, e.g. the nested thread pools of a summary and of its listings
+    pages. A request holds its slot through all the middlewares, including the rate limit retries.
+
+    :param int limit: The maximal number of requests in flight.
+    """
+    token = _request_slots.set(threading.BoundedSemaphore(limit))
+    try:
+        yield
+    finally:
+        _request_slots.reset(token)
+
+
+def normalize_endpoint(url: str) -> str:
+    """ Returns the endpoint template of a GitHub API URL, to keep the metrics labels cardinality bounded.
+
+    :param str url: The request URL.
+    :returns: The URL path with the repository, numbers, shas and compared refs replaced by placeholders,
+        e.g. `/repos/{owner}/{repo}/pulls/{number}`.
+    :rtype: str
+    """
+    path = urlsplit(url).path
+    path = _REPOSITORY_PATH.sub('/repos/{owner}/{repo}', path)
+    segments = path.split('/')
+    for index, segment in enumerate(segments):
+        if index > 0 and segments[index - 1] == 'compare':
+            segments[index] = '{basehead}'
+        elif segment.isdigit():
+            segments[index] = '{number}'
+        elif _SHA.match(segment):
+            segments[index] = '{sha}'
+    return '/'.join(segments)
+
+
+def _shared_session(
+    protocol: str, host: str, port: int, retry: Optional[Union[int, Retry]], pool_size: Optional[int]
+) -> requests.Session:
+    with _sessions_lock:
+        key = (protocol, host, port)
+        if key not in _sessions:
+            session = requests.Session()
+            session.auth = Requester.noopAuth
+            pool_size = pool_size or requests.adapters.DEFAULT_POOLSIZE
+            session.mount(f'{protocol}://', requests.adapters.HTTPAdapter(
+                max_retries=requests.adapters.DEFAULT_RETRIES if retry is None else retry,
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+            ))
+            _sessions[key] = session
+        return _sessions[key]
+
+
+class _HttpConnection:
+    # mimics the httplib connection object expected by the PyGithub `Requester`
+    protocol = 'http'
+    default_port = 80
+
+    def __init__(
+        self,
+        host: str,
+        port: Optional[int] = None,
+        strict: bool = False,
+        timeout: Optional[int] = None,
+        retry: Optional[Union[int, Retry]] = None,
+        pool_size: Optional[int] = None,
+        **kwargs,
+    ) -> None:
+        self.host = host
+        self.port = port if port else self.default_port
+        self.timeout = timeout
+        self.verify = kwargs.get('verify', True)
+        self.session = _shared_session(self.protocol, host, self.port, retry, pool_size)
+        self._request: Optional[HttpRequest] = None
+
+    def request(self, verb: str, url: str, input: Optional[Union[str, bytes]], headers: Dict[str, str]) -> None:
+        self._request = HttpRequest(
+            verb=verb, url=f'{self.protocol}://{self.host}:{self.port}{url}', headers=headers, body=input
+        )
+
+    def getresponse(self) -> HttpResponse:
+        send = self._send
+        for middleware in reversed(_middlewares):
+            send = _bind(middleware, send)
+        with _request_slots.get() or nullcontext():
+            return send(self._request)
+
+    def close(self) -> None:
+        # the session is shared between the connections
+        pass
+
+    def _send(self, request: HttpRequest) -> HttpResponse:
+        response = self.session.request(
+            request.verb,
+            request.url,
+            headers=request.headers,
+            data=request.body,
+            timeout=self.timeout,
+            verify=self.verify,
+            allow_redirects=False,
+        )
+        return HttpResponse(
+            status=response.status_code,
+            headers={k.lower(): v for k, v in response.headers.items()},
+            body=response.text
+        )
+
+
+class _HttpsConnection(_HttpConnection):
+    protocol = 'https'
+    default_port = 443
+
+
+def _bind(middleware: Middleware, send: Send) -> Send:
+    return lambda request: middleware(request, send)
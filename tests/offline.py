@@ -0,0 +1,16 @@
+from github import Github
+
+from repository_stats.fake_github import backend_middleware
+from repository_stats.synthetic import SyntheticBackend, SyntheticRepository
+from repository_stats.transport import Middleware, install_middlewares
+
+
+OFFLINE_BASE_URL = 'http://fake-github'
+
+
+def offline_github(repository: SyntheticRepository, *middlewares: Middleware) -> Github:
+    """ Returns a GitHub client answered in memory by a synthetic repository, through the given middlewares. """
+    install_middlewares(*middlewares, backend_middleware(SyntheticBackend(repository)))
+    return Github(
+        base_url=OFFLINE_BASE_URL, per_page=100, retry=None, seconds_between_requests=None, seconds_between_writes=None
+    )
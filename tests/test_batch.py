@@ -0,0 +1,68 @@
+import tempfile
+import unittest
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from repository_stats.batch import build_branch_trees, write_branch_trees
+from repository_stats.branch_tree import BranchTree
+from repository_stats.commit_utils import CommitRecord, get_in_between_commits
+from repository_stats.synthetic import generate_repository
+from repository_stats.transport import HttpRequest, HttpResponse, Send
+from tests.offline import offline_github
+
+
+class BuildBranchTreesTest(unittest.TestCase):
+    def setUp(self):
+        self.synthetic = generate_repository(main_branch_commits=200, merged_pull_requests=20)
+        self.numbers = [pr.number for pr in self.synthetic.pull_requests if pr.merged]
+
+    def expected_main_branch(self, repo, number):
+        pull_request = self.synthetic.pull_request(number)
+        diverge = CommitRecord(repo.compare(pull_request.base_sha, pull_request.head_sha).merge_base_commit.sha)
+        merge = CommitRecord(pull_request.merge_commit_sha)
+        return [diverge, *get_in_between_commits(repo, diverge, merge), merge]
+
+    def test_matches_the_compares(self):
+        repo = offline_github(self.synthetic).get_repo(self.synthetic.full_name)
+        trees = build_branch_trees(repo, self.numbers, max_main_branch_commits=100)
+        self.assertEqual(sorted(trees), sorted(self.numbers))
+        for number, tree in trees.items():
+            self.assertEqual(tree.main_branch_commits, self.expected_main_branch(repo, number), number)
+
+    def test_matches_the_compares_of_merges_older_than_the_span(self):
+        # the history of a single pull request is listed down to its diverge commit only, hence the feature branches
+        # of the pull requests merged meanwhile and diverged before are partly outside of the span
+        repo = offline_github(self.synthetic).get_repo(self.synthetic.full_name)
+        for number in self.numbers:
+            tree = build_branch_trees(repo, [number])[number]
+            self.assertEqual(tree.main_branch_commits, self.expected_main_branch(repo, number), number)
+
+    def test_falls_back_to_the_compares_when_the_history_fails(self):
+        def fail_history(request: HttpRequest, send: Send) -> HttpResponse:
+            if urlsplit(request.url).path == f'/repos/{self.synthetic.full_name}/commits':
+                return HttpResponse(status=500, body='{"message": "Server Error"}')
+            return send(request)
+
+        repo = offline_github(self.synthetic, fail_history).get_repo(self.synthetic.full_name)
+        with self.assertLogs('repository_stats.batch', 'ERROR'):
+            trees = build_branch_trees(repo, self.numbers)
+        self.assertEqual(sorted(trees), sorted(self.numbers))
+        for number, tree in trees.items():
+            self.assertEqual(tree.main_branch_commits, self.expected_main_branch(repo, number), number)
+
+
+class WriteBranchTreesTest(unittest.TestCase):
+    def test_writes_the_trees_of_slashed_branches(self):
+        tree = BranchTree(
+            feature_branch='feat/x',
+            main_branch='main',
+            feature_branch_commits=[CommitRecord('f1'), CommitRecord('f2')],
+            main_branch_commits=[CommitRecord('m1'), CommitRecord('m2')]
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            write_branch_trees({12: tree}, Path(directory))
+            self.assertEqual([path.name for path in Path(directory).iterdir()], ['branch_feat_x_pr12_graph.dot'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+import unittest
+
+from repository_stats.commit_utils import CommitGraph
+
+
+class CommitGraphTest(unittest.TestCase):
+    def test_commits_range_of_merges(self):
+        parents = {'M2': ['M1', 'A1'], 'A1': ['D'], 'M1': ['D', 'B1'], 'B1': ['D'], 'D': ['X']}
+        graph = CommitGraph(parents, ['M2', 'A1', 'M1', 'B1', 'D'])
+        self.assertEqual(graph.commits_range('D', 'M2'), ['B1', 'M1', 'A1', 'M2'])
+
+    def test_commits_range_leaving_the_span(self):
+        # `B1` is older than the listed span, hence the range can not be resolved locally
+        parents = {'MA': ['MB', 'A1'], 'A1': ['D'], 'MB': ['E', 'B1'], 'E': ['D'], 'D': ['X']}
+        graph = CommitGraph(parents, ['MA', 'A1', 'MB', 'E', 'D'])
+        self.assertIsNone(graph.commits_range('D', 'MA'))
+
+    def test_commits_range_outside_of_the_span(self):
+        graph = CommitGraph({'M': ['D'], 'D': ['X']}, ['M', 'D'])
+        self.assertIsNone(graph.commits_range('Y', 'M'))
+
+
+if __name__ == '__main__':
+    unittest.main()
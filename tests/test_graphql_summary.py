@@ -0,0 +1,54 @@
+import json
+import unittest
+from urllib.parse import urlsplit
+
+from repository_stats.graphql_summary import summarize_repository_graphql
+from repository_stats.repository_summary import summarize_repository
+from repository_stats.synthetic import generate_repository
+from repository_stats.transport import HttpRequest, HttpResponse, Send
+from tests.offline import offline_github
+
+
+def _graphql_answer(status: int, data: dict):
+    def answer(request: HttpRequest, send: Send) -> HttpResponse:
+        if urlsplit(request.url).path == '/graphql':
+            return HttpResponse(status=status, headers={'content-type': 'application/json'}, body=json.dumps(data))
+        return send(request)
+    return answer
+
+
+class SummarizeRepositoryGraphqlTest(unittest.TestCase):
+    def setUp(self):
+        self.synthetic = generate_repository(pull_requests=450, main_branch_commits=50)
+        repo = offline_github(self.synthetic).get_repo(self.synthetic.full_name)
+        self.expected = summarize_repository(repo, concurrency=2)
+
+    def summarize(self, *middlewares):
+        repo = offline_github(self.synthetic, *middlewares).get_repo(self.synthetic.full_name)
+        return summarize_repository_graphql(repo, concurrency=2)
+
+    def summarize_with_fallback(self, status: int, data: dict):
+        with self.assertLogs('repository_stats.graphql_summary', 'ERROR'):
+            return self.summarize(_graphql_answer(status, data))
+
+    def test_matches_the_rest_summary(self):
+        self.assertEqual(self.summarize(), self.expected)
+        self.assertEqual(len(self.expected.sorted_contributors), len(self.synthetic.contributors))
+
+    def test_falls_back_to_rest_on_errors(self):
+        errors = {'errors': [{'type': 'RATE_LIMITED', 'message': 'API rate limit exceeded'}]}
+        self.assertEqual(self.summarize_with_fallback(200, errors), self.expected)
+
+    def test_falls_back_to_rest_on_partial_errors(self):
+        partial = {'data': {'repository': None}, 'errors': [{'message': 'Something went wrong'}, {'message': 'Again'}]}
+        self.assertEqual(self.summarize_with_fallback(200, partial), self.expected)
+
+    def test_falls_back_to_rest_on_a_null_repository(self):
+        self.assertEqual(self.summarize_with_fallback(200, {'data': {'repository': None}}), self.expected)
+
+    def test_falls_back_to_rest_on_server_errors(self):
+        self.assertEqual(self.summarize_with_fallback(502, {'message': 'Bad Gateway'}), self.expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import sqlite3
+import tempfile
+import time
+import unittest
+from contextlib import closing
+from pathlib import Path
+
+from repository_stats.http_cache import HttpCache, _cache_key
+from repository_stats.transport import HttpRequest, HttpResponse
+
+
+class _Server:
+    # answers with an etag per url, and with 304 to the matching conditional requests
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        etag = f'"{request.url}"'
+        if request.headers.get('If-None-Match') == etag:
+            return HttpResponse(status=304, headers={'etag': etag})
+        return HttpResponse(status=200, headers={'etag': etag}, body=f'body of {request.url}')
+
+
+class HttpCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_dir = Path(directory.name)
+        self.server = _Server()
+
+    def get(self, cache: HttpCache, url: str) -> HttpResponse:
+        return cache(HttpRequest(verb='GET', url=url), self.server)
+
+    def cached(self, cache: HttpCache, url: str):
+        return cache._get(_cache_key(HttpRequest(verb='GET', url=url)))
+
+    def accessed(self) -> dict:
+        # read through another connection, seeing only the committed access times
+        with closing(sqlite3.connect(self.cache_dir / 'http_cache.sqlite3')) as db:
+            return dict(db.execute('SELECT key, accessed FROM responses').fetchall())
+
+    def test_serves_the_cached_response_on_not_modified(self):
+        cache = HttpCache(self.cache_dir)
+        self.get(cache, 'http://fake-github/a')
+        response = self.get(cache, 'http://fake-github/a')
+        self.assertEqual((response.status, response.body), (200, 'body of http://fake-github/a'))
+
+    def test_does_not_write_the_access_times_of_single_reads(self):
+        cache = HttpCache(self.cache_dir)
+        self.get(cache, 'http://fake-github/a')
+        accessed = self.accessed()
+        self.get(cache, 'http://fake-github/a')
+        self.assertEqual(self.accessed(), accessed)
+
+    def test_writes_the_access_times_after_many_reads(self):
+        cache = HttpCache(self.cache_dir)
+        urls = [f'http://fake-github/{index}' for index in range(100)]
+        for url in urls:
+            self.get(cache, url)
+        accessed = self.accessed()
+        time.sleep(0.01)
+        for url in urls:
+            self.get(cache, url)
+        self.assertTrue(all(self.accessed()[key] > accessed[key] for key in accessed))
+
+    def test_evicts_the_least_recently_read_response(self):
+        cache = HttpCache(self.cache_dir, max_entries=2)
+        self.get(cache, 'http://fake-github/a')
+        self.get(cache, 'http://fake-github/b')
+        self.get(cache, 'http://fake-github/a')
+        self.get(cache, 'http://fake-github/c')
+        self.assertEqual(len(self.accessed()), 2)
+        self.assertIsNotNone(self.cached(cache, 'http://fake-github/a'))
+        self.assertIsNone(self.cached(cache, 'http://fake-github/b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import json
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from repository_stats.__main__ import _parse_arguments
+from repository_stats.live_summary import (
+    LiveSummaryStore, LiveSummaryUpdater, RepositoryEvent, apply_event, read_events, serve_webhooks
+)
+from repository_stats.synthetic import generate_repository
+from tests.offline import offline_github
+
+
+EVENTS = Path(__file__).parent / 'events'
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class LiveSummaryTest(unittest.TestCase):
+    def setUp(self):
+        self.synthetic = generate_repository(pull_requests=100, contributors=10, main_branch_commits=20)
+        self.directory = tempfile.TemporaryDirectory()
+        self.clock = _Clock()
+        self.updater = LiveSummaryUpdater(
+            offline_github(self.synthetic), LiveSummaryStore(Path(self.directory.name) / 'live.db'), clock=self.clock
+        )
+        self.reconciled = self.updater.reconcile(self.synthetic.full_name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_applies_recorded_webhooks_once(self):
+        self.assertEqual(self.updater.ingest(read_events(EVENTS / 'webhooks.ndjson')), 5)
+        self.assertEqual(self.updater.ingest(read_events(EVENTS / 'webhooks.ndjson')), 0)
+        summary = self.updater.summary(self.synthetic.full_name)
+        self.assertEqual(summary.stars, self.reconciled.stars + 1)
+        self.assertEqual(summary.forks, self.reconciled.forks + 1)
+        self.assertEqual(summary.num_open_pull_requests, self.reconciled.num_open_pull_requests + 2)
+        self.assertEqual(summary.releases, ['v2.0.0', *self.reconciled.releases[:2]])
+
+    def test_applies_a_recorded_feed_page(self):
+        self.assertEqual(self.updater.ingest(read_events(EVENTS / 'feed.json')), 5)
+        summary = self.updater.summary(self.synthetic.full_name)
+        self.assertEqual(summary.stars, self.reconciled.stars + 1)
+        self.assertEqual(summary.forks, self.reconciled.forks + 1)
+        self.assertEqual(summary.num_open_pull_requests, self.reconciled.num_open_pull_requests)
+        self.assertEqual(summary.releases, ['v2.0.0', *self.reconciled.releases[:2]])
+
+    def test_polls_the_events_since_the_cursor(self):
+        feed = json.loads((EVENTS / 'feed.json').read_text())
+        self.synthetic.events.extend(feed[3:])
+        self.updater.reconcile(self.synthetic.full_name)
+        self.synthetic.events[:0] = feed[:3]
+        self.assertEqual(self.updater.poll(self.synthetic.full_name), 3)
+        self.assertEqual(self.updater.poll(self.synthetic.full_name), 0)
+        # the star and the fork preceded the rescan, the pull request was opened and closed since
+        summary = self.updater.summary(self.synthetic.full_name)
+        self.assertEqual((summary.stars, summary.forks), (self.reconciled.stars, self.reconciled.forks))
+        self.assertEqual(summary.num_open_pull_requests, self.reconciled.num_open_pull_requests)
+        self.assertEqual(summary.releases, ['v2.0.0', *self.reconciled.releases[:2]])
+
+    def test_rescans_when_events_were_lost(self):
+        feed = json.loads((EVENTS / 'feed.json').read_text())
+        self.synthetic.events.extend(feed[4:])
+        self.updater.reconcile(self.synthetic.full_name)
+        # the feed no longer holds the cursor event
+        self.synthetic.events[:] = feed[:2]
+        with self.assertLogs('repository_stats.live_summary', 'WARNING'):
+            self.assertEqual(self.updater.poll(self.synthetic.full_name), 0)
+        self.assertEqual(self.updater.store.load(self.synthetic.full_name).cursor, feed[0]['id'])
+        self.assertEqual(self.updater.summary(self.synthetic.full_name), self.reconciled)
+
+    def test_ignores_a_release_event_without_a_tag(self):
+        event = RepositoryEvent(
+            id='1', repository=self.synthetic.full_name, name='release', action='published', payload={'release': None}
+        )
+        with self.assertLogs('repository_stats.live_summary', 'WARNING'):
+            self.assertEqual(apply_event(self.reconciled, event), self.reconciled)
+
+
+class WebhooksTest(unittest.TestCase):
+    def setUp(self):
+        self.synthetic = generate_repository(pull_requests=100, contributors=10, main_branch_commits=20)
+        self.directory = tempfile.TemporaryDirectory()
+        self.updater = LiveSummaryUpdater(
+            offline_github(self.synthetic), LiveSummaryStore(Path(self.directory.name) / 'live.db')
+        )
+        self.reconciled = self.updater.reconcile(self.synthetic.full_name)
+        self.server = serve_webhooks(self.updater, 0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def deliver(self, name: str, body: bytes) -> int:
+        request = Request(
+            f'http://127.0.0.1:{self.server.server_port}/webhook', data=body, method='POST',
+            headers={'X-GitHub-Event': name, 'X-GitHub-Delivery': 'delivery-1', 'Content-Type': 'application/json'}
+        )
+        try:
+            with urlopen(request, timeout=5) as response:
+                return response.status
+        except HTTPError as error:
+            return error.code
+
+    def test_applies_a_delivery(self):
+        body = json.dumps({'action': 'created', 'repository': {'full_name': self.synthetic.full_name}}).encode()
+        self.assertEqual(self.deliver('star', body), 202)
+        self.assertEqual(self.updater.summary(self.synthetic.full_name).stars, self.reconciled.stars + 1)
+
+    def test_rejects_malformed_deliveries(self):
+        for body in [b'{"action": ', b'42', b'{"repository": "synthetic/repository"}', b'{"repository": {}}']:
+            with self.subTest(body=body), self.assertLogs('repository_stats.live_summary', 'WARNING'):
+                self.assertEqual(self.deliver('star', body), 400)
+        self.assertEqual(self.updater.summary(self.synthetic.full_name), self.reconciled)
+
+
+class LiveArgumentsTest(unittest.TestCase):
+    def test_rejects_polling_along_the_webhooks(self):
+        argv = ['repository_stats', '--github-token=token', '--live-store=live.db', '--webhook-port=8080']
+        with patch.object(sys, 'argv', argv):
+            self.assertEqual(_parse_arguments().webhook_port, 8080)
+        with patch.object(sys, 'argv', [*argv, '--poll-events=60']), patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                _parse_arguments()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import pstats
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from repository_stats.profiling import DETERMINISTIC, profile_stage, start_profiling, stop_profiling
+
+
+def _pool_work(n: int) -> int:
+    return sum(range(n))
+
+
+class DeterministicProfilingTest(unittest.TestCase):
+    def test_profiles_a_stage_running_a_thread_pool(self):
+        with tempfile.TemporaryDirectory() as directory:
+            start_profiling(DETERMINISTIC, Path(directory), interval=0.001)
+            try:
+                with profile_stage('summary'):
+                    with ThreadPoolExecutor(max_workers=4) as executor:
+                        futures = [executor.submit(_pool_work, n) for n in range(100, 110)]
+                        results = [future.result(timeout=10) for future in futures]
+            finally:
+                stop_profiling()
+            self.assertEqual(results, [sum(range(n)) for n in range(100, 110)])
+            stats = pstats.Stats(str(Path(directory) / 'summary.pstats'))
+            self.assertIn('_pool_work', {function for _, _, function in stats.stats})
+            self.assertTrue((Path(directory) / 'summary.txt').exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+from attr import evolve
+from github import Github
+
+from repository_stats.fake_github import backend_middleware
+from repository_stats.pull_request_store import _MAX_SYNC_PASSES, PullRequestStore
+from repository_stats.repository_summary import count_pull_requests_by_author
+from repository_stats.synthetic import SyntheticBackend, SyntheticPullRequest, generate_repository
+from repository_stats.transport import HttpRequest, HttpResponse, Send, install_middlewares
+from tests.offline import OFFLINE_BASE_URL, offline_github
+
+
+class _Requests:
+    # counts the pull requests listings, and calls `on_updated_listing` after every listing by update date
+    def __init__(self, on_updated_listing=None) -> None:
+        self.listings = 0
+        self.updated_listings = 0
+        self.on_updated_listing = on_updated_listing
+
+    def __call__(self, request: HttpRequest, send: Send) -> HttpResponse:
+        response = send(request)
+        if not urlsplit(request.url).path.endswith('/pulls'):
+            return response
+        self.listings += 1
+        if dict(parse_qsl(urlsplit(request.url).query)).get('sort') == 'updated':
+            self.updated_listings += 1
+            if self.on_updated_listing is not None:
+                self.on_updated_listing(self.updated_listings)
+        return response
+
+
+class PullRequestStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.synthetic = generate_repository(pull_requests=1_000, contributors=30, main_branch_commits=20)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / 'pull_requests.db'
+        self.store = PullRequestStore(self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def repo(self, *middlewares):
+        # a new backend serves the current state of the synthetic repository
+        return offline_github(self.synthetic, *middlewares).get_repo(self.synthetic.full_name, lazy=True)
+
+    def backend_repo(self, backend: SyntheticBackend, *middlewares):
+        # the backend is reset by the tests to serve the updates made while listing
+        install_middlewares(*middlewares, backend_middleware(backend))
+        return Github(base_url=OFFLINE_BASE_URL, per_page=100, retry=None).get_repo(self.synthetic.full_name, lazy=True)
+
+    def update(self, index: int) -> SyntheticPullRequest:
+        pull_request = evolve(self.synthetic.pull_requests[index], updated_at=self.next_update())
+        self.synthetic.pull_requests[index] = pull_request
+        return pull_request
+
+    def next_update(self) -> datetime:
+        # the API dates are in seconds
+        return (max(pr.updated_at for pr in self.synthetic.pull_requests) + timedelta(hours=1)).replace(microsecond=0)
+
+    def stored_update(self, number: int) -> str:
+        with sqlite3.connect(self.path) as db:
+            return db.execute('SELECT updated_at FROM pull_requests WHERE number = ?', (number,)).fetchone()[0]
+
+    def test_first_sync_counts_all_the_pull_requests(self):
+        requests = _Requests()
+        self.assertEqual(self.store.sync(self.repo(requests)), 1_000)
+        self.assertEqual(requests.listings, 11)
+        self.assertEqual(
+            self.store.count_by_author(self.synthetic.full_name), count_pull_requests_by_author(self.repo())
+        )
+
+    def test_next_sync_makes_two_requests(self):
+        self.store.sync(self.repo())
+        cursor = self.store.cursor(self.synthetic.full_name)
+        requests = _Requests()
+        self.store.sync(self.repo(requests))
+        self.assertEqual(requests.listings, 2)
+        self.assertEqual(self.store.cursor(self.synthetic.full_name), cursor)
+
+    def test_counts_the_pull_requests_updated_or_created_between_syncs(self):
+        self.store.sync(self.repo())
+        updated = self.update(10)
+        updated_at = self.next_update()
+        created = evolve(
+            self.synthetic.pull_requests[20], number=1_001, author='newcomer', state='open',
+            created_at=updated_at, updated_at=updated_at, closed_at=None, merged_at=None,
+            merge_commit_sha=None, commit_shas=[]
+        )
+        self.synthetic.pull_requests.append(created)
+        self.store.sync(self.repo())
+        self.assertEqual(self.stored_update(updated.number), updated.updated_at.isoformat())
+        self.assertEqual(self.store.cursor(self.synthetic.full_name), created.updated_at)
+        counts = self.store.count_by_author(self.synthetic.full_name)
+        self.assertEqual(counts['newcomer'], 1)
+        self.assertEqual(counts, count_pull_requests_by_author(self.repo()))
+
+    def test_repeats_a_walk_during_which_a_pull_request_was_updated(self):
+        self.store.sync(self.repo())
+        updated = []
+        backend = SyntheticBackend(self.synthetic)
+
+        def update_during_the_first_walk(listing: int) -> None:
+            if listing == 1:
+                updated.append(self.update(500))
+                backend.__init__(self.synthetic)
+
+        requests = _Requests(update_during_the_first_walk)
+        repo = self.backend_repo(backend, requests)
+        self.store.sync(repo)
+        # a walk and a check of the newest update per pass
+        self.assertEqual(requests.updated_listings, 4)
+        self.assertEqual(self.stored_update(updated[0].number), updated[0].updated_at.isoformat())
+        self.assertEqual(self.store.cursor(self.synthetic.full_name), updated[0].updated_at)
+
+    def test_keeps_the_cursor_of_pull_requests_updated_during_every_walk(self):
+        self.store.sync(self.repo())
+        cursor = self.store.cursor(self.synthetic.full_name)
+        backend = SyntheticBackend(self.synthetic)
+
+        def update_during_every_walk(listing: int) -> None:
+            if listing % 2:
+                self.update(listing)
+                backend.__init__(self.synthetic)
+
+        requests = _Requests(update_during_every_walk)
+        repo = self.backend_repo(backend, requests)
+        with self.assertLogs('repository_stats.pull_request_store', 'WARNING'):
+            self.store.sync(repo)
+        self.assertEqual(requests.updated_listings, 2 * _MAX_SYNC_PASSES)
+        self.assertEqual(self.store.cursor(self.synthetic.full_name), cursor)
+
+
+if __name__ == '__main__':
+    unittest.main()
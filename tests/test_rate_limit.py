@@ -0,0 +1,52 @@
+import unittest
+from urllib.parse import urlsplit
+
+from github import GithubException
+
+from repository_stats.rate_limit import RateLimitScheduler
+from repository_stats.synthetic import generate_repository
+from repository_stats.transport import HttpRequest, HttpResponse, Send
+from tests.offline import offline_github
+
+
+class _FailingPath:
+    # fails the requests of a path with a 502 a given number of times
+    def __init__(self, path: str, failures: int) -> None:
+        self.path = path
+        self.failures = failures
+        self.requests = 0
+
+    def __call__(self, request: HttpRequest, send: Send) -> HttpResponse:
+        if urlsplit(request.url).path != self.path:
+            return send(request)
+        self.requests += 1
+        if self.requests <= self.failures:
+            return HttpResponse(status=502, headers={}, body='{"message": "Bad Gateway"}')
+        return send(request)
+
+
+class ServerErrorRetriesTest(unittest.TestCase):
+    def setUp(self):
+        self.synthetic = generate_repository(pull_requests=50, contributors=5, main_branch_commits=10)
+        self.scheduler = RateLimitScheduler(server_error_backoff=0.001)
+
+    def test_retries_a_transient_server_error(self):
+        failing = _FailingPath(f'/repos/{self.synthetic.full_name}/contributors', failures=1)
+        repo = offline_github(self.synthetic, self.scheduler, failing).get_repo(self.synthetic.full_name)
+        with self.assertLogs('repository_stats.rate_limit', 'WARNING'):
+            contributors = [contributor.login for contributor in repo.get_contributors()]
+        self.assertEqual(contributors, self.synthetic.contributors)
+        self.assertEqual(failing.requests, 2)
+        self.assertEqual(self.scheduler.state.throttled, 0)
+
+    def test_gives_up_after_the_server_error_retries(self):
+        failing = _FailingPath(f'/repos/{self.synthetic.full_name}', failures=10)
+        github = offline_github(self.synthetic, self.scheduler, failing)
+        with self.assertLogs('repository_stats.rate_limit', 'WARNING'), self.assertRaises(GithubException) as error:
+            github.get_repo(self.synthetic.full_name)
+        self.assertEqual(error.exception.status, 502)
+        self.assertEqual(failing.requests, self.scheduler.server_error_retries + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
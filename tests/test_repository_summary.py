@@ -0,0 +1,102 @@
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from repository_stats.repository_summary import (
+    count_pull_requests_by_author, rank_contributors, sort_contributors_by_prs, summarize_repository
+)
+from repository_stats.synthetic import generate_repository
+from repository_stats.transport import HttpRequest, HttpResponse, Send
+from tests.offline import offline_github
+
+
+class _CountingPullRequest:
+    # counts the reads of its author, the unit of work of both rankings
+    reads = 0
+
+    def __init__(self, login: str) -> None:
+        self._user = SimpleNamespace(login=login)
+
+    @property
+    def user(self) -> SimpleNamespace:
+        _CountingPullRequest.reads += 1
+        return self._user
+
+
+class _InFlight:
+    # tracks the peak number of requests in flight, each request taking a little while
+    def __init__(self) -> None:
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, request: HttpRequest, send: Send) -> HttpResponse:
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+        try:
+            time.sleep(0.01)
+            return send(request)
+        finally:
+            with self._lock:
+                self.current -= 1
+
+
+def _rank_by_scanning_per_contributor(contributors, pull_requests):
+    # the previous implementation, scanning all the pull requests once per contributor
+    contributions = {
+        contributor.login: [pr for pr in pull_requests if pr.user.login == contributor.login]
+        for contributor in contributors
+    }
+    return [login for login, prs in sorted(contributions.items(), key=lambda item: len(item[1]), reverse=True)]
+
+
+class RankContributorsTest(unittest.TestCase):
+    def test_matches_the_per_contributor_scan_on_a_synthetic_repository(self):
+        synthetic = generate_repository(pull_requests=3_000, contributors=200, main_branch_commits=50)
+        repo = offline_github(synthetic).get_repo(synthetic.full_name)
+        contributors = list(repo.get_contributors())
+        pull_requests = list(repo.get_pulls(state='all'))
+        self.assertEqual(
+            sort_contributors_by_prs(repo, contributors),
+            _rank_by_scanning_per_contributor(contributors, pull_requests)
+        )
+
+    def test_keeps_the_contributors_order_of_ties(self):
+        contributors = [SimpleNamespace(login=login) for login in ['d', 'a', 'c', 'b', 'e', 'f']]
+        pull_requests = [SimpleNamespace(user=SimpleNamespace(login=login)) for login in 'abcaebcfgg']
+        pull_requests_per_author = count_pull_requests_by_author(SimpleNamespace(
+            get_pulls=lambda state: pull_requests, requester=SimpleNamespace(per_page=100)
+        ))
+        ranking = rank_contributors(contributors, pull_requests_per_author)
+        self.assertEqual(ranking, ['a', 'c', 'b', 'e', 'f', 'd'])
+        self.assertEqual(ranking, _rank_by_scanning_per_contributor(contributors, pull_requests))
+
+    def test_reads_every_pull_request_once(self):
+        contributors = [SimpleNamespace(login=f'contributor-{i}') for i in range(100)]
+        pull_requests = [_CountingPullRequest(f'contributor-{i % 150}') for i in range(5_000)]
+        _CountingPullRequest.reads = 0
+        expected = _rank_by_scanning_per_contributor(contributors, pull_requests)
+        self.assertEqual(_CountingPullRequest.reads, len(contributors) * len(pull_requests))
+        _CountingPullRequest.reads = 0
+        pull_requests_per_author = count_pull_requests_by_author(SimpleNamespace(
+            get_pulls=lambda state: pull_requests, requester=SimpleNamespace(per_page=100)
+        ))
+        self.assertEqual(rank_contributors(contributors, pull_requests_per_author), expected)
+        # the user is read twice per pull request, to skip the pull requests of deleted users
+        self.assertEqual(_CountingPullRequest.reads, 2 * len(pull_requests))
+
+
+class SummarizeRepositoryTest(unittest.TestCase):
+    def test_bounds_the_requests_in_flight_by_the_concurrency(self):
+        synthetic = generate_repository(pull_requests=1_000, contributors=300, main_branch_commits=30)
+        in_flight = _InFlight()
+        repo = offline_github(synthetic, in_flight).get_repo(synthetic.full_name)
+        summary = summarize_repository(repo, concurrency=3)
+        self.assertEqual(summary.num_contributors, 300)
+        self.assertEqual(in_flight.peak, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
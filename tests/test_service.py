@@ -0,0 +1,158 @@
+import json
+import threading
+import time
+import unittest
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+from repository_stats.service import RepositoryService, UpstreamError, serve
+from repository_stats.synthetic import generate_repository
+from repository_stats.transport import HttpRequest, HttpResponse, Send
+from tests.offline import offline_github
+
+
+class _Requests:
+    # counts the requests per path, fails the requests of the failing paths, and holds the requests of the held paths
+    # until released
+    def __init__(self, *failing_paths: str) -> None:
+        self.paths = []
+        self.failing_paths = set(failing_paths)
+        self.held_paths = set()
+        self.released = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, request: HttpRequest, send: Send) -> HttpResponse:
+        path = urlsplit(request.url).path
+        with self._lock:
+            self.paths.append(path)
+        if path in self.held_paths:
+            self.released.wait(10)
+        if path in self.failing_paths:
+            return HttpResponse(status=502, headers={}, body='{"message": "Bad Gateway"}')
+        return send(request)
+
+
+class RepositoryServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.synthetic = generate_repository(pull_requests=200, contributors=20, main_branch_commits=30)
+
+    def test_missing_contributors_are_an_upstream_error(self):
+        requests = _Requests(f'/repos/{self.synthetic.full_name}/contributors')
+        service = RepositoryService(offline_github(self.synthetic, requests))
+        with self.assertLogs('repository_stats.repository_summary', 'ERROR'), self.assertRaises(UpstreamError):
+            service.summary(self.synthetic.full_name)
+        service.close()
+
+    def test_serves_missing_fields_as_bad_gateway(self):
+        requests = _Requests(f'/repos/{self.synthetic.full_name}/releases')
+        service = RepositoryService(offline_github(self.synthetic, requests))
+        server = serve(service, 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            with self.assertLogs('repository_stats.repository_summary', 'ERROR'), self.assertRaises(HTTPError) as error:
+                urlopen(f'http://127.0.0.1:{server.server_port}/repos/{self.synthetic.full_name}/summary')
+            self.assertEqual(error.exception.code, 502)
+            self.assertIn('releases', json.loads(error.exception.read())['error'])
+        finally:
+            server.shutdown()
+            server.server_close()
+            service.close()
+
+    def test_fetches_the_pull_request_of_a_branch_tree_once(self):
+        requests = _Requests()
+        service = RepositoryService(offline_github(self.synthetic, requests))
+        pull_request = self.synthetic.widest_pull_request()
+        tree = service.branch_tree(self.synthetic.full_name, pull_request.number)
+        self.assertEqual(tree.feature_branch, pull_request.head_ref)
+        self.assertEqual(requests.paths.count(f'/repos/{self.synthetic.full_name}/pulls/{pull_request.number}'), 1)
+        service.close()
+
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class StaleWhileRevalidateTest(unittest.TestCase):
+    def setUp(self):
+        self.synthetic = generate_repository(pull_requests=200, contributors=20, main_branch_commits=30)
+        self.repository_path = f'/repos/{self.synthetic.full_name}'
+        self.requests = _Requests()
+        self.clock = _Clock()
+        self.service = RepositoryService(offline_github(self.synthetic, self.requests), clock=self.clock)
+        self.summary = self.service.summary(self.synthetic.full_name)
+
+    def tearDown(self):
+        self.requests.released.set()
+        self.service.close()
+
+    def wait_for_the_refreshes(self):
+        for _ in range(1000):
+            if not self.service._refreshes:
+                return
+            time.sleep(0.01)
+        self.fail('The background refreshes did not complete.')
+
+    def test_serves_the_stale_fields_at_once(self):
+        self.requests.held_paths.add(self.repository_path)
+        self.clock.now = 61.0
+        server = serve(self.service, 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f'http://127.0.0.1:{server.server_port}/repos/{self.synthetic.full_name}/summary'
+            with urlopen(url, timeout=5) as response:
+                self.assertEqual(response.headers['X-Stale-Fields'], 'forks,stars,num_open_pull_requests')
+                self.assertEqual(json.loads(response.read())['stars'], self.summary.stars)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_shares_a_background_refresh_between_concurrent_callers(self):
+        self.requests.held_paths.add(self.repository_path)
+        self.clock.now = 61.0
+        callers = [
+            threading.Thread(target=self.service.summary, args=(self.synthetic.full_name,)) for _ in range(8)
+        ]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join(5)
+        self.requests.released.set()
+        self.wait_for_the_refreshes()
+        # the repository is fetched by the first summary and by a single refresh
+        self.assertEqual(self.requests.paths.count(self.repository_path), 2)
+        self.assertEqual(self.service.summary_with_stale_fields(self.synthetic.full_name), (self.summary, []))
+
+    def test_fetches_the_fields_past_their_staleness_bound_before_answering(self):
+        self.clock.now = 60.0 + 600.0
+        summary, stale_fields = self.service.summary_with_stale_fields(self.synthetic.full_name)
+        self.assertEqual((summary, stale_fields), (self.summary, []))
+        self.assertEqual(self.requests.paths.count(self.repository_path), 2)
+        self.assertEqual(self.requests.paths.count(f'{self.repository_path}/releases'), 1)
+
+    def test_keeps_the_stale_fields_when_their_refresh_fails(self):
+        releases_path = f'{self.repository_path}/releases'
+        self.requests.failing_paths.add(releases_path)
+        self.clock.now = 3600.0
+        with self.assertLogs('repository_stats.repository_summary', 'ERROR'):
+            summary, stale_fields = self.service.summary_with_stale_fields(self.synthetic.full_name)
+            self.wait_for_the_refreshes()
+        self.assertEqual(summary.releases, self.summary.releases)
+        self.assertIn('releases', stale_fields)
+        self.assertEqual(self.requests.paths.count(releases_path), 2)
+        # the failed refresh is retried by the next caller
+        self.requests.failing_paths.clear()
+        summary, stale_fields = self.service.summary_with_stale_fields(self.synthetic.full_name)
+        self.assertEqual(summary.releases, self.summary.releases)
+        self.assertIn('releases', stale_fields)
+        self.wait_for_the_refreshes()
+        self.assertEqual(self.service.summary_with_stale_fields(self.synthetic.full_name)[1], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from collections import Counter
+
+from repository_stats.branch_tree import BranchTree
+from repository_stats.repository_summary import sort_contributors_by_prs
+from repository_stats.synthetic import generate_repository
+from tests.offline import offline_github
+
+
+class SyntheticBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.synthetic = generate_repository(pull_requests=300, contributors=20, main_branch_commits=30)
+        self.repo = offline_github(self.synthetic).get_repo(self.synthetic.full_name)
+
+    def test_users_are_complete(self):
+        contributors = list(self.repo.get_contributors())
+        authors = {pr.user for pr in self.repo.get_pulls(state='all')}
+        self.assertEqual(len(set(contributors)), len(contributors))
+        self.assertTrue(authors <= set(contributors))
+
+    def test_sorts_the_contributors_by_pull_requests(self):
+        contributions = Counter(pr.author for pr in self.synthetic.pull_requests)
+        self.assertEqual(
+            sort_contributors_by_prs(self.repo, list(self.repo.get_contributors())),
+            sorted(self.synthetic.contributors, key=lambda login: contributions[login], reverse=True)
+        )
+
+    def test_merge_status(self):
+        merged = self.synthetic.widest_pull_request()
+        not_merged = next(pr for pr in self.synthetic.pull_requests if not pr.merged)
+        self.assertTrue(self.repo.get_pull(merged.number).is_merged())
+        self.assertFalse(self.repo.get_pull(not_merged.number).is_merged())
+
+    def test_builds_the_branch_tree_of_a_merged_pull_request(self):
+        merged = self.synthetic.widest_pull_request()
+        branch_tree = BranchTree.from_github_branch(self.repo, merged.head_ref, merged.number)
+        self.assertEqual([c.sha for c in branch_tree.feature_branch_commits], merged.commit_shas)
+        self.assertEqual(branch_tree.main_branch_commits[0].sha, merged.base_sha)
+        self.assertEqual(branch_tree.main_branch_commits[-1].sha, merged.merge_commit_sha)
+
+
+if __name__ == '__main__':
+    unittest.main()